@@ -1,22 +1,42 @@
+import math
+import os
+import time
+from datetime import datetime
 import streamlit as st
 from utils.logger import setup_logger
-from utils.session_state import save_card_states
+from utils.card_numbers import BULK_MAX_CARDS
+from utils.card_store import get_card_store
+
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "10"))
+BULK_SAMPLE_SIZE = 5
+
+def _sample(card_numbers: list) -> str:
+    sample = ", ".join(card_numbers[:BULK_SAMPLE_SIZE])
+    return sample + (", ..." if len(card_numbers) > BULK_SAMPLE_SIZE else "")
 
 class CardManagementAgent:
-    def __init__(self):
+    def __init__(self, session=None):
+        # Defaults to the Streamlit session; the async pipeline passes a plain snapshot of it
+        self.session = session if session is not None else st.session_state
         self.logger = setup_logger()
 
+    def _holds_copy(self) -> bool:
+        # Streamlit sessions keep their own copy of the card state and update it alongside the log;
+        # API sessions read the store's live state, which the store updates itself on append
+        return self.session.card_states is not get_card_store().card_states
+
     def activate_card(self, card_number: str) -> str:
         self.logger.debug(f"Attempting to activate card: {card_number}")
         if not card_number.isdigit() or len(card_number) != 9:
             self.logger.warning(f"Invalid card number for activation: {card_number}")
             return "❌ Invalid card number. Must be 9 digits."
-        if card_number in st.session_state.card_states and st.session_state.card_states[card_number] == "active":
+        if card_number in self.session.card_states and self.session.card_states[card_number] == "active":
             self.logger.info(f"Card {card_number} already activated")
             return f"⚠️ Card {card_number} is already activated."
-        st.session_state.card_states[card_number] = "active"
-        st.session_state.card_action_history.append((card_number, "activated"))
-        save_card_states()
+        if self._holds_copy():
+            self.session.card_states[card_number] = "active"
+            self.session.card_action_history.append(card_number, "activated")
+        get_card_store().record_action(card_number, "active", "activated")
         self.logger.info(f"Card {card_number} activated successfully")
         return f"✅ Card {card_number} has been activated."
 
@@ -25,28 +45,94 @@ class CardManagementAgent:
         if not card_number.isdigit() or len(card_number) != 9:
             self.logger.warning(f"Invalid card number for deactivation: {card_number}")
             return "❌ Invalid card number. Must be 9 digits."
-        if card_number in st.session_state.card_states and st.session_state.card_states[card_number] == "inactive":
+        if card_number in self.session.card_states and self.session.card_states[card_number] == "inactive":
             self.logger.info(f"Card {card_number} already deactivated")
             return f"⚠️ Card {card_number} is already deactivated."
-        st.session_state.card_states[card_number] = "inactive"
-        st.session_state.card_action_history.append((card_number, "deactivated"))
-        save_card_states()
+        if self._holds_copy():
+            self.session.card_states[card_number] = "inactive"
+            self.session.card_action_history.append(card_number, "deactivated")
+        get_card_store().record_action(card_number, "inactive", "deactivated")
         self.logger.info(f"Card {card_number} deactivated successfully")
         return f"🔒 Card {card_number} has been deactivated."
 
-    def query_card_status(self, action: str) -> str:
+    def _bulk_set_state(self, card_numbers: list, invalid: list, state: str, action: str, label: str) -> str:
+        self.logger.debug(f"Attempting bulk {action} of {len(card_numbers)} cards")
+        if len(card_numbers) > BULK_MAX_CARDS:
+            self.logger.warning(f"Bulk request for {len(card_numbers)} cards exceeds limit {BULK_MAX_CARDS}")
+            return f"❌ Too many cards in one request ({len(card_numbers)}). The limit is {BULK_MAX_CARDS}."
+        card_states = self.session.card_states
+        changed = [card_number for card_number in card_numbers if card_states.get(card_number) != state]
+        unchanged = len(card_numbers) - len(changed)
+        if changed:
+            # One batch record: a single persistence write, applied all-or-nothing on replay
+            timestamp = time.time()
+            holds_copy = self._holds_copy()
+            get_card_store().record_batch(changed, state, action, timestamp)
+            if holds_copy:
+                history = self.session.card_action_history
+                for card_number in changed:
+                    card_states[card_number] = state
+                    history.append(card_number, action, timestamp)
+
+        icon = "✅" if state == "active" else "🔒"
+        response = f"{icon} Bulk {label}: {len(changed)} cards {action}"
+        if unchanged:
+            response += f", {unchanged} already {action}"
+        if invalid:
+            response += f", {len(invalid)} invalid ({_sample(invalid)})"
+        self.logger.info(f"Bulk {action}: {len(changed)} changed, {unchanged} unchanged, {len(invalid)} invalid")
+        return response + "."
+
+    def bulk_activate(self, card_numbers: list, invalid: list = ()) -> str:
+        return self._bulk_set_state(card_numbers, list(invalid), "active", "activated", "activation")
+
+    def bulk_deactivate(self, card_numbers: list, invalid: list = ()) -> str:
+        return self._bulk_set_state(card_numbers, list(invalid), "inactive", "deactivated", "deactivation")
+
+    def bulk_status(self, card_numbers: list, invalid: list = ()) -> str:
+        self.logger.debug(f"Querying status for {len(card_numbers)} cards")
+        card_states = self.session.card_states
+        groups = {"active": [], "inactive": [], None: []}
+        for card_number in card_numbers:
+            groups[card_states.get(card_number)].append(card_number)
+        lines = [f"ℹ️ Status of {len(card_numbers)} cards:"]
+        for status, label in (("active", "active"), ("inactive", "inactive"), (None, "no recorded actions")):
+            if groups[status]:
+                lines.append(f"- {len(groups[status])} {label}: {_sample(groups[status])}")
+        if invalid:
+            lines.append(f"- {len(invalid)} invalid: {_sample(list(invalid))}")
+        self.logger.info(f"Bulk status: {len(groups['active'])} active, {len(groups['inactive'])} inactive, {len(groups[None])} unknown")
+        return "\n".join(lines)
+
+    def _format_entries(self, entries: list) -> str:
+        lines = []
+        for card_number, action, timestamp in entries:
+            when = "" if math.isnan(timestamp) else f" on {datetime.fromtimestamp(timestamp):%Y-%m-%d %H:%M}"
+            lines.append(f"- Card {card_number} was {action}{when}.")
+        return "\n".join(lines)
+
+    def _page(self, action, offset: int) -> str:
+        # Latest entries first; remember where we stopped so "show more" can continue
+        history = self.session.card_action_history
+        total = history.count(action)
+        entries = history.latest(action, limit=HISTORY_PAGE_SIZE, offset=offset)
+        shown = offset + len(entries)
+        response = self._format_entries(entries)
+        if shown < total:
+            self.session.history_cursor = {"action": action, "offset": shown}
+            response += f"\n\nShowing {offset + 1}-{shown} of {total}. Say \"show more\" to see older entries."
+        else:
+            self.session.history_cursor = None
+        return response
+
+    def query_card_status(self, action: str, offset: int = 0) -> str:
         self.logger.debug(f"Querying card status for action: {action}")
-        if not st.session_state.card_action_history:
-            self.logger.info(f"No cards have been {action} in this session")
-            return f"ℹ️ No cards have been {action} in this session."
-        filtered_actions = [(card_number, act) for card_number, act in st.session_state.card_action_history if act == action]
-        if not filtered_actions:
+        total = self.session.card_action_history.count(action)
+        if not total:
             self.logger.info(f"No cards found for action: {action}")
             return f"ℹ️ No cards have been {action} in this session."
-        response = f"ℹ️ Cards {action}:\n"
-        for card_number, _ in filtered_actions:
-            response += f"- Card {card_number} was {action}.\n"
-        self.logger.info(f"Queried {action} cards: {response.strip()}")
+        response = f"ℹ️ Cards {action} ({total} total):\n" + self._page(action, offset)
+        self.logger.info(f"Queried {action} cards: {total} total, offset {offset}")
         return response.strip()
 
     def query_specific_card_status(self, card_number: str) -> str:
@@ -54,43 +140,46 @@ class CardManagementAgent:
         if not card_number.isdigit() or len(card_number) != 9:
             self.logger.warning(f"Invalid card number for status query: {card_number}")
             return "❌ Invalid card number. Must be 9 digits."
-        if card_number not in st.session_state.card_states:
+        if card_number not in self.session.card_states:
             self.logger.info(f"No recorded actions for card {card_number}")
             return f"ℹ️ Card {card_number} has no recorded actions."
-        status = st.session_state.card_states[card_number]
+        status = self.session.card_states[card_number]
         self.logger.info(f"Card {card_number} status: {status}")
         return f"ℹ️ Card {card_number} is currently {status}."
 
-    def query_all_status(self) -> str:
+    def query_all_status(self, offset: int = 0) -> str:
         self.logger.debug("Querying all card statuses")
-        if not st.session_state.card_action_history:
+        history = self.session.card_action_history
+        if not history:
             self.logger.info("No cards have been activated or deactivated")
             return "ℹ️ No cards have been activated or deactivated."
-        
-        activated = [(card_number, act) for card_number, act in st.session_state.card_action_history if act == "activated"]
-        deactivated = [(card_number, act) for card_number, act in st.session_state.card_action_history if act == "deactivated"]
-        
-        response = ""
-        if activated:
-            response += "ℹ️ Cards activated:\n" + "\n".join(f"- Card {card_number} was activated." for card_number, _ in activated) + "\n\n"
-        else:
-            response += "ℹ️ No cards have been activated.\n\n"
-        
-        if deactivated:
-            response += "ℹ️ Cards deactivated:\n" + "\n".join(f"- Card {card_number} was deactivated." for card_number, _ in deactivated)
-        else:
-            response += "ℹ️ No cards have been deactivated."
-        
-        self.logger.info(f"All card statuses: {response.strip()}")
+
+        # Summarise with counts, then page through the most recent actions of either kind
+        activated = history.count("activated")
+        deactivated = history.count("deactivated")
+        response = (
+            f"ℹ️ {activated} activations and {deactivated} deactivations across {history.distinct_cards()} cards.\n\n"
+            f"Latest actions:\n" + self._page(None, offset)
+        )
+        self.logger.info(f"All card statuses: {activated} activated, {deactivated} deactivated, offset {offset}")
         return response.strip()
 
+    def show_more(self) -> str:
+        cursor = self.session.history_cursor
+        if not cursor:
+            return "ℹ️ There is nothing more to show."
+        if cursor["action"] is None:
+            return "ℹ️ Latest actions, continued:\n" + self._page(None, cursor["offset"])
+        return f"ℹ️ Cards {cursor['action']}, continued:\n" + self._page(cursor["action"], cursor["offset"])
+
     def reset_all_cards(self) -> str:
         self.logger.debug("Attempting to reset all card states")
-        if not st.session_state.card_states:
+        if not self.session.card_states:
             self.logger.info("No card states to reset")
             return "ℹ️ No cards to reset."
-        st.session_state.card_states.clear()
-        st.session_state.card_action_history.clear()
-        save_card_states()
+        if self._holds_copy():
+            self.session.card_states.clear()
+            self.session.card_action_history.clear()
+        get_card_store().record_reset()
         self.logger.info("All card states and action history reset successfully")
         return "✅ All card states have been reset."
\ No newline at end of file
@@ -1,15 +1,86 @@
+import asyncio
+import os
+from collections import namedtuple
+from functools import lru_cache
+import numpy as np
+from agents.intent_examples import INTENT_EXAMPLES, INTENT_RULES
+from utils.embedding_cache import encode_queries
 from utils.logger import setup_logger
+from utils.metrics import intent_centroid_confidence, intent_decisions, llm_tokens, span
+from utils.single_flight import was_coalesced
+
+INTENT_CONFIDENCE_THRESHOLD = float(os.getenv("INTENT_CONFIDENCE_THRESHOLD", "0.8"))
+CENTROID_TEMPERATURE = 0.05
+
+# tier is one of "rule", "centroid" or "llm"; confidence is in [0, 1]
+IntentDecision = namedtuple("IntentDecision", ["intent", "tier", "confidence"])
+
+@lru_cache(maxsize=4)
+def _intent_centroids(embedding_model):
+    labels = list(INTENT_EXAMPLES)
+    centroids = []
+    for label in labels:
+        vectors = np.asarray(embedding_model.encode(INTENT_EXAMPLES[label]), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        centroid = vectors.mean(axis=0)
+        centroids.append(centroid / np.linalg.norm(centroid))
+    return labels, np.stack(centroids)
 
 class IntentAgent:
-    def __init__(self, openai_client):
+    def __init__(self, openai_client, embedding_model=None, confidence_threshold: float = INTENT_CONFIDENCE_THRESHOLD):
         self.openai_client = openai_client
+        self.embedding_model = embedding_model
+        self.confidence_threshold = confidence_threshold
         self.logger = setup_logger()
 
+    def classify_by_rules(self, user_input: str):
+        for intent, pattern in INTENT_RULES:
+            if pattern.match(user_input):
+                return IntentDecision(intent, "rule", 1.0)
+        return None
+
+    def _classify_by_centroid(self, user_input: str):
+        # CPU-bound: run off the event loop
+        labels, centroids = _intent_centroids(self.embedding_model)
+        vector = np.asarray(encode_queries(self.embedding_model, [user_input])[0], dtype=np.float32)
+        similarities = centroids @ (vector / np.linalg.norm(vector))
+        weights = np.exp((similarities - similarities.max()) / CENTROID_TEMPERATURE)
+        probabilities = weights / weights.sum()
+        best = int(np.argmax(probabilities))
+        return IntentDecision(labels[best], "centroid", float(probabilities[best]))
+
+    def _record(self, decision: IntentDecision) -> str:
+        # One agent serves every session: the decision goes to the logs and process-wide metrics, never onto the agent
+        intent_decisions.inc(tier=decision.tier, intent=decision.intent)
+        self.logger.info(f"Classified intent: {decision.intent} (tier={decision.tier}, confidence={decision.confidence:.3f})")
+        return decision.intent
+
     async def classify_intent(self, user_input: str, chat_history: list) -> str:
         self.logger.debug(f"Classifying intent for input: {user_input}")
-        context = ""
-        for role, message in chat_history[-4:]:
-            context += f"{role}: {message}\n"
+        with span("intent.rules"):
+            decision = self.classify_by_rules(user_input)
+        if decision:
+            return self._record(decision)
+
+        # Replies to a clarifying question depend on context, leave those to the LLM
+        awaiting_reply = bool(chat_history) and chat_history[-1][0] == "assistant" and chat_history[-1][1].startswith("❓")
+        if self.embedding_model is not None and not awaiting_reply:
+            try:
+                loop = asyncio.get_running_loop()
+                with span("intent.centroid"):
+                    decision = await loop.run_in_executor(None, self._classify_by_centroid, user_input)
+                accepted = decision.confidence >= self.confidence_threshold
+                intent_centroid_confidence.observe(decision.confidence, outcome="accepted" if accepted else "escalated")
+                if accepted:
+                    return self._record(decision)
+                self.logger.debug(
+                    f"Centroid tier below threshold: {decision.intent} ({decision.confidence:.3f} < {self.confidence_threshold}), escalating to LLM"
+                )
+            except Exception as e:
+                self.logger.warning(f"Centroid intent tier failed, escalating to LLM: {e}")
+
+        # Precomputed by the history on append: the last few messages, each capped in length
+        context = chat_history.context
 
         system_prompt = """
 You are an intent classifier for a card management chatbot. Classify the user's intent into one of these:
@@ -30,16 +101,19 @@ Consider the conversation context to determine if the user is responding to a pr
 Return only the intent word.
 """
         try:
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Context:\n{context}\nCurrent input: {user_input}"}
-                ]
-            )
+            with span("intent.llm"):
+                response = await self.openai_client.chat.completions.create(
+                    model="gpt-4",
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": f"Context:\n{context}\nCurrent input: {user_input}"}
+                    ]
+                )
+            if response.usage is not None and not was_coalesced():
+                llm_tokens.inc(response.usage.prompt_tokens, caller="intent", kind="prompt")
+                llm_tokens.inc(response.usage.completion_tokens, caller="intent", kind="completion")
             intent = response.choices[0].message.content.strip().lower()
-            self.logger.info(f"Classified intent: {intent}")
-            return intent
+            return self._record(IntentDecision(intent, "llm", 1.0))
         except Exception as e:
             self.logger.error(f"Error classifying intent: {e}")
             raise
\ No newline at end of file
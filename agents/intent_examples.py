@@ -0,0 +1,102 @@
+import re
+
+CARD_NUMBER = r"(?:card\s*(?:number\s*)?)?#?\d{9}"
+
+# Deterministic first tier: only unambiguous, self-contained phrasings belong here
+INTENT_RULES = [
+    ("end", re.compile(
+        r"^\s*(ok(ay)?[,\s]+)?(thanks?|thank\s+you|thx|ty|bye|goodbye|good\s*bye|end|exit|quit|that'?s\s+all)"
+        r"(\s+(so|very)\s+much|\s+a\s+lot)?[\s.!]*$", re.IGNORECASE)),
+    ("reset_cards", re.compile(
+        r"^\s*(please\s+)?(reset|clear|wipe)\s+(all\s+)?(the\s+|my\s+)?cards?(\s+states?)?[\s.!]*$", re.IGNORECASE)),
+    ("activate", re.compile(
+        rf"^\s*(please\s+)?(activate|enable|unfreeze|unblock)\s+(my\s+|the\s+)?{CARD_NUMBER}[\s.!]*$", re.IGNORECASE)),
+    ("deactivate", re.compile(
+        rf"^\s*(please\s+)?(deactivate|disable|freeze|block|lock)\s+(my\s+|the\s+)?{CARD_NUMBER}[\s.!]*$", re.IGNORECASE)),
+    ("query_status", re.compile(
+        rf"^\s*(what('?s|\s+is)\s+the\s+)?status\s+(of\s+)?(my\s+|the\s+)?{CARD_NUMBER}\s*\??\s*$"
+        rf"|^\s*is\s+(my\s+|the\s+)?{CARD_NUMBER}\s+(active|activated|inactive|deactivated)\s*\??\s*$", re.IGNORECASE)),
+    ("query_all_status", re.compile(
+        r"^\s*(show|list|what\s+(is|are))\s+(me\s+)?(the\s+)?(status(es)?\s+of\s+)?all\s+(my\s+|the\s+)?cards?"
+        r"(\s+status(es)?)?\s*\??\s*$", re.IGNORECASE)),
+    ("query_activated", re.compile(
+        r"^\s*(which|what|list|show(\s+me)?)\s+(the\s+)?cards?\s+(are|were|have\s+been)\s+activated\s*\??\s*$", re.IGNORECASE)),
+    ("query_deactivated", re.compile(
+        r"^\s*(which|what|list|show(\s+me)?)\s+(the\s+)?cards?\s+(are|were|have\s+been)\s+deactivated\s*\??\s*$", re.IGNORECASE)),
+]
+
+# Labelled examples for the nearest-centroid tier, embedded with the knowledge base model
+INTENT_EXAMPLES = {
+    "activate": [
+        "Activate card 123456789",
+        "Please activate my card 987654321",
+        "I want to activate a card",
+        "Turn on card 555666777",
+        "Can you enable my card 111222333?",
+        "Unfreeze card 444555666",
+        "I need my card activated",
+    ],
+    "deactivate": [
+        "Deactivate card 123456789",
+        "Please deactivate my card 987654321",
+        "I want to deactivate a card",
+        "Freeze card 555666777",
+        "Block my card 111222333, I lost it",
+        "Turn off card 444555666",
+        "I need my card disabled",
+    ],
+    "query_activated": [
+        "Which cards are activated?",
+        "Show me the activated cards",
+        "List all the cards I activated",
+        "What cards have been activated so far?",
+        "Which cards did I activate in this session?",
+    ],
+    "query_deactivated": [
+        "Which cards are deactivated?",
+        "Show me the deactivated cards",
+        "List all the cards I deactivated",
+        "What cards have been deactivated so far?",
+        "Which cards did I freeze in this session?",
+    ],
+    "query_status": [
+        "What is the status of card 123456789?",
+        "Is card 987654321 active?",
+        "Check the status of my card 555666777",
+        "Is my card 111222333 deactivated?",
+        "Tell me whether card 444555666 is active",
+    ],
+    "query_all_status": [
+        "Show the status of all cards",
+        "What is the status of all my cards?",
+        "List every activated and deactivated card",
+        "Give me an overview of all card statuses",
+        "Show all cards and their status",
+    ],
+    "knowledge": [
+        "How do I change my PIN?",
+        "How do I activate my card online?",
+        "What should I do if my card is lost or stolen?",
+        "How do I report a fraudulent transaction?",
+        "What are the fees for international withdrawals?",
+        "How can I increase my card limit?",
+        "How long does a new card take to arrive?",
+        "Can I use my card abroad?",
+        "How do I set up alerts for my card?",
+    ],
+    "end": [
+        "Thanks",
+        "Thank you, that's all",
+        "Great, bye",
+        "End the conversation",
+        "That's all I needed",
+        "Goodbye",
+    ],
+    "reset_cards": [
+        "Reset all cards",
+        "Clear all card states",
+        "Reset every card",
+        "Start over and reset the cards",
+        "Wipe all card statuses",
+    ],
+}
@@ -1,29 +1,118 @@
+import asyncio
+import time
+from utils.answer_cache import get_answer_cache
+from utils.context_builder import CONTEXT_SCORE_RATIO, RETRIEVAL_CANDIDATES, ContextSelection, count_tokens, select_context
+from utils.embedding_cache import encode_queries
+from utils.hybrid_retrieval import BM25_CANDIDATES, FUSED_SCORE_RATIO, RETRIEVAL_MODE, load_reranker, reciprocal_rank_fusion
 from utils.logger import setup_logger
+from utils.metrics import cache_requests, llm_tokens, observe_stage, span
+from utils.single_flight import was_coalesced
+from utils.upstream import priority
 
 class KnowledgeAgent:
-    def __init__(self, embedding_model, chunks, search_client, openai_client):
+    def __init__(self, embedding_model, chunks, search_client, openai_client, answer_cache=None, lexical_index=None,
+                 retrieval_mode: str = RETRIEVAL_MODE, reranker=None):
         self.embedding_model = embedding_model
         self.chunks = chunks
         self.search_client = search_client
         self.openai_client = openai_client
+        self.answer_cache = answer_cache if answer_cache is not None else get_answer_cache()
+        # BM25 over the same chunk list, positions aligned with self.chunks
+        self.lexical_index = lexical_index
+        self.retrieval_mode = retrieval_mode if lexical_index is not None else "vector"
+        self.reranker = reranker if reranker is not None else load_reranker()
+        # Running totals across all sessions, for per-query cost tracking
+        self.usage = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
         self.logger = setup_logger()
 
-    def search_knowledge_base(self, query: str) -> str:
-        self.logger.debug(f"Searching knowledge base for query: {query}")
-        try:
-            query_vector = self.embedding_model.encode([query]).tolist()[0]
-            results = self.search_client.search(
+    async def embed_query(self, query: str) -> list:
+        # Encoding is CPU-bound: keep it off the event loop
+        loop = asyncio.get_running_loop()
+        with span("embed"):
+            vectors = await loop.run_in_executor(None, encode_queries, self.embedding_model, [query])
+        return vectors.tolist()[0]
+
+    async def vector_search(self, query_vector: list) -> list:
+        with span("search"):
+            results = await self.search_client.search(
                 search_text="*",
                 vector_queries=[{
                     "kind": "vector",
                     "vector": query_vector,
-                    "k": 3,
+                    "k": RETRIEVAL_CANDIDATES,
                     "fields": "embedding"
                 }],
-                top=3
+                top=RETRIEVAL_CANDIDATES
             )
-            retrieved_text = "\n\n".join([result["content"] for result in results])
-            self.logger.debug(f"Retrieved knowledge base text: {retrieved_text[:100]}...")
+            return [(result["content"], result["@search.score"]) async for result in results]
+
+    async def lexical_search(self, query: str) -> list:
+        loop = asyncio.get_running_loop()
+        with span("search.bm25"):
+            hits = await loop.run_in_executor(None, self.lexical_index.search, query, BM25_CANDIDATES)
+        return [(self.chunks[position], score) for position, score in hits]
+
+    async def retrieve_context(self, query: str, query_vector: list) -> ContextSelection:
+        # hits are (content, score) best first
+        if self.retrieval_mode == "hybrid":
+            vector_hits, lexical_hits = await asyncio.gather(self.vector_search(query_vector), self.lexical_search(query))
+            with span("fusion"):
+                hits = reciprocal_rank_fusion([[content for content, _ in vector_hits], [content for content, _ in lexical_hits]])
+        elif self.retrieval_mode == "lexical":
+            hits = await self.lexical_search(query)
+        else:
+            hits = await self.vector_search(query_vector)
+        if not hits:
+            return select_context(hits, [])
+        loop = asyncio.get_running_loop()
+        # Chunk embeddings come from the embedding cache, so near-duplicate detection and reranking are cheap
+        vectors = await loop.run_in_executor(None, self.embedding_model.encode, [content for content, _ in hits])
+        score_ratio = CONTEXT_SCORE_RATIO if self.retrieval_mode == "vector" else FUSED_SCORE_RATIO
+        if self.reranker is not None:
+            with span("rerank"):
+                reranked = await loop.run_in_executor(
+                    None, self.reranker.rerank, query, query_vector, [content for content, _ in hits], vectors
+                )
+            order = {content: i for i, (content, _) in enumerate(hits)}
+            vectors = [vectors[order[content]] for content, _ in reranked]
+            hits, score_ratio = reranked, FUSED_SCORE_RATIO
+        with span("context"):
+            context = select_context(hits, vectors, score_ratio=score_ratio)
+        self.logger.info(
+            f"Selected {len(context.chunks)} of {context.candidates} chunks, {context.tokens} context tokens, "
+            f"{context.duplicates} near-duplicates dropped"
+        )
+        self.logger.debug(f"Retrieved knowledge base text: {context.text[:100]}...")
+        return context
+
+    async def retrieve(self, query: str, query_vector: list) -> str:
+        return (await self.retrieve_context(query, query_vector)).text
+
+    async def prepare(self, query: str):
+        # Everything before generation; safe to run speculatively. The answer cache lookup is counted by
+        # the caller that uses the result, so discarded speculations do not skew the hit rate
+        query_vector = await self.embed_query(query)
+        cached_answer = self.answer_cache.get(query_vector, query, count=False)
+        if cached_answer is not None:
+            return query_vector, cached_answer, None
+        return query_vector, None, await self.retrieve(query, query_vector)
+
+    async def stream_knowledge_base(self, query: str, prepared=None):
+        self.logger.debug(f"Searching knowledge base for query: {query}")
+        try:
+            prepared_result = None
+            if prepared is not None:
+                try:
+                    prepared_result = await prepared
+                except Exception as e:
+                    self.logger.warning(f"Speculative retrieval failed, retrying inline: {e}")
+            query_vector, cached_answer, retrieved_text = prepared_result or await self.prepare(query)
+            self.answer_cache.record(cached_answer is not None)
+            cache_requests.inc(cache="answer", result="miss" if cached_answer is None else "hit")
+            if cached_answer is not None:
+                self.logger.info(f"Knowledge base response served from answer cache for query: {query}")
+                yield cached_answer
+                return
 
             prompt = f"""
 Answer the question using only the information below.
@@ -36,13 +125,57 @@ Answer the question using only the information below.
 
 ### Answer:
 """
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4",
-                messages=[{"role": "user", "content": prompt}]
-            )
-            result = response.choices[0].message.content.strip()
-            self.logger.info(f"Knowledge base response: {result}")
-            return result
+            started = time.perf_counter()
+            first_token = None
+            usage = None
+            parts = []
+            with span("generate"):
+                # Long generations queue behind intent classification when the upstream is saturated
+                with priority("generation"):
+                    stream = await self.openai_client.chat.completions.create(
+                        model="gpt-4",
+                        messages=[{"role": "user", "content": prompt}],
+                        stream=True,
+                        stream_options={"include_usage": True}
+                    )
+                # A coalesced stream is another session's request: its tokens and answer are accounted for there
+                coalesced = was_coalesced()
+                async for chunk in stream:
+                    # With include_usage the final chunk has no choices, only token counts
+                    if chunk.usage is not None:
+                        usage = chunk.usage
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if first_token is None:
+                            first_token = time.perf_counter() - started
+                            observe_stage("generate.first_token", first_token)
+                        parts.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+            result = "".join(parts).strip()
+            if not coalesced:
+                self._record_usage(prompt, result, usage, first_token, time.perf_counter() - started)
+                self.answer_cache.put(query, query_vector, result)
+            self.logger.info(f"Knowledge base response: {len(result)} chars")
+            self.logger.debug(f"Knowledge base response: {result}")
         except Exception as e:
             self.logger.error(f"Error in knowledge base search: {e}")
-            raise
\ No newline at end of file
+            raise
+
+    def _record_usage(self, prompt: str, answer: str, usage, first_token: float, elapsed: float):
+        if usage is not None:
+            prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+        else:
+            # Endpoints that ignore stream_options: fall back to local counts
+            prompt_tokens, completion_tokens = count_tokens(prompt), count_tokens(answer)
+        self.usage["calls"] += 1
+        self.usage["prompt_tokens"] += prompt_tokens
+        self.usage["completion_tokens"] += completion_tokens
+        llm_tokens.inc(prompt_tokens, caller="knowledge", kind="prompt")
+        llm_tokens.inc(completion_tokens, caller="knowledge", kind="completion")
+        self.logger.info(
+            f"Knowledge base completion: {prompt_tokens} prompt tokens, {completion_tokens} completion tokens, "
+            f"first token after {first_token or 0:.2f}s, {elapsed:.2f}s total"
+        )
+
+    async def search_knowledge_base(self, query: str) -> str:
+        parts = [token async for token in self.stream_knowledge_base(query)]
+        return "".join(parts).strip()
@@ -0,0 +1,151 @@
+import asyncio
+import re
+import time
+from utils.card_numbers import extract_card_numbers
+from utils.logger import new_correlation_id, setup_logger
+from utils.metrics import bind_turn, finish_turn, span, start_turn
+from utils.session_state import save_card_states
+from utils.speculation import SPECULATIVE_RETRIEVAL, Speculation, speculation_stats
+
+CARD_INTENTS = {
+    "query_activated", "query_deactivated", "query_status", "query_all_status", "activate", "deactivate",
+    "show_more", "reset_cards",
+}
+
+def _is_bulk(card_numbers: list, invalid: list) -> bool:
+    # Several card numbers, or a range that could not be expanded, make a bulk request; a stray shorter
+    # number next to one card number (an order id, an amount) does not
+    return len(card_numbers) > 1 or any("-" in token for token in invalid)
+
+def _card_turn(intent: str, user_input: str, card_agent) -> str:
+    logger = setup_logger()
+    if intent == "query_activated":
+        result = card_agent.query_card_status("activated")
+        logger.info("Queried activated cards")
+        logger.debug(f"Activated cards response: {result}")
+    elif intent == "query_deactivated":
+        result = card_agent.query_card_status("deactivated")
+        logger.info("Queried deactivated cards")
+        logger.debug(f"Deactivated cards response: {result}")
+    elif intent == "query_status":
+        card_numbers, invalid = extract_card_numbers(user_input)
+        if _is_bulk(card_numbers, invalid):
+            result = card_agent.bulk_status(card_numbers, invalid)
+            logger.info(f"Queried status for {len(card_numbers)} cards")
+        elif card_numbers:
+            card_number = card_numbers[0]
+            result = card_agent.query_specific_card_status(card_number)
+            logger.info(f"Queried status for card {card_number}: {result}")
+        else:
+            result = "❓ Please provide a valid 9-digit card number to check its status."
+            logger.warning("Invalid card number for status query")
+    elif intent == "query_all_status":
+        result = card_agent.query_all_status()
+        logger.info("Queried all card statuses")
+        logger.debug(f"All card statuses response: {result}")
+    elif intent in ["activate", "deactivate"]:
+        # Lists, ranges and multiple card numbers go through one batched transaction
+        card_numbers, invalid = extract_card_numbers(user_input)
+        if _is_bulk(card_numbers, invalid):
+            result = card_agent.bulk_activate(card_numbers, invalid) if intent == "activate" else card_agent.bulk_deactivate(card_numbers, invalid)
+            logger.info(f"Performed bulk {intent} on {len(card_numbers)} cards")
+        elif card_numbers:
+            card_number = card_numbers[0]
+            result = card_agent.activate_card(card_number) if intent == "activate" else card_agent.deactivate_card(card_number)
+            logger.info(f"Performed {intent} on card {card_number}: {result}")
+        else:
+            action = "activate" if intent == "activate" else "deactivate"
+            result = f"❓ Please provide a valid 9-digit card number to {action} the card."
+            logger.warning(f"No valid card number provided for {action}")
+    elif intent == "show_more":
+        result = card_agent.show_more()
+        logger.info("Showed more card history")
+    else:
+        result = card_agent.reset_all_cards()
+        logger.info(f"Reset all cards: {result}")
+    return result
+
+# Handles one chat turn. Runs on an event loop off the Streamlit script thread, so it only touches
+# the session snapshot and the shared services container
+async def handle_user_input(user_input: str, session, services):
+    logger = setup_logger()
+    correlation_id = new_correlation_id()
+    logger.info(f"Received user input: {user_input}")
+    started = time.perf_counter()
+    timings = start_turn()
+    session.turn_timings = timings
+    intent_agent = services.intent_agent
+    card_agent = services.card_agent(session)
+    knowledge_agent = services.knowledge_agent
+
+    # Check if input is a 9-digit number and last intent was activate/deactivate
+    speculation = None
+    if re.match(r'^\d{9}$', user_input) and session.last_intent in ["activate", "deactivate"]:
+        intent = session.last_intent
+        logger.debug(f"Using previous intent: {intent} for card number input")
+    elif session.history_cursor and re.match(r'^\s*(show|see|load)\s+more\b', user_input, re.IGNORECASE):
+        intent = "show_more"
+        logger.debug("Continuing paginated card history")
+    else:
+        # Most traffic is knowledge questions: optionally embed and retrieve while the intent is classified,
+        # unless a deterministic rule already settles it
+        if SPECULATIVE_RETRIEVAL and knowledge_agent is not None and intent_agent.classify_by_rules(user_input) is None:
+            speculation = Speculation(knowledge_agent.prepare(user_input))
+        try:
+            with span("intent"):
+                intent = await intent_agent.classify_intent(user_input, session.chat_history)
+        except BaseException:
+            # Failed or cancelled classification: stop the speculative work and count it as a miss
+            if speculation is not None:
+                speculation.discard()
+            raise
+        logger.debug(f"Classified intent: {intent}")
+
+    prepared = None
+    if speculation is not None:
+        if intent == "knowledge":
+            prepared, saved = speculation.commit()
+            logger.debug(f"Speculative retrieval hit, saved {saved * 1000:.0f} ms (hit rate {speculation_stats.hit_rate:.0%})")
+        else:
+            speculation.discard()
+            logger.debug(f"Speculative retrieval discarded for intent {intent} (hit rate {speculation_stats.hit_rate:.0%})")
+
+    session.last_intent = intent
+    if intent != "show_more":
+        session.history_cursor = None
+
+    with span("dispatch"):
+        if intent == "end":
+            session.end_conversation = True
+            session.last_intent = None
+            await asyncio.to_thread(save_card_states)  # Save card states before ending session
+            result = "✅ Session ended. You can start a new conversation!"
+            logger.info("Conversation ended by user")
+        elif intent in CARD_INTENTS:
+            # Card writes take the store's file lock and may fsync, and bulk requests cover up to BULK_MAX_CARDS
+            # cards: run them off the shared event loop so other sessions keep streaming
+            result = await asyncio.to_thread(_card_turn, intent, user_input, card_agent)
+        elif intent == "knowledge":
+            try:
+                knowledge_agent = await services.wait_for_knowledge()
+            except Exception as e:
+                knowledge_agent = None
+                logger.error(f"Knowledge base warm-up failed: {e}")
+            if services.knowledge_future.done() and knowledge_agent is None:
+                result = "❌ The knowledge base is unavailable right now. Please try again later."
+            elif knowledge_agent is None:
+                result = "⏳ The knowledge base is still warming up. Please ask again in a few seconds."
+                logger.info("Knowledge query arrived before the knowledge base was ready")
+            else:
+                # Returned as a token stream, rendered incrementally by the caller
+                result = knowledge_agent.stream_knowledge_base(user_input, prepared)
+                logger.info(f"Knowledge base query: {user_input}, streaming response")
+        else:
+            result = "❓ Your question is unclear. Please provide a valid query."
+            logger.warning(f"Unclear user query: {user_input}")
+
+    if isinstance(result, str):
+        finish_turn(timings, intent, started)
+    else:
+        result = bind_turn(result, timings, intent, started, correlation_id)
+    return intent, result
@@ -0,0 +1,246 @@
+import asyncio
+import json
+import os
+import threading
+from contextlib import asynccontextmanager
+from aiohttp import web
+from agents.orchestrator import handle_user_input
+from utils.async_runtime import run_async
+from utils.card_numbers import extract_card_numbers, parse_card_csv
+from utils.card_store import get_card_store
+from utils.logger import setup_logger
+from utils.metrics import render_prometheus
+from utils.services import get_services
+from utils.session_store import create_session_store, session_from_state, state_from_session
+
+API_HOST = os.getenv("API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("API_PORT", "8080"))
+
+class ChatApi:
+    # Headless HTTP/WebSocket front end for the same turn pipeline the Streamlit UI uses
+    def __init__(self, services, session_store):
+        self.services = services
+        self.sessions = session_store
+        self.logger = setup_logger()
+        # Turns of one session are serialised within a worker: session id -> [lock, holders and waiters]
+        self._locks = {}
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/sessions", self.create_session)
+        app.router.add_get("/v1/sessions/{session_id}", self.get_session)
+        app.router.add_delete("/v1/sessions/{session_id}", self.delete_session)
+        app.router.add_post("/v1/sessions/{session_id}/messages", self.post_message)
+        app.router.add_post("/v1/sessions/{session_id}/bulk", self.post_bulk)
+        app.router.add_get("/v1/sessions/{session_id}/ws", self.websocket)
+        app.router.add_get("/healthz", self.healthz)
+        # Per worker: each process keeps its own counters
+        app.router.add_get("/metrics", self.metrics)
+        return app
+
+    @asynccontextmanager
+    async def _lock(self, session_id: str):
+        # The entry is dropped once nobody holds or waits for it; counting users rather than checking
+        # locked() keeps a request arriving just after a release from getting a second lock
+        entry = self._locks.get(session_id)
+        if entry is None:
+            entry = self._locks[session_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and self._locks.get(session_id) is entry:
+                del self._locks[session_id]
+
+    async def _load(self, session_id: str) -> dict:
+        state = await self.sessions.load(session_id)
+        if state is None:
+            raise web.HTTPNotFound(text=json.dumps({"error": "Unknown or expired session"}), content_type="application/json")
+        # Pick up card changes made by other workers since this one last looked
+        await asyncio.get_running_loop().run_in_executor(None, get_card_store().refresh)
+        return state
+
+    async def _json_body(self, request) -> dict:
+        try:
+            body = await request.json()
+        except (ValueError, UnicodeDecodeError):
+            raise web.HTTPBadRequest(text=json.dumps({"error": "Request body must be JSON"}), content_type="application/json")
+        if not isinstance(body, dict):
+            raise web.HTTPBadRequest(text=json.dumps({"error": "Request body must be a JSON object"}), content_type="application/json")
+        return body
+
+    async def _turn(self, session_id: str, message: str):
+        # Yields ("token", text) for streamed answers, then ("done", payload)
+        async with self._lock(session_id):
+            state = await self._load(session_id)
+            session = session_from_state(state)
+            intent, result = await handle_user_input(message, session, self.services)
+            if isinstance(result, str):
+                response = result
+            else:
+                parts = []
+                async for token in result:
+                    parts.append(token)
+                    yield "token", token
+                response = "".join(parts).strip()
+            session.chat_history.append(("user", message))
+            session.chat_history.append(("assistant", response))
+            await self.sessions.save(session_id, state_from_session(session))
+            yield "done", {
+                "intent": intent,
+                "response": response,
+                "end_conversation": session.end_conversation,
+                "timings": session.turn_timings,
+            }
+
+    async def create_session(self, request):
+        session_id = await self.sessions.create()
+        return web.json_response({"session_id": session_id}, status=201)
+
+    async def get_session(self, request):
+        state = await self._load(request.match_info["session_id"])
+        return web.json_response(state)
+
+    async def delete_session(self, request):
+        if not await self.sessions.delete(request.match_info["session_id"]):
+            raise web.HTTPNotFound(text=json.dumps({"error": "Unknown session"}), content_type="application/json")
+        return web.Response(status=204)
+
+    async def post_message(self, request):
+        session_id = request.match_info["session_id"]
+        body = await self._json_body(request)
+        message = str(body.get("message", "")).strip()
+        if not message:
+            raise web.HTTPBadRequest(text=json.dumps({"error": "message is required"}), content_type="application/json")
+
+        if not body.get("stream"):
+            turn = self._turn(session_id, message)
+            try:
+                async for event, data in turn:
+                    if event == "done":
+                        return web.json_response(data)
+            except web.HTTPException:
+                raise
+            except Exception as e:
+                self.logger.error(f"API turn failed: {e}")
+                return web.json_response({"error": str(e)}, status=500)
+            finally:
+                # Releases the session lock now rather than when the generator is collected
+                await turn.aclose()
+
+        # Server-sent events: "token" events while the answer streams, then one "done" event
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        turn = self._turn(session_id, message)
+        try:
+            first = await turn.__anext__()
+        except web.HTTPException:
+            raise
+        except Exception as e:
+            self.logger.error(f"API turn failed: {e}")
+            return web.json_response({"error": str(e)}, status=500)
+        await response.prepare(request)
+
+        async def send(event: str, data: dict):
+            await response.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+
+        try:
+            event, data = first
+            await send(event, {"token": data} if event == "token" else data)
+            async for event, data in turn:
+                await send(event, {"token": data} if event == "token" else data)
+        except Exception as e:
+            self.logger.error(f"API turn failed while streaming: {e}")
+            await send("error", {"error": str(e)})
+        finally:
+            await turn.aclose()
+        await response.write_eof()
+        return response
+
+    async def post_bulk(self, request):
+        session_id = request.match_info["session_id"]
+        body = await self._json_body(request)
+        operation = body.get("operation")
+        # Same parsing as the UI: "csv" is the uploaded file's text, "cards" a list of numbers or ranges
+        if "csv" in body:
+            cards, invalid = parse_card_csv(str(body["csv"]).encode("utf-8"))
+        else:
+            cards, invalid = extract_card_numbers(" ".join(str(card) for card in body.get("cards", [])))
+        if operation not in ("activate", "deactivate", "status"):
+            raise web.HTTPBadRequest(text=json.dumps({"error": "operation must be activate, deactivate or status"}),
+                                     content_type="application/json")
+        async with self._lock(session_id):
+            state = await self._load(session_id)
+            session = session_from_state(state)
+            card_agent = self.services.card_agent(session)
+            run = {"activate": card_agent.bulk_activate, "deactivate": card_agent.bulk_deactivate,
+                   "status": card_agent.bulk_status}[operation]
+            # Large batches write the card log; keep that off the event loop
+            response = await asyncio.get_running_loop().run_in_executor(None, run, cards, invalid)
+            session.chat_history.append(("user", f"{operation.capitalize()} {len(cards)} cards"))
+            session.chat_history.append(("assistant", response))
+            await self.sessions.save(session_id, state_from_session(session))
+        return web.json_response({"response": response, "cards": len(cards), "invalid": len(invalid)})
+
+    async def websocket(self, request):
+        # Each text frame {"message": ...} gets "token" frames followed by one "done" frame
+        session_id = request.match_info["session_id"]
+        await self._load(session_id)
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        async for frame in ws:
+            if frame.type != web.WSMsgType.TEXT:
+                continue
+            try:
+                message = str(json.loads(frame.data).get("message", "")).strip()
+            except (ValueError, AttributeError):
+                await ws.send_json({"type": "error", "error": "Frames must be JSON objects with a message"})
+                continue
+            if not message:
+                continue
+            turn = self._turn(session_id, message)
+            try:
+                async for event, data in turn:
+                    await ws.send_json({"type": event, "token": data} if event == "token" else {"type": event, **data})
+            except web.HTTPNotFound:
+                await ws.send_json({"type": "error", "error": "Unknown or expired session"})
+                break
+            except Exception as e:
+                self.logger.error(f"WebSocket turn failed: {e}")
+                await ws.send_json({"type": "error", "error": str(e)})
+            finally:
+                await turn.aclose()
+        return ws
+
+    async def healthz(self, request):
+        return web.json_response({
+            "status": "ok" if self.services.knowledge_ready else "warming_up",
+            "knowledge_ready": self.services.knowledge_ready,
+            "health": self.services.health,
+            "pid": os.getpid(),
+        })
+
+    async def metrics(self, request):
+        return web.Response(text=render_prometheus(), content_type="text/plain", charset="utf-8")
+
+def serve(host: str = API_HOST, port: int = API_PORT, reuse_port: bool = False, log_level: str = None):
+    # The server runs on the shared event loop, the same loop the async OpenAI and Azure clients are bound to
+    logger = setup_logger(log_level)
+    services = get_services()
+    api = ChatApi(services, create_session_store())
+
+    async def start():
+        runner = web.AppRunner(api.app())
+        await runner.setup()
+        await web.TCPSite(runner, host, port, reuse_port=reuse_port).start()
+        return runner
+
+    runner = run_async(start())
+    logger.info(f"CardAssist API listening on http://{host}:{port} (pid {os.getpid()})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        run_async(runner.cleanup())
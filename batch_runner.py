@@ -0,0 +1,241 @@
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+import numpy as np
+from agents.orchestrator import handle_user_input
+from utils.embedding_cache import encode_queries
+from utils.logger import setup_logger
+from utils.session_state import new_session_state
+from utils.upstream import priority
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "16"))
+# Messages whose query embeddings are computed in one encode call, ahead of the sessions that use them
+BATCH_ENCODE_SIZE = int(os.getenv("BATCH_ENCODE_SIZE", "256"))
+BATCH_PROGRESS_EVERY = int(os.getenv("BATCH_PROGRESS_EVERY", "100"))
+
+class KnowledgeUnavailable(RuntimeError):
+    pass
+
+def _user_messages(messages: list) -> list:
+    # Plain strings, or transcript entries such as {"role": "user", "content": ...}; assistant turns are dropped
+    texts = []
+    for message in messages:
+        if isinstance(message, str):
+            texts.append(message)
+        elif isinstance(message, dict) and message.get("role", "user") == "user":
+            text = message.get("content", message.get("text"))
+            if isinstance(text, str):
+                texts.append(text)
+    return [text for text in texts if text.strip()]
+
+def load_sessions(path: str) -> list:
+    # One JSON object per line: either a whole session {"session_id": ..., "messages": [...]} or a single
+    # message {"session_id": ..., "message": ...}. Messages of one session keep their file order;
+    # "card_states" optionally seeds a session's cards.
+    sessions = {}
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{path}:{line_number}: invalid JSON ({e})")
+            if not isinstance(record, dict):
+                raise ValueError(f"{path}:{line_number}: expected a JSON object")
+            session_id = str(record.get("session_id", f"line-{line_number}"))
+            session = sessions.setdefault(session_id, {"session_id": session_id, "messages": [], "card_states": {}})
+            if "messages" in record:
+                session["messages"].extend(_user_messages(record["messages"]))
+            elif "message" in record:
+                session["messages"].extend(_user_messages([record["message"]]))
+            else:
+                raise ValueError(f"{path}:{line_number}: expected \"messages\" or \"message\"")
+            session["card_states"].update(record.get("card_states") or {})
+    return [session for session in sessions.values() if session["messages"]]
+
+def read_checkpoint(path: str) -> set:
+    # The output file is the checkpoint: every complete line is a finished session. A line cut short by
+    # an interruption is truncated away so the session is run again.
+    done = set()
+    if not os.path.exists(path):
+        return done
+    valid_bytes = 0
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if not line.endswith(b"\n"):
+                break
+            done.add(record["session_id"])
+            valid_bytes += len(line)
+    if valid_bytes < os.path.getsize(path):
+        setup_logger().warning(f"Truncating incomplete record at byte {valid_bytes} of {path}")
+        with open(path, "r+b") as f:
+            f.truncate(valid_bytes)
+    return done
+
+def _summary(samples: list) -> dict:
+    values = np.asarray(samples, dtype=np.float64) * 1000
+    return {
+        "count": len(values),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "max_ms": float(values.max()),
+    }
+
+class BatchStats:
+    def __init__(self):
+        self.sessions = 0
+        self.turns = 0
+        self.errors = 0
+        self.latency = defaultdict(list)
+        self.first_token = defaultdict(list)
+        self.started = time.perf_counter()
+
+    def record(self, turns: list):
+        self.sessions += 1
+        for turn in turns:
+            self.turns += 1
+            if "error" in turn:
+                self.errors += 1
+                continue
+            self.latency[turn["intent"]].append(turn["seconds"])
+            if turn.get("first_token_seconds") is not None:
+                self.first_token[turn["intent"]].append(turn["first_token_seconds"])
+
+    def report(self) -> dict:
+        elapsed = time.perf_counter() - self.started
+        return {
+            "sessions": self.sessions,
+            "turns": self.turns,
+            "errors": self.errors,
+            "seconds": elapsed,
+            "turns_per_second": self.turns / elapsed if elapsed else 0.0,
+            "latency": {intent: _summary(samples) for intent, samples in sorted(self.latency.items())},
+            "first_token": {intent: _summary(samples) for intent, samples in sorted(self.first_token.items())},
+        }
+
+def format_report(report: dict) -> str:
+    lines = [
+        f"{report['sessions']} sessions, {report['turns']} turns, {report['errors']} errors in {report['seconds']:.1f}s "
+        f"({report['turns_per_second']:.1f} turns/s)",
+        f"{'intent':<20}{'turns':>8}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}",
+    ]
+    for intent, stats in report["latency"].items():
+        lines.append(f"{intent:<20}{stats['count']:>8}{stats['mean_ms']:>10.0f}{stats['p50_ms']:>10.0f}"
+                     f"{stats['p95_ms']:>10.0f}{stats['max_ms']:>10.0f}")
+    for intent, stats in report["first_token"].items():
+        lines.append(f"{intent} first token: p50 {stats['p50_ms']:.0f} ms, p95 {stats['p95_ms']:.0f} ms")
+    return "\n".join(lines)
+
+async def run_session(services, session: dict) -> dict:
+    # Each session gets its own card state, so replayed activations never leak between sessions
+    state = new_session_state(card_states=dict(session["card_states"]))
+    turns = []
+    started = time.perf_counter()
+    try:
+        for message in session["messages"]:
+            turn_started = time.perf_counter()
+            try:
+                intent, result = await handle_user_input(message, state, services)
+                first_token = None
+                if not isinstance(result, str):
+                    parts = []
+                    async for part in result:
+                        if first_token is None:
+                            first_token = time.perf_counter() - turn_started
+                        parts.append(part)
+                    result = "".join(parts).strip()
+            except Exception as e:
+                # One failing turn is reported and the session carries on, as it would in the UI
+                turns.append({"message": message, "error": f"{type(e).__name__}: {e}",
+                              "seconds": time.perf_counter() - turn_started})
+                continue
+            state.chat_history.append(("user", message))
+            state.chat_history.append(("assistant", result))
+            turns.append({
+                "message": message,
+                "intent": intent,
+                "response": result,
+                "seconds": time.perf_counter() - turn_started,
+                "first_token_seconds": first_token,
+                "timings": dict(state.turn_timings or {}),
+            })
+    finally:
+        state.chat_history.discard()
+    return {"session_id": session["session_id"], "seconds": time.perf_counter() - started, "turns": turns}
+
+async def _prewarm_embeddings(services, sessions: list):
+    # One encode call for the block's query texts; the per-turn encodes are then query cache hits.
+    # Messages settled by the intent rules are never embedded, so they are left out.
+    if services.embedding_model is None:
+        return
+    texts = list(dict.fromkeys(
+        message for session in sessions for message in session["messages"]
+        if services.intent_agent.classify_by_rules(message) is None
+    ))
+    if texts:
+        await asyncio.get_running_loop().run_in_executor(None, encode_queries, services.embedding_model, texts)
+
+async def run_batch(services, sessions: list, output_path: str, concurrency: int = BATCH_CONCURRENCY,
+                    encode_size: int = BATCH_ENCODE_SIZE, resume: bool = True) -> dict:
+    logger = setup_logger()
+    done = read_checkpoint(output_path) if resume else set()
+    pending = [session for session in sessions if session["session_id"] not in done]
+    if done:
+        logger.info(f"Resuming: {len(sessions) - len(pending)} of {len(sessions)} sessions already in {output_path}")
+
+    # Batch work queues behind interactive traffic for the shared upstream budgets
+    with priority("batch"):
+        if services.knowledge_future is not None:
+            try:
+                await asyncio.wrap_future(services.knowledge_future)
+            except Exception as e:
+                # Replaying without the knowledge base would record "unavailable" for every knowledge turn
+                raise KnowledgeUnavailable(f"Knowledge base warm-up failed: {e}") from e
+        stats = BatchStats()
+        # Bounded, so embedding stays only a block or two ahead of the sessions
+        queue = asyncio.Queue(maxsize=max(concurrency * 2, 1))
+
+        async def produce():
+            block, size = [], 0
+            for session in pending:
+                block.append(session)
+                size += len(session["messages"])
+                if size >= encode_size:
+                    await _prewarm_embeddings(services, block)
+                    for item in block:
+                        await queue.put(item)
+                    block, size = [], 0
+            await _prewarm_embeddings(services, block)
+            for item in block:
+                await queue.put(item)
+            for _ in range(concurrency):
+                await queue.put(None)
+
+        with open(output_path, "a" if resume else "w", encoding="utf-8") as output:
+            async def work():
+                while True:
+                    session = await queue.get()
+                    if session is None:
+                        return
+                    record = await run_session(services, session)
+                    # Written whole as each session finishes: the file doubles as the resume checkpoint
+                    output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    output.flush()
+                    stats.record(record["turns"])
+                    if BATCH_PROGRESS_EVERY and stats.sessions % BATCH_PROGRESS_EVERY == 0:
+                        print(f"{stats.sessions}/{len(pending)} sessions, "
+                              f"{stats.turns / (time.perf_counter() - stats.started):.1f} turns/s", file=sys.stderr)
+
+            await asyncio.gather(produce(), *(work() for _ in range(concurrency)))
+    report = stats.report()
+    report["skipped"] = len(sessions) - len(pending)
+    return report
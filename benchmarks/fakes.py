@@ -0,0 +1,207 @@
+import argparse
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+import uuid
+import zlib
+import numpy as np
+
+WORD_PATTERN = re.compile(r"\w+")
+# Keyword fallbacks the fake server uses to answer intent classification prompts
+FAKE_INTENT_KEYWORDS = [
+    ("reset", "reset_cards"),
+    ("deactivat", "deactivate"),
+    ("activat", "activate"),
+    ("status", "query_status"),
+    ("bye", "end"),
+]
+FAKE_ANSWER = (
+    "To change your PIN, sign in to Global Card Access, open the card details page and choose Change PIN. "
+    "You will be asked to verify your identity before the new PIN takes effect. "
+)
+
+class HashingEmbeddingModel:
+    # Deterministic signed bag-of-words embedding, a fast stand-in when sentence-transformers is not installed
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def encode(self, sentences, batch_size: int = None, **kwargs):
+        single = isinstance(sentences, str)
+        rows = [sentences] if single else list(sentences)
+        vectors = np.zeros((len(rows), self.dim), dtype=np.float32)
+        for i, text in enumerate(rows):
+            for word in WORD_PATTERN.findall(text.lower()):
+                h = zlib.crc32(word.encode("utf-8"))
+                vectors[i, h % self.dim] += 1.0 if (h >> 16) & 1 else -1.0
+        return vectors[0] if single else vectors
+
+class LatencySearchClient:
+    # Wraps an async search client and adds a fixed network-like delay to every query
+    def __init__(self, client, latency: float = 0.0):
+        self.client = client
+        self.latency = latency
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def __len__(self):
+        return len(self.client)
+
+    async def search(self, *args, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return await self.client.search(*args, **kwargs)
+
+class FakeOpenAIServer:
+    # Minimal OpenAI-compatible HTTP server: /v1/models and /v1/chat/completions, with SSE streaming.
+    # latency is the delay before the first token, token_latency the delay between streamed tokens.
+    # throttle_rate answers that fraction of completions with 429 and a Retry-After of retry_after seconds.
+    def __init__(self, latency: float = 0.3, token_latency: float = 0.01, completion_tokens: int = 60,
+                 host: str = "127.0.0.1", port: int = 0, throttle_rate: float = 0.0, retry_after: float = 0.2):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.completion_tokens = completion_tokens
+        self.host = host
+        self.port = port
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.requests = 0
+        self.throttled = 0
+        self._random = random.Random(0)
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def _reply(self, messages: list) -> str:
+        system = messages[0]["content"] if messages and messages[0]["role"] == "system" else ""
+        if "intent classifier" in system:
+            current = messages[-1]["content"].rsplit("Current input:", 1)[-1].lower()
+            for keyword, intent in FAKE_INTENT_KEYWORDS:
+                if keyword in current:
+                    return intent
+            return "knowledge"
+        words = (FAKE_ANSWER * (self.completion_tokens // len(FAKE_ANSWER.split()) + 1)).split()
+        return " ".join(words[:self.completion_tokens])
+
+    def _usage(self, messages: list, reply: str) -> dict:
+        prompt_tokens = sum(len(message["content"]) for message in messages) // 4
+        completion_tokens = len(reply.split())
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens}
+
+    async def _models(self, request):
+        from aiohttp import web
+        return web.json_response({"object": "list", "data": [{"id": "gpt-4", "object": "model", "created": 0, "owned_by": "fake"}]})
+
+    async def _chat_completions(self, request):
+        from aiohttp import web
+        self.requests += 1
+        if self.throttle_rate and self._random.random() < self.throttle_rate:
+            self.throttled += 1
+            return web.json_response(
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                status=429, headers={"Retry-After": f"{self.retry_after:g}"}
+            )
+        body = await request.json()
+        messages = body.get("messages", [])
+        reply = self._reply(messages)
+        usage = self._usage(messages, reply)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        await asyncio.sleep(self.latency)
+
+        if not body.get("stream"):
+            await asyncio.sleep(self.token_latency * usage["completion_tokens"])
+            return web.json_response({
+                "id": completion_id, "object": "chat.completion", "created": created, "model": body.get("model", "gpt-4"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+
+        async def send(choices: list, extra: dict = None):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                     "model": body.get("model", "gpt-4"), "choices": choices, **(extra or {})}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+        for i, word in enumerate(reply.split(" ")):
+            if i:
+                await asyncio.sleep(self.token_latency)
+            delta = {"content": word if i == 0 else " " + word}
+            if i == 0:
+                delta["role"] = "assistant"
+            await send([{"index": 0, "delta": delta, "finish_reason": None}])
+        await send([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await send([], {"usage": usage})
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    def _app(self):
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_get("/v1/models", self._models)
+        app.router.add_post("/v1/chat/completions", self._chat_completions)
+        return app
+
+    async def _start(self):
+        from aiohttp import web
+        self._runner = web.AppRunner(self._app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    def start(self) -> str:
+        # Serves from its own thread and loop so the server does not compete with the client's event loop
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self._start())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="fake-openai", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self.base_url
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop = None
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI server for offline CardAssist benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.3, help="Seconds before the first token")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="Seconds between streamed tokens")
+    parser.add_argument("--completion-tokens", type=int, default=60)
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of completions answered with 429")
+    parser.add_argument("--retry-after", type=float, default=0.2, help="Retry-After seconds sent with a 429")
+    args = parser.parse_args()
+    server = FakeOpenAIServer(args.latency, args.token_latency, args.completion_tokens, args.host, args.port,
+                              args.throttle_rate, args.retry_after)
+    print(f"Fake OpenAI server listening on {server.start()}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
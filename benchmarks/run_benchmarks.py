@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+# Offline benchmarks for CardAssist: no OpenAI or Azure access needed.
+#   python -m benchmarks.run_benchmarks --output bench.json
+# Results are written as JSON so runs can be compared over time.
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+# Card state, embedding cache and answer cache go to a scratch directory, never to the working tree's files
+SCRATCH_DIR = tempfile.mkdtemp(prefix="cardassist-bench-")
+os.environ.setdefault("CARD_STORE_PATH", os.path.join(SCRATCH_DIR, "card_states.log"))
+os.environ.setdefault("EMBEDDING_CACHE_DIR", os.path.join(SCRATCH_DIR, "embeddings"))
+os.environ.setdefault("CHAT_HISTORY_DIR", os.path.join(SCRATCH_DIR, "chat_history"))
+os.environ.pop("ANSWER_CACHE_PATH", None)
+
+import numpy as np
+from agents.knowledge_agent import KnowledgeAgent
+from agents.orchestrator import handle_user_input
+from benchmarks.fakes import FakeOpenAIServer, HashingEmbeddingModel, LatencySearchClient
+from utils.answer_cache import SemanticAnswerCache
+from utils.card_numbers import extract_card_numbers
+from utils.card_store import CardStateStore
+from utils.embedding_backends import EMBEDDING_BACKENDS, load_embedding_model
+from utils.hybrid_retrieval import LocalReranker
+from utils.ingestion import KNOWLEDGE_SOURCES
+from utils.knowledge_base import EMBEDDING_MODEL_NAME, build_knowledge_base
+from utils.logger import setup_logger
+from utils.search_backends import FaissSearchClient, NumpySearchClient
+from utils.services import Services
+from utils.single_flight import single_flight_calls
+from utils.upstream import upstream_failures, upstream_retries
+from utils.session_state import new_session_state
+
+# One session's conversation; {card} is unique per session, {card_end} closes a 10-card range
+SESSION_SCRIPT = [
+    "Activate card {card}",
+    "What is the status of card {card}?",
+    "How do I change my PIN?",
+    "Deactivate card {card}",
+    "Which cards are activated?",
+    "How can I report a lost or stolen card?",
+    "Activate cards {card} to {card_end}",
+    "Show all cards status",
+    "What should I do if my card is declined abroad?",
+    "Can you explain how card disputes work?",
+]
+CARDS_PER_SESSION = 10
+# Retrieval queries for recall@k: the knowledge questions above plus the opening words of sampled chunks
+RECALL_QUESTIONS = [message for message in SESSION_SCRIPT if "{card" not in message] + [
+    "How do I unlock my account after too many attempts?",
+    "What are the fees for international transactions?",
+    "How do I set up a new cardholder?",
+    "Where can I see my card limits?",
+]
+RECALL_CHUNK_QUERIES = 64
+# Words per exact-phrase retrieval query, taken from the middle of a sampled chunk
+PHRASE_QUERY_WORDS = 6
+CARD_BASE = 100000000
+
+def summarize(samples: list) -> dict:
+    if not samples:
+        return {"count": 0}
+    values = np.asarray(samples, dtype=np.float64) * 1000
+    return {
+        "count": len(values),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(values.max()),
+    }
+
+def load_embedder(name: str):
+    if name in ("auto", "minilm"):
+        try:
+            from sentence_transformers import SentenceTransformer
+            from utils.embedding_cache import CachedEmbeddingModel
+            return "minilm", CachedEmbeddingModel(SentenceTransformer(EMBEDDING_MODEL_NAME), EMBEDDING_MODEL_NAME)
+        except ImportError:
+            if name == "minilm":
+                raise
+    return "hash", HashingEmbeddingModel()
+
+class TurnRecorder:
+    def __init__(self):
+        self.latency = defaultdict(list)
+        self.first_token = defaultdict(list)
+        self.stages = defaultdict(list)
+
+    def record(self, intent: str, total: float, first_token: float, stages: dict):
+        self.latency[intent].append(total)
+        if first_token is not None:
+            self.first_token[intent].append(first_token)
+        # Stage timings are the spans the pipeline records for the turn
+        for stage, seconds in stages.items():
+            if stage != "total":
+                self.stages[stage].append(seconds)
+
+    def report(self) -> dict:
+        return {
+            "latency": {intent: summarize(samples) for intent, samples in sorted(self.latency.items())},
+            "first_token": {intent: summarize(samples) for intent, samples in sorted(self.first_token.items())},
+            "stages": {stage: summarize(samples) for stage, samples in sorted(self.stages.items())},
+        }
+
+async def run_session(services, session_number: int, turns: int, recorder: TurnRecorder):
+    session = new_session_state()
+    card = CARD_BASE + session_number * CARDS_PER_SESSION
+    for turn in range(turns):
+        message = SESSION_SCRIPT[turn % len(SESSION_SCRIPT)].format(
+            card=f"{card:09d}", card_end=f"{card + CARDS_PER_SESSION - 1:09d}"
+        )
+        started = time.perf_counter()
+        intent, result = await handle_user_input(message, session, services)
+        first_token = None
+        if not isinstance(result, str):
+            parts = []
+            async for part in result:
+                if first_token is None:
+                    first_token = time.perf_counter() - started
+                parts.append(part)
+            result = "".join(parts).strip()
+        total = time.perf_counter() - started
+        session.chat_history.append(("user", message))
+        session.chat_history.append(("assistant", result))
+        recorder.record(intent, total, first_token, session.turn_timings)
+
+async def benchmark_pipeline(args, embedding_model) -> dict:
+    import openai
+    from utils.http_pool import openai_http_client
+
+    server = FakeOpenAIServer(args.llm_latency, args.token_latency, args.completion_tokens,
+                              throttle_rate=args.throttle_rate, retry_after=args.retry_after)
+    base_url = server.start()
+    try:
+        openai_client = openai.AsyncOpenAI(api_key="benchmark", base_url=base_url, http_client=openai_http_client(),
+                                           max_retries=0)
+        chunks, search_client, lexical_index, _ = build_knowledge_base(embedding_model, args.sources, backend="numpy")
+        search_client = LatencySearchClient(search_client, args.search_latency)
+        # A fresh, never-hitting answer cache unless cache hits are what is being measured
+        answer_cache = SemanticAnswerCache(path=None) if args.answer_cache else SemanticAnswerCache(threshold=2.0, path=None)
+
+        services = Services(openai_client, None)
+        services.attach_knowledge(embedding_model, chunks, search_client, answer_cache, lexical_index)
+
+        results = {}
+        for concurrency in args.concurrency:
+            recorder = TurnRecorder()
+            started = time.perf_counter()
+            await asyncio.gather(*(run_session(services, i, args.turns, recorder) for i in range(concurrency)))
+            elapsed = time.perf_counter() - started
+            total_turns = concurrency * args.turns
+            results[str(concurrency)] = {
+                "sessions": concurrency,
+                "turns": total_turns,
+                "seconds": elapsed,
+                "turns_per_second": total_turns / elapsed,
+                **recorder.report(),
+            }
+            print(f"pipeline: {concurrency} sessions, {total_turns / elapsed:.1f} turns/s", file=sys.stderr)
+        results["llm_requests"] = server.requests
+        results["llm_throttled"] = server.throttled
+        results["upstream_retries"] = {
+            reason: upstream_retries.value(upstream="openai", reason=reason) for reason in ("429", "connection", "500", "503")
+        }
+        results["upstream_failures"] = upstream_failures.value(upstream="openai")
+        # Identical calls from concurrent sessions that shared one upstream request
+        results["single_flight"] = {
+            f"{call}_{outcome}": single_flight_calls.value(call=call, result=outcome)
+            for call in ("chat", "chat_stream", "search") for outcome in ("leader", "coalesced")
+        }
+        await openai_client.close()
+        return results
+    finally:
+        server.stop()
+
+def benchmark_ingestion(args, embedding_model) -> dict:
+    # The first pass embeds everything; the second is served by the embedding cache when the model has one
+    runs = {}
+    for name in ("cold", "warm"):
+        chunks, search_client, _, stats = build_knowledge_base(embedding_model, args.sources, backend="numpy")
+        runs[name] = stats.as_dict()
+        print(f"ingestion ({name}): {stats.summary()}", file=sys.stderr)
+    return runs
+
+def _rss_bytes():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return None
+
+def _recall_queries(chunks: list) -> list:
+    step = max(1, len(chunks) // RECALL_CHUNK_QUERIES)
+    return RECALL_QUESTIONS + [" ".join(chunk.split()[:12]) for chunk in chunks[::step][:RECALL_CHUNK_QUERIES]]
+
+def _top_ids(client, query_vectors: np.ndarray, k: int) -> list:
+    return [
+        [hit["id"] for hit in client.search(vector_queries=[{"vector": vector, "k": k}], top=k)]
+        for vector in query_vectors
+    ]
+
+def _recall(results: list, baseline: list) -> float:
+    return float(np.mean([len(set(got) & set(expected)) / len(expected) for got, expected in zip(results, baseline)]))
+
+def _documents(chunks: list, vectors: np.ndarray) -> list:
+    return [{"id": str(i), "content": chunk, "embedding": vector} for i, (chunk, vector) in enumerate(zip(chunks, vectors))]
+
+def benchmark_embeddings(args, embedding_model) -> dict:
+    # Recall@k of every embedding backend and vector precision against exact float32 search over the
+    # baseline embedder's vectors, with the latency and memory each one costs
+    chunks, _, _, _ = build_knowledge_base(embedding_model, args.sources, backend="numpy")
+    queries = _recall_queries(chunks)
+    k = args.recall_k
+    vectors = np.asarray(embedding_model.encode(chunks), dtype=np.float32)
+    query_vectors = np.asarray(embedding_model.encode(queries), dtype=np.float32)
+    baseline = _top_ids(NumpySearchClient(_documents(chunks, vectors), dtype="float32"), query_vectors, k)
+    results = {"chunks": len(chunks), "queries": len(queries), "k": k, "storage": {}, "backends": {}}
+
+    for name, client_class in (("numpy", NumpySearchClient), ("faiss", FaissSearchClient)):
+        for dtype in ("float32", "float16", "int8"):
+            try:
+                client = client_class(_documents(chunks, vectors), dtype=dtype)
+            except ImportError:
+                continue
+            started = time.perf_counter()
+            found = _top_ids(client, query_vectors, k)
+            seconds = (time.perf_counter() - started) / len(queries)
+            results["storage"][f"{name}/{dtype}"] = {
+                "recall_at_k": _recall(found, baseline),
+                "vector_bytes": client.vector_bytes,
+                "query_ms": seconds * 1000,
+            }
+            print(f"vectors {name}/{dtype}: recall@{k} {_recall(found, baseline):.3f}, {client.vector_bytes} bytes", file=sys.stderr)
+
+    for backend in args.embedding_backends:
+        rss_before = _rss_bytes()
+        started = time.perf_counter()
+        try:
+            model, loaded = load_embedding_model(EMBEDDING_MODEL_NAME, backend)
+        except ImportError as e:
+            results["backends"][backend] = {"error": str(e)}
+            continue
+        if loaded != backend:
+            results["backends"][backend] = {"error": f"unavailable, loaded {loaded} instead"}
+            continue
+        load_seconds = time.perf_counter() - started
+        rss_after = _rss_bytes()
+
+        started = time.perf_counter()
+        backend_vectors = np.asarray(model.encode(chunks, batch_size=32, convert_to_numpy=True), dtype=np.float32)
+        encode_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        for query in queries:
+            model.encode([query], convert_to_numpy=True)
+        query_seconds = (time.perf_counter() - started) / len(queries)
+        backend_queries = np.asarray(model.encode(queries, convert_to_numpy=True), dtype=np.float32)
+
+        found = _top_ids(NumpySearchClient(_documents(chunks, backend_vectors), dtype="float32"), backend_queries, k)
+        results["backends"][backend] = {
+            "load_seconds": load_seconds,
+            "rss_delta_bytes": rss_after - rss_before if rss_before is not None else None,
+            "chunks_per_second": len(chunks) / encode_seconds,
+            "query_encode_ms": query_seconds * 1000,
+            "recall_at_k": _recall(found, baseline),
+        }
+        print(f"embeddings {backend}: load {load_seconds:.2f}s, {len(chunks) / encode_seconds:.0f} chunks/s, "
+              f"recall@{k} {_recall(found, baseline):.3f}", file=sys.stderr)
+        del model
+    return results
+
+def _phrase_queries(chunks: list, count: int) -> list:
+    # A distinctive run of words from the middle of each sampled chunk: the kind of exact wording (error
+    # codes, product names) embeddings blur. Any chunk containing the phrase counts as relevant.
+    step = max(1, len(chunks) // count)
+    queries = []
+    for chunk in chunks[::step][:count]:
+        words = chunk.split()
+        if len(words) < PHRASE_QUERY_WORDS * 2:
+            continue
+        start = (len(words) - PHRASE_QUERY_WORDS) // 2
+        queries.append(" ".join(words[start:start + PHRASE_QUERY_WORDS]))
+    return queries
+
+async def benchmark_retrieval(args, embedding_model) -> dict:
+    # Hit rate and MRR of the selected context for vector-only, BM25-only, hybrid and reranked hybrid
+    # retrieval, with the latency and context size each one costs
+    started = time.perf_counter()
+    chunks, search_client, lexical_index, _ = build_knowledge_base(embedding_model, args.sources, backend="numpy")
+    build_seconds = time.perf_counter() - started
+    queries = _phrase_queries(chunks, RECALL_CHUNK_QUERIES)
+    query_vectors = np.asarray(embedding_model.encode(queries), dtype=np.float32).tolist()
+    results = {
+        "chunks": len(chunks),
+        "queries": len(queries),
+        "bm25": {"terms": len(lexical_index.terms), "bytes": lexical_index.nbytes, "ingest_seconds": build_seconds},
+        "modes": {},
+    }
+    modes = {
+        "vector": ("vector", None),
+        "bm25": ("lexical", None),
+        "hybrid": ("hybrid", None),
+        "hybrid+rerank": ("hybrid", LocalReranker()),
+    }
+    for name, (mode, reranker) in modes.items():
+        agent = KnowledgeAgent(embedding_model, chunks, search_client, None, SemanticAnswerCache(path=None),
+                               lexical_index, retrieval_mode=mode)
+        # Set after construction: None there means the RERANKER default
+        agent.reranker = reranker
+        ranks, latencies, tokens = [], [], []
+        for query, query_vector in zip(queries, query_vectors):
+            started = time.perf_counter()
+            context = await agent.retrieve_context(query, query_vector)
+            latencies.append(time.perf_counter() - started)
+            tokens.append(context.tokens)
+            ranks.append(next((rank for rank, chunk in enumerate(context.chunks, start=1) if query in chunk), None))
+        found = [rank for rank in ranks if rank is not None]
+        results["modes"][name] = {
+            "hit_rate": len(found) / len(queries) if queries else 0.0,
+            "mrr": sum(1.0 / rank for rank in found) / len(queries) if queries else 0.0,
+            "context_tokens_mean": float(np.mean(tokens)) if tokens else 0.0,
+            **summarize(latencies),
+        }
+        print(f"retrieval {name}: hit rate {results['modes'][name]['hit_rate']:.3f}, "
+              f"MRR {results['modes'][name]['mrr']:.3f}", file=sys.stderr)
+    return results
+
+def _timed(fn, *args, repeat: int = 1) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn(*args)
+    return (time.perf_counter() - started) / repeat
+
+def benchmark_card_store(sizes: list, single_ops: int, fsync: bool) -> dict:
+    results = {}
+    for size in sizes:
+        path = os.path.join(SCRATCH_DIR, f"card_store_{size}.log")
+        store = CardStateStore(path, legacy_path=os.path.join(SCRATCH_DIR, "none.json"),
+                               compact_bytes=1 << 62, fsync=fsync)
+        cards = [f"{CARD_BASE + i:09d}" for i in range(size)]
+        batch = 100000
+
+        started = time.perf_counter()
+        for start in range(0, size, batch):
+            store.record_batch(cards[start:start + batch], "active", "activated", time.time())
+        bulk_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for i in range(single_ops):
+            store.record_action(cards[i % size], "inactive", "deactivated")
+        single_seconds = time.perf_counter() - started
+
+        replay_seconds = _timed(lambda: CardStateStore(path, compact_bytes=1 << 62, fsync=fsync))
+        log_bytes = os.path.getsize(path)
+        compact_seconds = _timed(store.compact)
+        replay_compacted_seconds = _timed(lambda: CardStateStore(path, compact_bytes=1 << 62, fsync=fsync))
+
+        history = store.card_action_history
+        probe = cards[size // 2]
+        range_text = f"Activate cards {cards[0]} to {cards[min(size, batch) - 1]}"
+        results[str(size)] = {
+            "bulk_append_seconds": bulk_seconds,
+            "bulk_cards_per_second": size / bulk_seconds,
+            "single_append_ops_per_second": single_ops / single_seconds,
+            "log_bytes": log_bytes,
+            "replay_seconds": replay_seconds,
+            "compact_seconds": compact_seconds,
+            "replay_after_compaction_seconds": replay_compacted_seconds,
+            "history_latest_page_us": _timed(history.latest, "activated", repeat=1000) * 1e6,
+            "history_for_card_us": _timed(history.for_card, probe, repeat=1000) * 1e6,
+            "history_count_us": _timed(history.count, "deactivated", repeat=1000) * 1e6,
+            "parse_range_seconds": _timed(extract_card_numbers, range_text),
+        }
+        print(f"card store: {size} cards, bulk {size / bulk_seconds:.0f} cards/s, replay {replay_seconds:.3f}s", file=sys.stderr)
+    return results
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline CardAssist benchmarks")
+    parser.add_argument("--suites", default="pipeline,ingestion,card_store,embeddings,retrieval",
+                        help="Comma-separated suites to run (default: pipeline,ingestion,card_store,embeddings,retrieval)")
+    parser.add_argument("--embedder", choices=["auto", "minilm", "hash"], default="auto",
+                        help="minilm is the production model; hash is a fast deterministic stand-in")
+    parser.add_argument("--sources", default=KNOWLEDGE_SOURCES, help="Knowledge documents to ingest")
+    parser.add_argument("--concurrency", default="1,8,32", help="Concurrent session counts, comma-separated")
+    parser.add_argument("--turns", type=int, default=20, help="Turns per session")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Fake OpenAI seconds before the first token")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="Fake OpenAI seconds between tokens")
+    parser.add_argument("--completion-tokens", type=int, default=60)
+    parser.add_argument("--search-latency", type=float, default=0.05, help="Fake search seconds per query")
+    parser.add_argument("--answer-cache", action="store_true", help="Let repeated questions hit the answer cache")
+    parser.add_argument("--throttle-rate", type=float, default=0.0,
+                        help="Fraction of fake OpenAI completions answered with 429, to exercise the upstream scheduler")
+    parser.add_argument("--retry-after", type=float, default=0.2, help="Retry-After seconds the fake server sends with a 429")
+    parser.add_argument("--card-sizes", default="1000,10000,100000,1000000")
+    parser.add_argument("--single-ops", type=int, default=1000, help="Single-card appends per card store size")
+    parser.add_argument("--fsync", action="store_true", help="fsync card store appends, as in production")
+    parser.add_argument("--embedding-backends", default=",".join(EMBEDDING_BACKENDS),
+                        help="Embedding backends compared by the embeddings suite")
+    parser.add_argument("--recall-k", type=int, default=5, help="k for recall@k in the embeddings suite")
+    parser.add_argument("--output", help="Write JSON results here instead of stdout")
+    args = parser.parse_args()
+    args.concurrency = [int(n) for n in args.concurrency.split(",")]
+    args.embedding_backends = [name.strip() for name in args.embedding_backends.split(",") if name.strip()]
+    suites = [suite.strip() for suite in args.suites.split(",") if suite.strip()]
+
+    # Keep the log output out of the measurements' way
+    setup_logger("WARNING")
+
+    embedder_name, embedding_model = load_embedder(args.embedder)
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "embedder": embedder_name,
+            "config": {key: value for key, value in vars(args).items() if key != "output"},
+        }
+    }
+    if "ingestion" in suites:
+        report["ingestion"] = benchmark_ingestion(args, embedding_model)
+    if "pipeline" in suites:
+        report["pipeline"] = asyncio.run(benchmark_pipeline(args, embedding_model))
+    if "card_store" in suites:
+        sizes = [int(n) for n in args.card_sizes.split(",")]
+        report["card_store"] = benchmark_card_store(sizes, args.single_ops, args.fsync)
+    if "embeddings" in suites:
+        report["embeddings"] = benchmark_embeddings(args, embedding_model)
+    if "retrieval" in suites:
+        report["retrieval"] = asyncio.run(benchmark_retrieval(args, embedding_model))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
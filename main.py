@@ -1,15 +1,18 @@
 import streamlit as st
-import asyncio
 import os
 import argparse
-from agents.intent_agent import IntentAgent
 from agents.card_management_agent import CardManagementAgent
-from agents.knowledge_agent import KnowledgeAgent
-from utils.session_state import initialize_session_state, update_chat_history, save_card_states
-from utils.openai_setup import setup_openai
-from utils.knowledge_base import load_knowledge_base
+from agents.orchestrator import handle_user_input
+from utils.session_state import initialize_session_state, update_chat_history, snapshot_session_state, apply_session_state
+from utils.async_runtime import run_async, iterate_async
+from utils.card_numbers import parse_card_csv
+from utils.services import get_services
+from utils.api_client import API_BASE_URL, SessionNotFound, get_api_client
 from utils.logger import setup_logger
-import re
+from utils.metrics import SHOW_TURN_TIMINGS, format_timings
+
+# Messages rendered per rerun; older ones are shown a page at a time on request
+CHAT_RENDER_MESSAGES = int(os.getenv("CHAT_RENDER_MESSAGES", "20"))
 
 # Parse command-line arguments
 parser = argparse.ArgumentParser(description="CardAssist Chatbot")
@@ -45,95 +48,119 @@ I'm here to help you manage your cards and answer your questions. You can:
 Start by typing your question below!
 """)
 
-# Initialize session state
-initialize_session_state()
-
-# Load knowledge base
-embedding_model, chunks, search_client = load_knowledge_base()
-
-# Setup OpenAI and Semantic Kernel
-openai_client, kernel = setup_openai()
-
-# Display chat history
-for role, message in st.session_state.chat_history:
+# Initialize session state; as an API client the card store lives on the server
+initialize_session_state(local_cards=not API_BASE_URL)
+
+if API_BASE_URL:
+    # Thin client of a running API server (run_api.py); the pipeline and card store live there
+    api = get_api_client()
+else:
+    # Clients, knowledge base and agents are built once per process and reused across reruns and sessions;
+    # the knowledge base warms up in the background so card operations are available right away
+    services = get_services()
+    if not services.knowledge_ready:
+        st.caption("⏳ The knowledge base is warming up; card operations are already available.")
+
+def api_session_id(renew: bool = False) -> str:
+    if renew or "api_session_id" not in st.session_state:
+        st.session_state.api_session_id = api.create_session()
+    return st.session_state.api_session_id
+
+def api_call(call):
+    # The server may have expired the session or restarted with an in-memory store
+    try:
+        return call(api_session_id())
+    except SessionNotFound:
+        logger.info("API session expired; starting a new one")
+        return call(api_session_id(renew=True))
+
+# Display the newest messages only, so a rerun costs the same however long the session is
+chat_history = st.session_state.chat_history
+render_count = st.session_state.get("chat_render_count", CHAT_RENDER_MESSAGES)
+if len(chat_history) > render_count:
+    if st.button(f"⬆️ Load older messages ({len(chat_history) - render_count} hidden)"):
+        st.session_state.chat_render_count = render_count + CHAT_RENDER_MESSAGES
+        st.rerun()
+for role, message in chat_history.tail(render_count):
     if role == "user":
         st.markdown(f"**🧑 You:** {message}")
     else:
         st.markdown(f"**🤖 CardAssist:** {message}")
         if message == "✅ Session ended. You can start a new conversation!" and st.session_state.end_conversation:
             st.markdown("👋 Session ended. Start a new conversation below.")
-
-# Handle user input
-async def handle_user_input(user_input: str):
-    logger.info(f"Received user input: {user_input}")
-    intent_agent = IntentAgent(openai_client)
-    card_agent = CardManagementAgent()
-    knowledge_agent = KnowledgeAgent(embedding_model, chunks, search_client, openai_client)
-
-    # Check if input is a 9-digit number and last intent was activate/deactivate
-    if re.match(r'^\d{9}$', user_input) and st.session_state.last_intent in ["activate", "deactivate"]:
-        intent = st.session_state.last_intent
-        logger.debug(f"Using previous intent: {intent} for card number input")
-    else:
-        intent = await intent_agent.classify_intent(user_input, st.session_state.chat_history)
-        logger.debug(f"Classified intent: {intent}")
-
-    st.session_state.last_intent = intent
-
-    if intent == "end":
-        st.session_state.end_conversation = True
-        st.session_state.last_intent = None
-        save_card_states()  # Save card states before ending session
-        result = "✅ Session ended. You can start a new conversation!"
-        logger.info("Conversation ended by user")
-    elif intent == "query_activated":
-        result = card_agent.query_card_status("activated")
-        logger.info(f"Queried activated cards: {result}")
-    elif intent == "query_deactivated":
-        result = card_agent.query_card_status("deactivated")
-        logger.info(f"Queried deactivated cards: {result}")
-    elif intent == "query_status":
-        match = re.search(r'\b\d{9}\b', user_input)
-        if match:
-            card_number = match.group(0)
-            result = card_agent.query_specific_card_status(card_number)
-            logger.info(f"Queried status for card {card_number}: {result}")
-        else:
-            result = "❓ Please provide a valid 9-digit card number to check its status."
-            logger.warning("Invalid card number for status query")
-    elif intent == "query_all_status":
-        result = card_agent.query_all_status()
-        logger.info(f"Queried all card statuses: {result}")
-    elif intent in ["activate", "deactivate"]:
-        match = re.search(r'\b\d{9}\b', user_input)
-        if match:
-            card_number = match.group(0)
-            result = card_agent.activate_card(card_number) if intent == "activate" else card_agent.deactivate_card(card_number)
-            logger.info(f"Performed {intent} on card {card_number}: {result}")
-        else:
-            action = "activate" if intent == "activate" else "deactivate"
-            result = f"❓ Please provide a valid 9-digit card number to {action} the card."
-            logger.warning(f"No valid card number provided for {action}")
-    elif intent == "knowledge":
-        result = knowledge_agent.search_knowledge_base(user_input)
-        logger.info(f"Knowledge base query: {user_input}, Response: {result}")
-    elif intent == "reset_cards":
-        result = card_agent.reset_all_cards()
-        logger.info(f"Reset all cards: {result}")
-    else:
-        result = "❓ Your question is unclear. Please provide a valid query."
-        logger.warning(f"Unclear user query: {user_input}")
-
-    return intent, result
+if SHOW_TURN_TIMINGS and st.session_state.turn_timings:
+    st.caption(f"⏱️ {format_timings(st.session_state.turn_timings)}")
 
 # Input Section
 with st.form(key="chat_form", clear_on_submit=True):
     user_input = st.text_input("💬 Ask your question:", placeholder="e.g., Activate card 123456789 or How do I change my PIN?")
     submit_btn = st.form_submit_button("Submit")
 
-if submit_btn and user_input:
+# Bulk operations from an uploaded CSV of card numbers
+with st.expander("📄 Bulk card operations from a CSV file"):
+    card_file = st.file_uploader("CSV of card numbers (any column, ranges like 123456700-123456799 allowed)", type=["csv", "txt"])
+    bulk_operation = st.radio("Operation", ["Activate", "Deactivate", "Status"], horizontal=True)
+    bulk_btn = st.button("Run bulk operation")
+
+if bulk_btn and card_file is not None:
+    if API_BASE_URL:
+        try:
+            csv_text = card_file.getvalue().decode("utf-8-sig", errors="replace")
+            response = api_call(lambda session_id: api.bulk(session_id, bulk_operation, csv_text))
+        except RuntimeError as e:
+            st.error(f"API error: {e}. Please try again.")
+            logger.error(f"API error occurred: {e}")
+            st.stop()
+        logger.info(f"Bulk {bulk_operation.lower()} from {card_file.name} sent to the API")
+    else:
+        card_numbers, invalid = parse_card_csv(card_file.getvalue())
+        card_agent = CardManagementAgent()
+        if bulk_operation == "Activate":
+            response = card_agent.bulk_activate(card_numbers, invalid)
+        elif bulk_operation == "Deactivate":
+            response = card_agent.bulk_deactivate(card_numbers, invalid)
+        else:
+            response = card_agent.bulk_status(card_numbers, invalid)
+        logger.info(f"Bulk {bulk_operation.lower()} from {card_file.name}: {len(card_numbers)} cards, {len(invalid)} invalid")
+    update_chat_history(f"{bulk_operation} cards from {card_file.name}", response)
+    st.rerun()
+
+def stream_api_turn(session_id: str, user_input: str, placeholder) -> str:
+    streamed = ""
+    for event, data in api.stream_message(session_id, user_input):
+        if event == "token":
+            streamed += data
+            placeholder.markdown(f"**🤖 CardAssist:** {streamed}▌")
+        elif event == "done":
+            st.session_state.end_conversation = data["end_conversation"]
+            st.session_state.last_intent = data["intent"]
+            st.session_state.turn_timings = data["timings"]
+            return data["response"]
+    raise RuntimeError("API stream ended without a response")
+
+if submit_btn and user_input and API_BASE_URL:
+    try:
+        st.markdown(f"**🧑 You:** {user_input}")
+        placeholder = st.empty()
+        response = api_call(lambda session_id: stream_api_turn(session_id, user_input, placeholder))
+        update_chat_history(user_input, response)
+        st.rerun()
+    except RuntimeError as e:
+        st.error(f"API error: {e}. Please try again.")
+        logger.error(f"API error occurred: {e}")
+elif submit_btn and user_input:
     try:
-        intent, response = asyncio.run(handle_user_input(user_input))
+        session = snapshot_session_state()
+        intent, response = run_async(handle_user_input(user_input, session, services))
+        if not isinstance(response, str):
+            st.markdown(f"**🧑 You:** {user_input}")
+            placeholder = st.empty()
+            streamed = ""
+            for token in iterate_async(response):
+                streamed += token
+                placeholder.markdown(f"**🤖 CardAssist:** {streamed}▌")
+            response = streamed.strip()
+        apply_session_state(session)
         update_chat_history(user_input, response)
         logger.debug(f"Updated chat history with user input and response: {response}")
         st.rerun()
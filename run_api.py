@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+import argparse
+import multiprocessing
+import os
+import socket
+import sys
+
+# Parse command-line arguments
+parser = argparse.ArgumentParser(description="Run the CardAssist HTTP/WebSocket API")
+parser.add_argument("--host", type=str, default=os.getenv("API_HOST", "127.0.0.1"), help="Bind address (default: 127.0.0.1)")
+parser.add_argument("--port", type=int, default=int(os.getenv("API_PORT", "8080")), help="Port (default: 8080)")
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=int(os.getenv("API_WORKERS", "1")),
+    help="Worker processes sharing the port (default: 1)"
+)
+parser.add_argument(
+    "--log-level",
+    type=str,
+    default="INFO",
+    choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+    help="Set the logging level (default: INFO)"
+)
+
+def run_worker(host: str, port: int, reuse_port: bool, log_level: str):
+    from api_server import serve
+    serve(host, port, reuse_port=reuse_port, log_level=log_level)
+
+def main():
+    args = parser.parse_args()
+    if args.workers <= 1:
+        run_worker(args.host, args.port, False, args.log_level)
+        return
+
+    if not hasattr(socket, "SO_REUSEPORT"):
+        print("Error: --workers > 1 needs SO_REUSEPORT, which this platform does not support")
+        sys.exit(1)
+    # Workers share sessions through the on-disk store unless another store is configured explicitly;
+    # the metrics endpoint on METRICS_PORT is served by whichever worker binds it first, use /metrics per worker instead
+    os.environ.setdefault("API_SESSION_STORE", "file")
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(target=run_worker, args=(args.host, args.port, True, args.log_level), name=f"api-worker-{i}")
+        for i in range(args.workers)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        print("\nStopped by user")
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# Replays conversation transcripts through the chat pipeline:
+#   python run_batch.py sessions.jsonl --output results.jsonl --concurrency 32
+# Re-running with the same --output resumes after the last finished session.
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+# Parse command-line arguments
+parser = argparse.ArgumentParser(description="Run a JSONL file of chat sessions through CardAssist")
+parser.add_argument("input", help="JSONL sessions: {\"session_id\": ..., \"messages\": [...]} or one {\"session_id\": ..., \"message\": ...} per line")
+parser.add_argument("--output", required=True, help="JSONL results, one line per finished session; also the resume checkpoint")
+parser.add_argument("--concurrency", type=int, default=int(os.getenv("BATCH_CONCURRENCY", "16")),
+                    help="Sessions run at the same time (default: 16)")
+parser.add_argument("--encode-batch", type=int, default=int(os.getenv("BATCH_ENCODE_SIZE", "256")),
+                    help="Messages embedded per encode call (default: 256)")
+parser.add_argument("--no-resume", action="store_true", help="Overwrite --output instead of resuming from it")
+parser.add_argument(
+    "--card-store",
+    help="Card store log the replayed card actions go to (default: a scratch file, never the live store)"
+)
+parser.add_argument("--report", help="Also write the throughput and latency report here as JSON")
+parser.add_argument(
+    "--log-level",
+    type=str,
+    default="WARNING",
+    choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+    help="Set the logging level (default: WARNING)"
+)
+
+def main():
+    args = parser.parse_args()
+    # Card actions and spilled chat history must not touch the live files; both are read at import time
+    with tempfile.TemporaryDirectory(prefix="cardassist-batch-") as scratch:
+        os.environ["CARD_STORE_PATH"] = args.card_store or os.path.join(scratch, "card_states.log")
+        os.environ.setdefault("CHAT_HISTORY_DIR", os.path.join(scratch, "chat_history"))
+        run(args)
+
+def run(args):
+    from batch_runner import KnowledgeUnavailable, format_report, load_sessions, run_batch
+    from utils.async_runtime import run_async
+    from utils.logger import setup_logger
+    from utils.services import get_services
+
+    setup_logger(args.log_level)
+    try:
+        sessions = load_sessions(args.input)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    print(f"Loaded {len(sessions)} sessions, {sum(len(s['messages']) for s in sessions)} messages", file=sys.stderr)
+
+    # The pipeline's clients live on the shared event loop, so the batch runs there too
+    try:
+        services = get_services()
+        report = run_async(run_batch(services, sessions, args.output, max(args.concurrency, 1),
+                                     max(args.encode_batch, 1), resume=not args.no_resume))
+    except (KnowledgeUnavailable, ValueError) as e:
+        # A failed warm-up, or missing configuration such as OPENAI_API_KEY
+        print(f"Error: {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print("\nStopped by user; run again with the same --output to resume")
+        sys.exit(130)
+    print(format_report(report))
+    if report["skipped"]:
+        print(f"{report['skipped']} sessions skipped, already in {args.output}")
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
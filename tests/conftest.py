@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# Tests import the app's modules from the repository root; every relative path they use (logs/, cache/,
+# the card store and its legacy card_states.json) resolves inside a scratch directory instead
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(tempfile.mkdtemp(prefix="cardassist-tests-"))
+os.environ.pop("ANSWER_CACHE_PATH", None)
@@ -0,0 +1,49 @@
+import json
+import numpy as np
+from utils.answer_cache import SemanticAnswerCache, opposite_meaning
+
+def _near(vector, seed: int = 0, noise: float = 0.05):
+    # A second query vector at cosine similarity ~0.99 to the first
+    return vector + noise * np.random.default_rng(seed).standard_normal(vector.shape).astype(np.float32)
+
+def _vector(seed: int = 1):
+    return np.random.default_rng(seed).standard_normal(384).astype(np.float32)
+
+def test_paraphrase_hits():
+    cache = SemanticAnswerCache(path=None)
+    vector = _vector()
+    cache.put("How do I lock my card?", vector, "Use Lock card in the app.")
+    assert cache.get(_near(vector), "How can I lock my card?") == "Use Lock card in the app."
+
+def test_near_antonym_questions_do_not_share_answers():
+    cache = SemanticAnswerCache(path=None)
+    vector = _vector()
+    cache.put("How do I lock my card?", vector, "Use Lock card in the app.")
+    assert cache.get(_near(vector), "How do I unlock my card?") is None
+    assert cache.misses == 1
+
+def test_opposite_candidate_is_skipped_for_a_matching_one():
+    cache = SemanticAnswerCache(path=None)
+    vector = _vector()
+    cache.put("How do I activate my card?", vector, "activate answer")
+    cache.put("How do I deactivate my card?", _near(vector, seed=2, noise=0.01), "deactivate answer")
+    assert cache.get(vector, "How do I deactivate my card?") == "deactivate answer"
+    assert cache.get(vector, "How do I activate my card?") == "activate answer"
+
+def test_opposite_meaning():
+    assert opposite_meaning("How do I enable alerts?", "How do I disable alerts?")
+    assert opposite_meaning("Why is my card declined?", "Why is my card not declined?")
+    assert opposite_meaning("I can't log in", "I can log in")
+    assert not opposite_meaning("How do I change my PIN?", "How can I change my PIN?")
+
+def test_saves_are_batched_and_flushed(tmp_path):
+    path = tmp_path / "answers.json"
+    cache = SemanticAnswerCache(path=str(path))
+    cache.put("How do I change my PIN?", _vector(), "In the app.")
+    cache.put("Where are my card limits?", _vector(2), "Under Limits.")
+    # Written by the debounce timer, not by put()
+    assert not path.exists()
+    cache.flush()
+    assert len(json.loads(path.read_text())["entries"]) == 2
+    reloaded = SemanticAnswerCache(path=str(path))
+    assert reloaded.get(_vector(2), "Where are my card limits?") == "Under Limits."
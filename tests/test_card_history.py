@@ -0,0 +1,57 @@
+import math
+import pytest
+from utils.card_history import CardActionHistory
+
+def _history() -> CardActionHistory:
+    # Cards 1..5 activated, then cards 1..3 deactivated, one second apart
+    history = CardActionHistory()
+    for i in range(5):
+        history.append(f"{i + 1:09d}", "activated", timestamp=i)
+    for i in range(3):
+        history.append(f"{i + 1:09d}", "deactivated", timestamp=5 + i)
+    return history
+
+def _cards(entries: list) -> list:
+    return [card for card, _, _ in entries]
+
+def test_latest_pages_newest_first():
+    history = _history()
+    assert _cards(history.latest(limit=3)) == ["000000003", "000000002", "000000001"]
+    assert _cards(history.latest(limit=3, offset=3)) == ["000000005", "000000004", "000000003"]
+    assert _cards(history.latest(limit=3, offset=6)) == ["000000002", "000000001"]
+    assert history.latest(limit=3, offset=8) == []
+    assert history.latest(limit=3, offset=20) == []
+
+def test_latest_by_action_pages_only_that_action():
+    history = _history()
+    assert _cards(history.latest("activated", limit=2)) == ["000000005", "000000004"]
+    assert _cards(history.latest("activated", limit=2, offset=4)) == ["000000001"]
+    assert [action for _, action, _ in history.latest("deactivated", limit=10)] == ["deactivated"] * 3
+
+def test_for_card_returns_that_card_newest_first():
+    history = _history()
+    assert history.for_card("000000002") == [("000000002", "deactivated", 6), ("000000002", "activated", 1)]
+    assert history.for_card("000000002", limit=1, offset=1) == [("000000002", "activated", 1)]
+    assert history.for_card("000000009") == []
+
+def test_counts_and_distinct_cards():
+    history = _history()
+    assert (len(history), history.count("activated"), history.count("deactivated")) == (8, 5, 3)
+    assert history.distinct_cards() == 5
+
+def test_unknown_action_is_rejected():
+    with pytest.raises(ValueError):
+        CardActionHistory().append("000000001", "frozen")
+
+def test_records_round_trip_including_entries_without_timestamps():
+    history = CardActionHistory([("000000001", "activated"), ["000000002", "deactivated", 10.0]])
+    restored = CardActionHistory(history.to_records())
+    assert restored.to_records() == [["000000001", "activated", None], ["000000002", "deactivated", 10.0]]
+    assert math.isnan(restored.latest(limit=2)[1][2])
+
+def test_copy_is_independent():
+    history = _history()
+    copied = history.copy()
+    copied.append("000000009", "activated")
+    assert (len(history), len(copied)) == (8, 9)
+    assert history.for_card("000000009") == []
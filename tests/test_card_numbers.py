@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+from agents.orchestrator import _card_turn
+from utils import card_numbers
+from utils.card_numbers import extract_card_numbers, parse_card_csv
+
+def test_single_and_listed_numbers_keep_first_seen_order():
+    assert extract_card_numbers("activate 222222222, 111111111 and 222222222") == (["222222222", "111111111"], [])
+
+def test_ranges_expand_inclusively_with_leading_zeros():
+    valid, invalid = extract_card_numbers("cards 000000098 to 000000101")
+    assert valid == ["000000098", "000000099", "000000100", "000000101"]
+    assert invalid == []
+    assert extract_card_numbers("123456780-123456781")[0] == ["123456780", "123456781"]
+    assert extract_card_numbers("123456780 through 123456781")[0] == ["123456780", "123456781"]
+
+def test_ranges_over_the_limit_or_backwards_are_invalid(monkeypatch):
+    monkeypatch.setattr(card_numbers, "BULK_MAX_CARDS", 10)
+    assert extract_card_numbers("100000000 to 100000010") == ([], ["100000000-100000010"])
+    assert extract_card_numbers("100000000 to 100000009")[0][-1] == "100000009"
+    assert extract_card_numbers("100000005 to 100000001") == ([], ["100000005-100000001"])
+
+def test_wrong_length_candidates_are_reported_and_short_numbers_ignored():
+    valid, invalid = extract_card_numbers("activate 123456789 and 1234567890, order 4455667, pin 1234")
+    assert valid == ["123456789"]
+    assert invalid == ["1234567890", "4455667"]
+
+def test_csv_ignores_headers_and_reports_short_numbers():
+    data = "card,name\n123456789,Ann\n987654321,Bob\n12345,Eve\n".encode("utf-8-sig")
+    assert parse_card_csv(data) == (["123456789", "987654321"], ["12345"])
+
+def _card_agent(calls):
+    return SimpleNamespace(
+        activate_card=lambda number: calls.append(("activate", number)) or "ok",
+        query_specific_card_status=lambda number: calls.append(("status", number)) or "ok",
+        bulk_activate=lambda numbers, invalid: calls.append(("bulk", numbers, invalid)) or "ok",
+    )
+
+def test_single_card_turn_uses_the_extracted_number():
+    calls = []
+    _card_turn("activate", "activate card #123456789 for order 4455667", _card_agent(calls))
+    _card_turn("query_status", "status of 123456789?", _card_agent(calls))
+    assert calls == [("activate", "123456789"), ("status", "123456789")]
+
+def test_out_of_range_candidate_is_not_taken_as_a_card():
+    calls = []
+    result = _card_turn("activate", "activate 1234567890", _card_agent(calls))
+    assert calls == []
+    assert result.startswith("❓")
@@ -0,0 +1,96 @@
+import json
+from utils.card_store import CardStateStore
+
+def _store(tmp_path, **kwargs):
+    kwargs.setdefault("legacy_path", str(tmp_path / "card_states.json"))
+    kwargs.setdefault("fsync", False)
+    return CardStateStore(str(tmp_path / "card_states.log"), **kwargs)
+
+def test_replay_rebuilds_state(tmp_path):
+    store = _store(tmp_path)
+    store.record_action("100000001", "active", "activated")
+    store.record_batch(["100000002", "100000003"], "active", "activated", 1.0)
+    store.record_action("100000002", "inactive", "deactivated")
+
+    replayed = _store(tmp_path)
+    assert replayed.card_states == {"100000001": "active", "100000002": "inactive", "100000003": "active"}
+    assert len(replayed.card_action_history) == 4
+    assert replayed.card_action_history.count("deactivated") == 1
+
+def test_reset_is_replayed(tmp_path):
+    store = _store(tmp_path)
+    store.record_action("100000001", "active", "activated")
+    store.record_reset()
+    store.record_action("100000002", "active", "activated")
+    assert _store(tmp_path).card_states == {"100000002": "active"}
+
+def test_torn_final_line_is_ignored_and_overwritten(tmp_path):
+    store = _store(tmp_path)
+    store.record_action("100000001", "active", "activated")
+    # A writer that crashed mid-append
+    with open(store.path, "a") as f:
+        f.write('{"op":"batch","cards":["100000002","1000')
+
+    replayed = _store(tmp_path)
+    assert replayed.card_states == {"100000001": "active"}
+
+def test_other_process_appends_are_picked_up(tmp_path):
+    first, second = _store(tmp_path), _store(tmp_path)
+    first.record_action("100000001", "active", "activated")
+    second.refresh()
+    assert second.card_states == {"100000001": "active"}
+    second.record_action("100000002", "inactive", "deactivated")
+    first.refresh()
+    assert first.card_states == {"100000001": "active", "100000002": "inactive"}
+
+def test_compaction_by_another_process_switches_generation(tmp_path):
+    first, second = _store(tmp_path), _store(tmp_path)
+    for i in range(5):
+        first.record_action(f"10000000{i}", "active", "activated")
+    second.refresh()
+    first.compact()
+    first.record_action("100000009", "inactive", "deactivated")
+
+    # The log was replaced under second's offset: it must replay the new file rather than read from the old offset
+    second.refresh()
+    assert second.card_states == first.card_states
+    assert len(second.card_action_history) == 6
+    assert len(_store(tmp_path).card_action_history) == 6
+
+def test_compaction_keeps_history(tmp_path):
+    store = _store(tmp_path)
+    store.record_action("100000001", "active", "activated")
+    store.record_action("100000001", "inactive", "deactivated")
+    store.compact()
+    with open(store.path) as f:
+        records = [json.loads(line) for line in f]
+    assert [record["op"] for record in records] == ["header", "snapshot"]
+    replayed = _store(tmp_path)
+    assert replayed.card_states == {"100000001": "inactive"}
+    assert [action for _, action, _ in replayed.card_action_history.to_records()] == ["activated", "deactivated"]
+
+def test_legacy_json_is_migrated(tmp_path):
+    legacy = tmp_path / "card_states.json"
+    legacy.write_text(json.dumps({
+        "card_states": {"100000001": "active"},
+        "card_action_history": [["100000001", "activated", 1.0]],
+    }))
+    store = _store(tmp_path)
+    assert store.card_states == {"100000001": "active"}
+    assert len(store.card_action_history) == 1
+    store.record_action("100000002", "active", "activated")
+    # The log now exists, so the legacy file is not migrated a second time
+    assert _store(tmp_path).card_states == {"100000001": "active", "100000002": "active"}
+
+def test_existing_large_log_is_not_compacted_on_first_append(tmp_path):
+    store = _store(tmp_path, compact_bytes=1 << 30)
+    for i in range(50):
+        store.record_action(f"{100000000 + i}", "active", "activated")
+    size = store._offset
+
+    restarted = _store(tmp_path, compact_bytes=size // 2)
+    compactions = []
+    restarted.compact_in_background = lambda: compactions.append(True)
+    restarted.record_action("100000999", "active", "activated")
+    assert restarted._compacted_bytes == size
+    assert not compactions
@@ -0,0 +1,50 @@
+import os
+import time
+from utils.chat_history import ChatHistory, prune_spill_files
+
+def _history(directory, count: int, window: int = 4) -> ChatHistory:
+    history = ChatHistory(window=window, directory=str(directory))
+    history.extend(("user" if i % 2 == 0 else "assistant", f"message {i}") for i in range(count))
+    return history
+
+def test_window_stays_bounded_and_older_messages_spill(tmp_path):
+    history = _history(tmp_path, 10)
+    assert len(history) == 10
+    assert history.spilled == 6
+    assert [message for _, message in history] == [f"message {i}" for i in range(6, 10)]
+    assert os.path.exists(history.spill_path)
+
+def test_tail_and_older_page_back_through_the_spill_file(tmp_path):
+    history = _history(tmp_path, 10)
+    assert [message for _, message in history.tail(2)] == ["message 8", "message 9"]
+    assert [message for _, message in history.tail(7)] == [f"message {i}" for i in range(3, 10)]
+    assert [message for _, message in history.older(2)] == ["message 4", "message 5"]
+    assert len(history.tail(100)) == 10
+    assert history.older(100) == history.tail(10)[:6]
+
+def test_context_covers_only_the_last_messages(tmp_path):
+    history = _history(tmp_path, 10)
+    assert "message 9" in history.context
+    assert "message 5" not in history.context
+
+def test_state_round_trip_keeps_the_spill(tmp_path):
+    history = _history(tmp_path, 10)
+    state = history.to_state()
+    restored = ChatHistory.from_state(state)
+    restored.directory = str(tmp_path)
+    assert len(restored) == 10
+    assert restored.tail(10) == history.tail(10)
+
+def test_discard_and_clear_remove_the_spill_file(tmp_path):
+    history = _history(tmp_path, 10)
+    history.clear()
+    assert len(history) == 0
+    assert not os.path.exists(history.spill_path)
+
+def test_prune_removes_only_abandoned_spill_files(tmp_path):
+    old = _history(tmp_path, 10)
+    live = _history(tmp_path, 10)
+    os.utime(old.spill_path, (time.time() - 120, time.time() - 120))
+    assert prune_spill_files(str(tmp_path), ttl=60) == 1
+    assert not os.path.exists(old.spill_path)
+    assert os.path.exists(live.spill_path)
@@ -0,0 +1,79 @@
+import multiprocessing
+import os
+import numpy as np
+from utils.embedding_cache import CachedEmbeddingModel, EmbeddingCache
+
+DIM = 8
+
+def _vectors(keys: list) -> np.ndarray:
+    # Each key's vector is derived from the key, so any row can be checked against the key it is filed under
+    return np.stack([np.random.default_rng(int(key[:8], 16)).standard_normal(DIM).astype(np.float32) for key in keys])
+
+def _write(cache_dir: str, worker: int, rounds: int):
+    cache = EmbeddingCache("test-model", cache_dir)
+    for i in range(rounds):
+        # Every worker also writes a shared key, so the same key races between writers
+        keys = [cache.key(f"worker {worker} text {i}"), cache.key(f"shared {i}")]
+        cache.put_many(keys, _vectors(keys))
+
+class _Model:
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, texts, batch_size=None, convert_to_numpy=True, **kwargs):
+        self.calls.append(list(texts))
+        return np.stack([np.full(DIM, len(text), dtype=np.float32) for text in texts])
+
+def test_concurrent_writers_append_without_losing_or_mixing_rows(tmp_path):
+    cache_dir = str(tmp_path)
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_write, args=(cache_dir, worker, 20)) for worker in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+
+    cache = EmbeddingCache("test-model", cache_dir)
+    keys = [cache.key(f"worker {w} text {i}") for w in range(4) for i in range(20)]
+    keys += [cache.key(f"shared {i}") for i in range(20)]
+    assert len(cache) == len(keys)
+    found = cache.get_many(keys)
+    assert np.allclose(np.stack([found[key] for key in keys]), _vectors(keys))
+    assert os.path.getsize(cache.data_path) == len(keys) * DIM * 4
+
+def test_reader_sees_keys_appended_by_another_writer(tmp_path):
+    reader = EmbeddingCache("test-model", str(tmp_path))
+    writer = EmbeddingCache("test-model", str(tmp_path))
+    keys = [writer.key("a"), writer.key("b")]
+    writer.put_many(keys, _vectors(keys))
+    assert set(reader.get_many(keys)) == set(keys)
+
+def test_torn_tail_is_dropped_by_the_next_writer(tmp_path):
+    cache = EmbeddingCache("test-model", str(tmp_path))
+    first = [cache.key("a")]
+    cache.put_many(first, _vectors(first))
+    # A writer died after its rows and half a key line
+    with open(cache.data_path, "ab") as f:
+        f.write(b"\0" * DIM * 4)
+    with open(cache.index_path, "ab") as f:
+        f.write(b'"deadbeef')
+
+    other = EmbeddingCache("test-model", str(tmp_path))
+    assert len(other) == 1
+    second = [other.key("b")]
+    other.put_many(second, _vectors(second))
+    fresh = EmbeddingCache("test-model", str(tmp_path))
+    found = fresh.get_many(first + second)
+    assert np.allclose(np.stack([found[key] for key in first + second]), _vectors(first + second))
+
+def test_queries_stay_in_memory_and_chunks_go_to_disk(tmp_path):
+    model = _Model()
+    cached = CachedEmbeddingModel(model, "test-model", EmbeddingCache("test-model", str(tmp_path)), query_cache_size=2)
+    cached.encode(["chunk one", "chunk two"])
+    cached.encode_queries(["q1", "q2"])
+    cached.encode_queries(["q1", "q3"])
+    cached.encode_queries(["q2"])
+    assert len(cached.cache) == 2
+    # q2 was the least recently used when q3 arrived, so it is embedded again
+    assert model.calls == [["chunk one", "chunk two"], ["q1", "q2"], ["q3"], ["q2"]]
@@ -0,0 +1,76 @@
+import asyncio
+import numpy as np
+from agents.knowledge_agent import KnowledgeAgent
+from utils.answer_cache import SemanticAnswerCache
+from utils.hybrid_retrieval import LocalReranker, reciprocal_rank_fusion
+from utils.lexical_index import BM25Index
+
+CHUNKS = [
+    "Error E-1023 means the card was blocked after three wrong PIN attempts.",
+    "To change your PIN, open the card details page and choose Change PIN.",
+    "Card disputes are opened from the transaction list within 60 days.",
+    "Lost or stolen cards should be reported at once so the card can be blocked.",
+]
+
+class _Embedder:
+    # One dimension per chunk: a chunk's vector is its one-hot row, so cosine scores are easy to reason about
+    def encode(self, sentences, **kwargs):
+        rows = [sentences] if isinstance(sentences, str) else list(sentences)
+        vectors = np.zeros((len(rows), len(CHUNKS)), dtype=np.float32)
+        for i, text in enumerate(rows):
+            vectors[i, CHUNKS.index(text)] = 1.0
+        return vectors
+
+class _Results:
+    def __init__(self, hits):
+        self.hits = list(hits)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.hits:
+            raise StopAsyncIteration
+        return self.hits.pop(0)
+
+class _SearchClient:
+    def __init__(self, ranked):
+        self.ranked = ranked
+
+    async def search(self, **kwargs):
+        return _Results({"content": content, "@search.score": score} for content, score in self.ranked)
+
+def test_bm25_ranks_exact_terms_first():
+    index = BM25Index.from_texts(CHUNKS)
+    hits = index.search("what does error E-1023 mean", 3)
+    assert hits[0][0] == 0
+    assert all(hits[i][1] >= hits[i + 1][1] for i in range(len(hits) - 1))
+    assert index.search("unrelated words entirely", 3) == []
+
+def test_bm25_caps_k_at_matching_documents():
+    index = BM25Index.from_texts(CHUNKS)
+    assert [position for position, _ in index.search("dispute disputes", 10)] == [2]
+
+def test_rrf_rewards_agreement_and_normalises_scores():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "a", "d"]])
+    assert [content for content, _ in fused[:2]] in (["a", "b"], ["b", "a"])
+    assert {content for content, _ in fused[2:]} == {"c", "d"}
+    assert reciprocal_rank_fusion([["x"], ["x"]])[0][1] == 1.0
+    assert all(0.0 < score <= 1.0 for _, score in fused)
+
+def test_local_reranker_scores_stay_at_most_one():
+    vectors = _Embedder().encode(CHUNKS)
+    reranked = LocalReranker().rerank("change PIN", vectors[1], CHUNKS, vectors)
+    assert reranked[0][0] == CHUNKS[1]
+    assert reranked[0][1] <= 1.0
+
+def test_hybrid_context_keeps_a_score_cut_off():
+    # Both retrievers agree on the PIN chunk; the chunks only one of them found fall below the fused cut-off
+    vector_ranked = [(CHUNKS[1], 0.9), (CHUNKS[3], 0.2)]
+    agent = KnowledgeAgent(_Embedder(), CHUNKS, _SearchClient(vector_ranked), None, SemanticAnswerCache(path=None),
+                           BM25Index.from_texts(CHUNKS), retrieval_mode="hybrid")
+    # Set after construction: None there means the RERANKER default
+    agent.reranker = None
+    context = asyncio.run(agent.retrieve_context("change PIN page", _Embedder().encode(CHUNKS[1]).tolist()))
+    assert context.chunks == [CHUNKS[1]]
+    assert context.candidates > 1
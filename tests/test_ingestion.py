@@ -0,0 +1,64 @@
+import asyncio
+import numpy as np
+from utils import search_backends
+from utils.ingestion import IngestionStats, TokenCounter, batched, iter_chunks
+from utils.search_backends import create_local_search_client
+
+def _page(path: str, words: int, sentence: int = 10):
+    # Sentences of `sentence` numbered words, so every token is identifiable
+    text = " ".join(f"w{i}" + ("." if (i + 1) % sentence == 0 else "") for i in range(words))
+    return (path, 0, text)
+
+def _words(chunk: str) -> list:
+    return [word.rstrip(".") for word in chunk.split()]
+
+def test_chunks_respect_the_token_budget_and_overlap():
+    stats = IngestionStats()
+    chunks = list(iter_chunks([_page("a.txt", 100)], TokenCounter(), max_tokens=30, overlap=10, stats=stats))
+    assert stats.chunks == len(chunks) > 1
+    assert all(len(chunk.split()) <= 30 for chunk in chunks)
+    for previous, current in zip(chunks, chunks[1:]):
+        # The next chunk starts with the last whole sentence of the previous one
+        assert _words(current)[:10] == _words(previous)[-10:]
+    # Every word is covered, in order
+    covered = []
+    for chunk in chunks:
+        covered.extend(word for word in _words(chunk) if not covered or int(word[1:]) > int(covered[-1][1:]))
+    assert covered == [f"w{i}" for i in range(100)]
+
+def test_overlap_never_crosses_documents():
+    chunks = list(iter_chunks([_page("a.txt", 25), ("b.txt", 0, "Other document.")], TokenCounter(),
+                              max_tokens=30, overlap=10))
+    assert chunks[-1] == "Other document."
+    assert "w" not in chunks[-1]
+
+def test_sentences_longer_than_the_window_are_split():
+    chunks = list(iter_chunks([_page("a.txt", 100, sentence=100)], TokenCounter(), max_tokens=30, overlap=0))
+    assert all(len(chunk.split()) <= 30 for chunk in chunks)
+    assert sum(len(chunk.split()) for chunk in chunks) == 100
+
+def test_batched_keeps_the_remainder():
+    assert [len(batch) for batch in batched(range(10), 4)] == [4, 4, 2]
+
+class _Embedder:
+    def __init__(self):
+        self.batches = []
+
+    def encode(self, texts):
+        self.batches.append(len(texts))
+        return np.random.default_rng(len(self.batches)).standard_normal((len(texts), 16)).astype(np.float32)
+
+def test_local_index_is_built_batch_by_batch_from_a_stream(monkeypatch):
+    monkeypatch.setattr(search_backends, "batched", lambda iterable: batched(iterable, 8))
+    embedder = _Embedder()
+
+    def stream():
+        for i in range(30):
+            yield f"chunk {i}"
+        # A repeated chunk maps onto the same document
+        yield "chunk 0"
+
+    client = create_local_search_client("numpy", stream(), embedder)
+    assert len(client) == 30
+    assert embedder.batches == [8, 8, 8, 6]
+    assert asyncio.run(client.get_document_count()) == 30
@@ -0,0 +1,52 @@
+import asyncio
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from agents.intent_agent import IntentAgent
+from agents.intent_examples import INTENT_EXAMPLES
+from utils.chat_history import ChatHistory
+from utils.metrics import intent_centroid_confidence, intent_decisions
+
+@pytest.mark.parametrize("message, intent", [
+    ("bye", "end"),
+    ("Thanks a lot!", "end"),
+    ("ok, that's all", "end"),
+    ("Activate card 123456789", "activate"),
+    ("please block my card #987654321", "deactivate"),
+    ("What is the status of card 123456789?", "query_status"),
+    ("Reset all cards", "reset_cards"),
+])
+def test_rules_settle_unambiguous_phrasings(message, intent):
+    assert IntentAgent(None).classify_by_rules(message).intent == intent
+
+@pytest.mark.parametrize("message", ["done", "ok done", "great", "Great!", "activate my card", "status of 12345"])
+def test_rules_leave_context_dependent_replies_to_later_tiers(message):
+    # "done" can answer "let me know when you have the card number"; only the centroid or LLM tier sees that
+    assert IntentAgent(None).classify_by_rules(message) is None
+
+def test_decisions_are_counted_by_tier():
+    before = intent_decisions.value(tier="rule", intent="end")
+    asyncio.run(IntentAgent(None).classify_intent("bye", []))
+    assert intent_decisions.value(tier="rule", intent="end") == before + 1
+
+def test_centroid_confidence_is_observed_for_accepted_and_escalated_decisions():
+    class Embedder:
+        # Every text maps to the same direction, so all centroids tie and confidence is 1 / len(labels)
+        def encode(self, sentences, **kwargs):
+            return np.ones((len(sentences), 4), dtype=np.float32)
+
+    class LLM:
+        async def create(self, **kwargs):
+            message = SimpleNamespace(content="knowledge")
+            return SimpleNamespace(usage=None, choices=[SimpleNamespace(message=message)])
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=LLM()))
+    escalated = intent_centroid_confidence.count(outcome="escalated")
+    accepted = intent_centroid_confidence.count(outcome="accepted")
+    agent = IntentAgent(client, Embedder(), confidence_threshold=0.01)
+    assert asyncio.run(agent.classify_intent("how do fees work", ChatHistory())) in INTENT_EXAMPLES
+    agent.confidence_threshold = 0.99
+    assert asyncio.run(agent.classify_intent("how do fees work", ChatHistory())) == "knowledge"
+    assert intent_centroid_confidence.count(outcome="accepted") == accepted + 1
+    assert intent_centroid_confidence.count(outcome="escalated") == escalated + 1
+    assert intent_decisions.value(tier="llm", intent="knowledge") >= 1
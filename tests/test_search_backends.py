@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+from utils.search_backends import CompactVectors, FaissSearchClient, NumpySearchClient
+
+DIM = 32
+CLIENTS = [(NumpySearchClient, dtype) for dtype in ("float32", "float16", "int8")]
+CLIENTS += [(FaissSearchClient, dtype) for dtype in ("float32", "int8")]
+
+def _vectors(count: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((count, DIM)).astype(np.float32)
+
+def _documents(vectors, start: int = 0, prefix: str = "doc") -> list:
+    return [{"id": f"{prefix}{start + i}", "content": f"content {start + i}", "embedding": vector}
+            for i, vector in enumerate(vectors)]
+
+def _client(client_class, dtype):
+    try:
+        return client_class(dtype=dtype)
+    except ImportError:
+        pytest.skip("faiss is not installed")
+
+def _best(client, vector) -> str:
+    return client.search(vector_queries=[{"vector": vector, "k": 1}], top=1)[0]["id"]
+
+@pytest.mark.parametrize("client_class, dtype", CLIENTS)
+def test_batched_uploads_find_every_document(client_class, dtype):
+    vectors = _vectors(300)
+    client = _client(client_class, dtype)
+    for start in range(0, len(vectors), 64):
+        client.merge_or_upload_documents(_documents(vectors[start:start + 64], start))
+    assert len(client) == 300
+    assert all(_best(client, vectors[i]) == f"doc{i}" for i in range(0, 300, 7))
+
+@pytest.mark.parametrize("client_class, dtype", CLIENTS)
+def test_update_replaces_the_vector_and_content(client_class, dtype):
+    vectors = _vectors(100)
+    client = _client(client_class, dtype)
+    client.merge_or_upload_documents(_documents(vectors))
+    replacement = _vectors(1, seed=9)[0]
+    client.merge_or_upload_documents([{"id": "doc5", "content": "new content", "embedding": replacement}])
+    assert len(client) == 100
+    hit = client.search(vector_queries=[{"vector": replacement, "k": 1}], top=1)[0]
+    assert (hit["id"], hit["content"]) == ("doc5", "new content")
+
+@pytest.mark.parametrize("client_class, dtype", CLIENTS)
+def test_delete_then_append_keeps_positions_consistent(client_class, dtype):
+    vectors = _vectors(120)
+    client = _client(client_class, dtype)
+    client.merge_or_upload_documents(_documents(vectors[:100]))
+    client.delete_documents([{"id": f"doc{i}"} for i in range(0, 100, 2)])
+    client.merge_or_upload_documents(_documents(vectors[100:], 100))
+    assert len(client) == 70
+    assert _best(client, vectors[51]) == "doc51"
+    assert _best(client, vectors[110]) == "doc110"
+    assert all(hit["id"] != "doc50" for hit in client.search(vector_queries=[{"vector": vectors[50], "k": 5}], top=5))
+
+def test_repeated_id_within_one_upload_keeps_the_last_version():
+    vectors = _vectors(2)
+    client = NumpySearchClient(dtype="float32")
+    client.merge_or_upload_documents([{"id": "a", "content": "first", "embedding": vectors[0]},
+                                      {"id": "a", "content": "second", "embedding": vectors[1]}])
+    assert len(client) == 1
+    hit = client.search(vector_queries=[{"vector": vectors[1], "k": 1}], top=1)[0]
+    assert hit["content"] == "second"
+    assert hit["@search.score"] == pytest.approx(1.0, abs=1e-5)
+
+def test_appends_grow_capacity_geometrically():
+    vectors = CompactVectors(np.empty((0, 0), dtype=np.float32), "int8")
+    capacities = set()
+    for start in range(0, 1000, 10):
+        vectors.append(_vectors(10, seed=start))
+        capacities.add(vectors.capacity)
+    assert len(vectors) == 1000
+    assert len(capacities) <= 6
+    assert vectors.exact().shape == (1000, DIM)
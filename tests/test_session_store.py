@@ -0,0 +1,82 @@
+import asyncio
+import json
+import os
+import time
+from utils.chat_history import ChatHistory
+from utils.session_store import FileSessionStore, MemorySessionStore, new_conversation, session_from_state, state_from_session
+
+def _with_spill(state: dict) -> dict:
+    # A conversation long enough to have spilled older messages to disk
+    history = ChatHistory(window=4)
+    history.extend(("user", f"message {i}") for i in range(10))
+    state["chat_history"] = history.to_state()
+    return state
+
+def _age(store, session_id: str, seconds: float):
+    path = store._path(session_id)
+    with open(path) as f:
+        state = json.load(f)
+    state["updated_at"] -= seconds
+    with open(path, "w") as f:
+        json.dump(state, f)
+    os.utime(path, (time.time() - seconds, time.time() - seconds))
+
+def test_round_trip_keeps_conversation_state(tmp_path):
+    store = FileSessionStore(str(tmp_path / "sessions"))
+
+    async def run():
+        session_id = await store.create()
+        session = session_from_state(await store.load(session_id))
+        session.chat_history.append(("user", "hello"))
+        session.last_intent = "knowledge"
+        await store.save(session_id, state_from_session(session))
+        return session_from_state(await store.load(session_id))
+    session = asyncio.run(run())
+    assert list(session.chat_history) == [("user", "hello")]
+    assert session.last_intent == "knowledge"
+
+def test_expired_session_is_not_loaded(tmp_path):
+    store = FileSessionStore(str(tmp_path / "sessions"), ttl=60)
+    session_id = asyncio.run(store.create())
+    _age(store, session_id, 120)
+    assert asyncio.run(store.load(session_id)) is None
+
+def test_sweep_removes_expired_files_and_their_spills(tmp_path):
+    store = FileSessionStore(str(tmp_path / "sessions"), ttl=60)
+    old_id, live_id = "a" * 32, "b" * 32
+    store._write(old_id, _with_spill(new_conversation()))
+    store._write(live_id, _with_spill(new_conversation()))
+    old_spill = ChatHistory.from_state(json.load(open(store._path(old_id)))["chat_history"]).spill_path
+    assert os.path.exists(old_spill)
+    _age(store, old_id, 120)
+    with open(os.path.join(store.directory, f"{old_id}.json.123.tmp"), "w") as f:
+        f.write("{")
+    os.utime(os.path.join(store.directory, f"{old_id}.json.123.tmp"), (time.time() - 120, time.time() - 120))
+
+    assert store._expire() == 1
+    assert sorted(os.listdir(store.directory)) == [f"{live_id}.json"]
+    assert not os.path.exists(old_spill)
+    assert asyncio.run(store.load(live_id)) is not None
+
+def test_sweep_runs_on_create_at_most_once_per_interval(tmp_path):
+    store = FileSessionStore(str(tmp_path / "sessions"), ttl=60, sweep_interval=3600)
+    sweeps = []
+    store._expire = lambda: sweeps.append(1)
+
+    async def run():
+        await store.create()
+        await store.create()
+        await asyncio.sleep(0.05)
+    asyncio.run(run())
+    assert sweeps == [1]
+
+def test_memory_store_expires_on_create():
+    store = MemorySessionStore(ttl=60)
+
+    async def run():
+        session_id = await store.create()
+        store._sessions[session_id]["updated_at"] -= 120
+        await store.create()
+        return session_id
+    session_id = asyncio.run(run())
+    assert session_id not in store._sessions
@@ -0,0 +1,139 @@
+import asyncio
+import numpy as np
+import pytest
+from utils.single_flight import SingleFlight, call_key, was_coalesced
+
+def test_key_ignores_keyword_order_and_vector_formatting():
+    vector = [0.1, 0.2, 0.3]
+    first = call_key("search", top=3, vector=np.array(vector))
+    assert first == call_key("search", vector=np.array(vector, dtype=np.float64), top=3)
+    assert call_key("search", top=3) != call_key("search", top=4)
+    assert call_key("search", top=3) != call_key("chat", top=3)
+
+def test_overlapping_calls_share_one_request():
+    async def main():
+        flights, calls, coalesced = SingleFlight(), [], []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "result"
+
+        async def caller():
+            result = await flights.do("search", "key", fetch)
+            coalesced.append(was_coalesced())
+            return result
+
+        results = await asyncio.gather(*(caller() for _ in range(5)))
+        return results, calls, sorted(coalesced), flights.in_flight()
+
+    results, calls, coalesced, in_flight = asyncio.run(main())
+    assert results == ["result"] * 5
+    assert calls == [1]
+    assert coalesced == [False, True, True, True, True]
+    assert in_flight == 0
+
+def test_cancelled_leader_does_not_cancel_the_call_for_joiners():
+    async def main():
+        flights, calls = SingleFlight(), []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "result"
+
+        leader = asyncio.create_task(flights.do("search", "key", fetch))
+        await asyncio.sleep(0)
+        joiner = asyncio.create_task(flights.do("search", "key", fetch))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await joiner, calls
+
+    assert asyncio.run(main()) == ("result", [1])
+
+def test_errors_reach_every_caller_and_the_next_call_starts_fresh():
+    async def main():
+        flights, calls = SingleFlight(), []
+
+        async def failing():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            raise ValueError("upstream failed")
+
+        results = await asyncio.gather(*(flights.do("chat", "key", failing) for _ in range(3)), return_exceptions=True)
+        await flights.do("chat", "key", lambda: asyncio.sleep(0, result="ok"))
+        return results, calls
+
+    results, calls = asyncio.run(main())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert calls == [1]
+
+class _Tokens:
+    # Yields each token after `gate` lets it through, so the test controls how far the stream has got
+    def __init__(self, tokens):
+        self.tokens = list(tokens)
+        self.gate = asyncio.Semaphore(0)
+
+    async def __aiter__(self):
+        for token in self.tokens:
+            await self.gate.acquire()
+            yield token
+
+def test_caller_joining_mid_stream_gets_the_replay_then_the_rest():
+    async def main():
+        flights, opened = SingleFlight(), []
+        tokens = _Tokens(["a", "b", "c", "d"])
+
+        async def open_stream():
+            opened.append(1)
+            return tokens
+
+        leader = await flights.stream("chat_stream", "key", open_stream)
+        tokens.gate.release()
+        tokens.gate.release()
+        assert [await leader.__anext__(), await leader.__anext__()] == ["a", "b"]
+
+        joiner = await flights.stream("chat_stream", "key", open_stream)
+        for _ in range(2):
+            tokens.gate.release()
+        return [token async for token in leader], [token async for token in joiner], opened
+
+    leader, joiner, opened = asyncio.run(main())
+    assert leader == ["c", "d"]
+    assert joiner == ["a", "b", "c", "d"]
+    assert opened == [1]
+
+def test_stream_continues_for_joiners_when_the_leader_stops_reading():
+    async def main():
+        flights = SingleFlight()
+        tokens = _Tokens(["a", "b", "c"])
+
+        async def open_stream():
+            return tokens
+
+        leader = await flights.stream("chat_stream", "key", open_stream)
+        joiner = await flights.stream("chat_stream", "key", open_stream)
+        tokens.gate.release()
+        assert await leader.__anext__() == "a"
+        await leader.aclose()
+        for _ in range(2):
+            tokens.gate.release()
+        return [token async for token in joiner]
+
+    assert asyncio.run(main()) == ["a", "b", "c"]
+
+def test_disabled_single_flight_sends_every_call():
+    async def main():
+        flights, calls = SingleFlight(enabled=False), []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "result"
+
+        await asyncio.gather(*(flights.do("search", "key", fetch) for _ in range(3)))
+        return calls
+
+    assert asyncio.run(main()) == [1, 1, 1]
@@ -0,0 +1,89 @@
+import asyncio
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from agents import orchestrator
+from agents.knowledge_agent import KnowledgeAgent
+from utils.answer_cache import SemanticAnswerCache
+from utils.session_state import new_session_state
+from utils.speculation import SpeculationStats
+
+class _Embedder:
+    def encode(self, sentences, **kwargs):
+        return np.ones((len(sentences), 4), dtype=np.float32)
+
+class _IntentAgent:
+    def __init__(self, error=None, intent="knowledge", after=None):
+        self.error = error
+        self.intent = intent
+        # Classification finishes once the speculative work reaches this point
+        self.after = after
+
+    def classify_by_rules(self, user_input):
+        return None
+
+    async def classify_intent(self, user_input, chat_history):
+        if self.after is not None:
+            while not self.after():
+                await asyncio.sleep(0.001)
+        if self.error is not None:
+            raise self.error
+        return self.intent
+
+def _services(intent_agent, knowledge_agent):
+    return SimpleNamespace(intent_agent=intent_agent, knowledge_agent=knowledge_agent, card_agent=lambda session: None)
+
+def _knowledge_agent(cache):
+    agent = KnowledgeAgent(_Embedder(), [], None, None, cache, retrieval_mode="vector")
+    agent.prepared = 0
+
+    async def retrieve(query, query_vector):
+        agent.prepared += 1
+        await asyncio.sleep(1)
+        return "context"
+    agent.retrieve = retrieve
+    return agent
+
+def _speculation_class(stats):
+    from utils import speculation
+
+    class Recorded(speculation.Speculation):
+        created = []
+
+        def __init__(self, coro):
+            super().__init__(coro, stats)
+            Recorded.created.append(self)
+    return Recorded
+
+def test_failed_classification_discards_the_speculation(monkeypatch):
+    stats = SpeculationStats()
+    recorded = _speculation_class(stats)
+    monkeypatch.setattr(orchestrator, "SPECULATIVE_RETRIEVAL", True)
+    monkeypatch.setattr(orchestrator, "Speculation", recorded)
+    cache = SemanticAnswerCache(path=None)
+    services = _services(_IntentAgent(error=RuntimeError("upstream down")), _knowledge_agent(cache))
+
+    async def turn():
+        with pytest.raises(RuntimeError):
+            await orchestrator.handle_user_input("How do I change my PIN?", new_session_state(), services)
+        task = recorded.created[0].task
+        await asyncio.sleep(0)
+        return task
+    task = asyncio.run(turn())
+    assert task.cancelled()
+    assert stats.misses == 1 and stats.hits == 0
+
+def test_discarded_speculation_does_not_count_answer_cache_lookups(monkeypatch):
+    stats = SpeculationStats()
+    monkeypatch.setattr(orchestrator, "SPECULATIVE_RETRIEVAL", True)
+    monkeypatch.setattr(orchestrator, "Speculation", _speculation_class(stats))
+    cache = SemanticAnswerCache(path=None)
+    knowledge_agent = _knowledge_agent(cache)
+    services = _services(_IntentAgent(intent="query_all_status", after=lambda: knowledge_agent.prepared),
+                         knowledge_agent)
+    services.card_agent = lambda session: SimpleNamespace(query_all_status=lambda: "no cards")
+
+    intent, result = asyncio.run(orchestrator.handle_user_input("How do I change my PIN?", new_session_state(), services))
+    assert (intent, result) == ("query_all_status", "no cards")
+    assert cache.hits == 0 and cache.misses == 0
+    assert stats.misses == 1
@@ -0,0 +1,215 @@
+import asyncio
+import gc
+import time
+from types import SimpleNamespace
+from utils.upstream import ScheduledOpenAI, UpstreamScheduler, _HeldStream, _priority, priority
+
+class Throttled(Exception):
+    def __init__(self, retry_after: str):
+        super().__init__("429")
+        self.status_code = 429
+        self.response = SimpleNamespace(status_code=429, headers={"retry-after": retry_after})
+
+def test_waiting_calls_run_in_priority_order():
+    async def main():
+        scheduler = UpstreamScheduler("test", max_concurrency=1)
+        await scheduler.acquire(priority_class="interactive")
+        order = []
+
+        async def waiter(name):
+            await scheduler.acquire(priority_class=name)
+            order.append(name)
+            scheduler.release()
+
+        tasks = [asyncio.create_task(waiter(name)) for name in ("batch", "generation", "interactive", "batch")]
+        await asyncio.sleep(0)
+        assert len(scheduler) == 4
+        scheduler.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(main()) == ["interactive", "generation", "batch", "batch"]
+
+def test_throttled_call_pauses_every_queued_call():
+    async def main():
+        scheduler = UpstreamScheduler("test", max_concurrency=4, backoff_base=0)
+        attempts = []
+
+        async def throttled_once():
+            attempts.append(time.monotonic())
+            if len(attempts) == 1:
+                raise Throttled("0.2")
+            return "ok"
+
+        async def other():
+            return time.monotonic()
+
+        started = time.monotonic()
+        first = asyncio.create_task(scheduler.call(throttled_once))
+        await asyncio.sleep(0.05)
+        # Queued after the 429: must wait out the same Retry-After
+        other_ran = await scheduler.call(other)
+        assert await first == "ok"
+        return started, attempts, other_ran
+
+    started, attempts, other_ran = asyncio.run(main())
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.19
+    assert other_ran - started >= 0.19
+
+def test_non_retryable_errors_are_raised_without_retry():
+    async def main():
+        scheduler = UpstreamScheduler("test", max_concurrency=1)
+        calls = []
+
+        async def bad_request():
+            calls.append(1)
+            raise ValueError("bad request")
+
+        try:
+            await scheduler.call(bad_request)
+        except ValueError:
+            pass
+        return calls, scheduler.active
+
+    calls, active = asyncio.run(main())
+    assert calls == [1]
+    assert active == 0
+
+def test_slot_granted_to_a_cancelled_caller_is_returned():
+    async def main():
+        scheduler = UpstreamScheduler("test", max_concurrency=1)
+        await scheduler.acquire()
+        waiter = asyncio.create_task(scheduler.acquire())
+        await asyncio.sleep(0)
+        # Grant the slot and cancel the waiter before it gets to run
+        scheduler.release()
+        waiter.cancel()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            pass
+        assert scheduler.active == 0
+        await asyncio.wait_for(scheduler.acquire(), 1)
+        return scheduler.active
+
+    assert asyncio.run(main()) == 1
+
+def test_caller_cancelled_while_queued_is_skipped():
+    async def main():
+        scheduler = UpstreamScheduler("test", max_concurrency=1)
+        await scheduler.acquire()
+        cancelled = asyncio.create_task(scheduler.acquire())
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        scheduler.release()
+        await asyncio.wait_for(scheduler.acquire(), 1)
+        return len(scheduler), scheduler.active
+
+    assert asyncio.run(main()) == (0, 1)
+
+def test_abandoned_stream_is_closed_and_released():
+    class Stream:
+        closed = False
+
+        def __aiter__(self):
+            return self
+
+        async def __anext__(self):
+            return "token"
+
+        async def close(self):
+            self.closed = True
+
+    async def main():
+        stream, released = Stream(), []
+        held = _HeldStream(stream, lambda: released.append(True))
+        assert await held.__anext__() == "token"
+        await held.aclose()
+        await held.aclose()
+        return stream.closed, released
+
+    assert asyncio.run(main()) == (True, [True])
+
+def test_stream_that_is_never_read_releases_its_slot():
+    async def main():
+        scheduler = UpstreamScheduler("test", max_concurrency=1)
+
+        async def open_stream():
+            return _Stream([])
+
+        await scheduler.call(open_stream, hold=_HeldStream)
+        assert scheduler.active == 1
+        # Dropped without iterating or closing
+        gc.collect()
+        await asyncio.sleep(0)
+        return scheduler.active
+
+    assert asyncio.run(main()) == 0
+
+class _Stream:
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.chunks:
+            raise StopAsyncIteration
+        return self.chunks.pop(0)
+
+    async def close(self):
+        pass
+
+class _Completions:
+    def __init__(self, usage):
+        self.usage = usage
+
+    async def create(self, **kwargs):
+        if kwargs.get("stream"):
+            return _Stream([SimpleNamespace(usage=None), SimpleNamespace(usage=self.usage)])
+        return SimpleNamespace(usage=self.usage)
+
+def _client(scheduler, total_tokens):
+    completions = _Completions(SimpleNamespace(total_tokens=total_tokens))
+    return ScheduledOpenAI(SimpleNamespace(chat=SimpleNamespace(completions=completions), models=None), scheduler)
+
+def test_token_budget_is_settled_from_reported_usage():
+    async def main():
+        scheduler = UpstreamScheduler("test", tpm=6000)
+        client = _client(scheduler, total_tokens=50)
+        await client.chat.completions.create(messages=[{"role": "user", "content": "hi"}], max_tokens=1000)
+        after_call = scheduler.tokens.level
+        stream = await client.chat.completions.create(messages=[{"role": "user", "content": "hi"}], max_tokens=1000,
+                                                      stream=True)
+        during_stream = scheduler.tokens.level
+        async for _ in stream:
+            pass
+        return after_call, during_stream, scheduler.tokens.level, scheduler.active
+
+    after_call, during_stream, after_stream, active = asyncio.run(main())
+    # Only the 50 reported tokens stay charged, not the 1000-token completion reserve
+    assert 5900 < after_call < 5955
+    assert during_stream < 5000
+    assert 5850 < after_stream < 5905
+    assert active == 0
+
+def test_usage_above_the_estimate_is_charged():
+    async def main():
+        scheduler = UpstreamScheduler("test", tpm=6000)
+        client = _client(scheduler, total_tokens=3000)
+        await client.chat.completions.create(messages=[{"role": "user", "content": "hi"}], max_tokens=10)
+        return scheduler.tokens.level
+
+    assert asyncio.run(main()) <= 3000.5
+
+def test_nested_priority_cannot_raise_urgency():
+    with priority("batch"):
+        with priority("generation"):
+            assert _priority.get() == "batch"
+    with priority("generation"):
+        with priority("batch"):
+            assert _priority.get() == "batch"
+        assert _priority.get() == "generation"
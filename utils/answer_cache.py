@@ -0,0 +1,207 @@
+import atexit
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from utils.logger import setup_logger
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))
+# Optional, e.g. cache/answers.json; unset keeps the cache in memory only
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH")
+# Writes to ANSWER_CACHE_PATH are batched: at most one save per this many seconds, off the caller's thread
+ANSWER_CACHE_SAVE_DELAY = float(os.getenv("ANSWER_CACHE_SAVE_DELAY", "5"))
+
+# Embeddings place a question close to its opposite ("lock my card" / "unlock my card"), so a hit also
+# needs the same negation and no pair of differing words that only differ by a reversing prefix
+NEGATIONS = frozenset("not no never cannot without".split())
+REVERSING_PREFIXES = ("dis", "non", "un", "de", "en", "in", "im")
+WORD_PATTERN = re.compile(r"[a-z0-9']+")
+
+def _terms(text: str) -> set:
+    return set(WORD_PATTERN.findall(text.lower()))
+
+def _negated(terms: set) -> bool:
+    return any(term in NEGATIONS or term.endswith("n't") for term in terms)
+
+def _stem(term: str) -> str:
+    for prefix in REVERSING_PREFIXES:
+        if term.startswith(prefix) and len(term) - len(prefix) >= 3:
+            return term[len(prefix):]
+    return term
+
+def opposite_meaning(query: str, other: str) -> bool:
+    a, b = _terms(query), _terms(other)
+    if _negated(a) != _negated(b):
+        return True
+    # "unlock" / "lock", "deactivate" / "activate", "disable" / "enable"
+    return any(_stem(x) == _stem(y) or _stem(x) == y or x == _stem(y) for x in a - b for y in b - a)
+
+class SemanticAnswerCache:
+    # Answers keyed by query embedding: a lookup hits when cosine similarity reaches the threshold
+    def __init__(self, max_entries: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL,
+                 threshold: float = ANSWER_CACHE_THRESHOLD, path: str = ANSWER_CACHE_PATH):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.path = path
+        self.corpus_hash = None
+        self.hits = 0
+        self.misses = 0
+        self.logger = setup_logger()
+        self._entries = OrderedDict()
+        self._matrix = None
+        self._matrix_keys = []
+        self._next_key = 0
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._save_timer = None
+        if path:
+            self._load()
+            atexit.register(self.flush)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def bind_corpus(self, corpus_hash: str):
+        # Answers are only valid for the knowledge base content they were generated from
+        with self._lock:
+            if self.corpus_hash == corpus_hash:
+                return
+            if self._entries:
+                self.logger.info(f"Knowledge base changed, dropping {len(self._entries)} cached answers")
+            self.corpus_hash = corpus_hash
+            self._entries.clear()
+            self._matrix = None
+            self._schedule_save()
+
+    def get(self, vector, query: str = None, count: bool = True) -> str:
+        # With the query, candidates above the threshold that ask the opposite are skipped. count=False
+        # is for speculative lookups, recorded with record() once their result is actually used
+        with self._lock:
+            self._expire()
+            if not self._entries:
+                self.misses += count
+                return None
+            if self._matrix is None:
+                self._matrix_keys = list(self._entries)
+                self._matrix = np.stack([entry["vector"] for entry in self._entries.values()])
+            similarities = self._matrix @ _normalize(vector)
+            best = None
+            for candidate in np.argsort(-similarities):
+                if similarities[candidate] < self.threshold:
+                    break
+                if query is None or not opposite_meaning(query, self._entries[self._matrix_keys[candidate]]["query"]):
+                    best = int(candidate)
+                    break
+            if best is None:
+                self.misses += count
+                return None
+            key = self._matrix_keys[best]
+            self._entries.move_to_end(key)
+            self.hits += count
+            entry = self._entries[key]
+            self.logger.debug(f"Answer cache hit (similarity {similarities[best]:.3f}) for cached query: {entry['query']}")
+            return entry["answer"]
+
+    def record(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def put(self, query: str, vector, answer: str):
+        with self._lock:
+            self._entries[self._next_key] = {
+                "query": query,
+                "vector": _normalize(vector),
+                "answer": answer,
+                "created_at": time.time(),
+            }
+            self._next_key += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+            self._schedule_save()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+            self._schedule_save()
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        expired = [key for key, entry in self._entries.items() if entry["created_at"] < cutoff]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    def _load(self):
+        try:
+            if not os.path.exists(self.path):
+                return
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            self.corpus_hash = data.get("corpus_hash")
+            for entry in data.get("entries", []):
+                entry["vector"] = np.asarray(entry["vector"], dtype=np.float32)
+                self._entries[self._next_key] = entry
+                self._next_key += 1
+            self._expire()
+            self.logger.info(f"Loaded {len(self._entries)} cached answers from {self.path}")
+        except Exception as e:
+            self.logger.error(f"Error loading answer cache: {e}")
+
+    def _schedule_save(self):
+        # Called with self._lock held; the file is written by a timer thread, never on the caller's (event loop) thread
+        if not self.path or self._save_timer is not None:
+            return
+        self._save_timer = threading.Timer(ANSWER_CACHE_SAVE_DELAY, self.flush)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+
+    def flush(self):
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            # Entries are never modified after put, so a shallow copy is a consistent snapshot
+            corpus_hash, entries = self.corpus_hash, list(self._entries.values())
+        with self._save_lock:
+            self._save(corpus_hash, entries)
+
+    def _save(self, corpus_hash: str, entries: list):
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            entries = [dict(entry, vector=entry["vector"].tolist()) for entry in entries]
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"corpus_hash": corpus_hash, "entries": entries}, f, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            self.logger.error(f"Error saving answer cache: {e}")
+
+def _normalize(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+def get_answer_cache() -> SemanticAnswerCache:
+    # One cache per process, shared by every Streamlit session
+    global _answer_cache
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            _answer_cache = SemanticAnswerCache()
+        return _answer_cache
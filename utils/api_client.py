@@ -0,0 +1,78 @@
+import json
+import os
+import httpx
+
+# When set, the Streamlit UI is a thin client of a running API server instead of running the pipeline itself
+API_BASE_URL = os.getenv("API_BASE_URL", "").rstrip("/")
+API_TIMEOUT = float(os.getenv("API_TIMEOUT", "120"))
+
+class SessionNotFound(RuntimeError):
+    pass
+
+class ChatApiClient:
+    def __init__(self, base_url: str = API_BASE_URL, timeout: float = API_TIMEOUT):
+        self.client = httpx.Client(base_url=base_url, timeout=timeout)
+
+    def _check(self, response: httpx.Response):
+        if response.status_code == 404:
+            raise SessionNotFound("Unknown or expired session")
+        if response.is_error:
+            try:
+                detail = response.json().get("error", response.text)
+            except ValueError:
+                detail = response.text
+            raise RuntimeError(f"API error {response.status_code}: {detail}")
+
+    def create_session(self) -> str:
+        try:
+            response = self.client.post("/v1/sessions")
+        except httpx.HTTPError as e:
+            raise RuntimeError(f"API unreachable: {e}") from e
+        self._check(response)
+        return response.json()["session_id"]
+
+    def get_session(self, session_id: str) -> dict:
+        try:
+            response = self.client.get(f"/v1/sessions/{session_id}")
+        except httpx.HTTPError as e:
+            raise RuntimeError(f"API unreachable: {e}") from e
+        self._check(response)
+        return response.json()
+
+    def stream_message(self, session_id: str, message: str):
+        # Yields ("token", text) while the answer streams, then ("done", payload)
+        try:
+            with self.client.stream("POST", f"/v1/sessions/{session_id}/messages",
+                                    json={"message": message, "stream": True}) as response:
+                if response.is_error:
+                    response.read()
+                    self._check(response)
+                event = None
+                for line in response.iter_lines():
+                    if line.startswith("event: "):
+                        event = line[len("event: "):]
+                    elif line.startswith("data: "):
+                        data = json.loads(line[len("data: "):])
+                        if event == "error":
+                            raise RuntimeError(f"API error: {data.get('error')}")
+                        yield event, data.get("token") if event == "token" else data
+        except httpx.HTTPError as e:
+            raise RuntimeError(f"API unreachable: {e}") from e
+
+    def bulk(self, session_id: str, operation: str, csv_text: str) -> str:
+        try:
+            response = self.client.post(f"/v1/sessions/{session_id}/bulk",
+                                        json={"operation": operation.lower(), "csv": csv_text})
+        except httpx.HTTPError as e:
+            raise RuntimeError(f"API unreachable: {e}") from e
+        self._check(response)
+        return response.json()["response"]
+
+_client = None
+
+def get_api_client() -> ChatApiClient:
+    # One connection pool per process, shared by all Streamlit sessions
+    global _client
+    if _client is None:
+        _client = ChatApiClient()
+    return _client
@@ -0,0 +1,45 @@
+import asyncio
+import queue
+import threading
+
+# One long-lived event loop per process: async clients keep their connection pools across
+# Streamlit reruns instead of being bound to a throwaway asyncio.run() loop
+_loop = None
+_loop_lock = threading.Lock()
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name="cardassist-async", daemon=True)
+            thread.start()
+        return _loop
+
+def run_async(coro, timeout: float = None):
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result(timeout)
+
+def iterate_async(async_iterable):
+    # Drive an async iterator on the shared loop and hand its items to a synchronous caller
+    items = queue.Queue()
+
+    async def pump():
+        try:
+            async for item in async_iterable:
+                items.put((False, item))
+            items.put((True, None))
+        except BaseException as e:
+            items.put((True, e))
+            raise
+
+    future = asyncio.run_coroutine_threadsafe(pump(), get_event_loop())
+    try:
+        while True:
+            finished, value = items.get()
+            if finished:
+                if value is not None:
+                    raise value
+                return
+            yield value
+    finally:
+        future.cancel()
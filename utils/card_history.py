@@ -0,0 +1,84 @@
+import math
+import time
+from array import array
+
+ACTIONS = ["activated", "deactivated"]
+
+class CardActionHistory:
+    # Column-oriented action log: card numbers, action codes and timestamps in typed arrays,
+    # plus position indexes by action and by card so queries cost O(results) rather than O(history)
+    def __init__(self, entries=None):
+        self._cards = array("q")
+        self._actions = array("b")
+        self._timestamps = array("d")
+        self._by_action = {action: array("q") for action in ACTIONS}
+        self._by_card = {}
+        if entries:
+            self.extend(entries)
+
+    def __len__(self):
+        return len(self._cards)
+
+    def __iter__(self):
+        for card, code in zip(self._cards, self._actions):
+            yield f"{card:09d}", ACTIONS[code]
+
+    def append(self, card_number: str, action: str, timestamp: float = None):
+        if action not in ACTIONS:
+            raise ValueError(f"Unknown card action: {action}")
+        position = len(self._cards)
+        card = int(card_number)
+        self._cards.append(card)
+        self._actions.append(ACTIONS.index(action))
+        self._timestamps.append(time.time() if timestamp is None else timestamp)
+        self._by_action[action].append(position)
+        self._by_card.setdefault(card, array("q")).append(position)
+
+    def extend(self, entries):
+        # Entries are (card, action) or (card, action, timestamp); legacy entries have no timestamp
+        for entry in entries:
+            timestamp = entry[2] if len(entry) > 2 and entry[2] is not None else math.nan
+            self.append(entry[0], entry[1], timestamp)
+
+    def clear(self):
+        self.__init__()
+
+    def copy(self):
+        history = CardActionHistory()
+        history._cards = array("q", self._cards)
+        history._actions = array("b", self._actions)
+        history._timestamps = array("d", self._timestamps)
+        history._by_action = {action: array("q", positions) for action, positions in self._by_action.items()}
+        history._by_card = {card: array("q", positions) for card, positions in self._by_card.items()}
+        return history
+
+    def count(self, action: str = None) -> int:
+        return len(self._cards) if action is None else len(self._by_action[action])
+
+    def distinct_cards(self) -> int:
+        return len(self._by_card)
+
+    def _entries(self, positions, limit: int, offset: int) -> list:
+        # Newest first
+        end = len(positions) - offset
+        start = max(end - limit, 0)
+        return [
+            (f"{self._cards[i]:09d}", ACTIONS[self._actions[i]], self._timestamps[i])
+            for i in reversed(positions[start:max(end, 0)])
+        ]
+
+    def latest(self, action: str = None, limit: int = 10, offset: int = 0) -> list:
+        if action is None:
+            end = len(self._cards) - offset
+            start = max(end - limit, 0)
+            return self._entries(range(start, max(end, 0)), limit, 0)
+        return self._entries(self._by_action[action], limit, offset)
+
+    def for_card(self, card_number: str, limit: int = 10, offset: int = 0) -> list:
+        return self._entries(self._by_card.get(int(card_number), array("q")), limit, offset)
+
+    def to_records(self) -> list:
+        return [
+            [f"{card:09d}", ACTIONS[code], None if math.isnan(ts) else ts]
+            for card, code, ts in zip(self._cards, self._actions, self._timestamps)
+        ]
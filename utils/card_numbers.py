@@ -0,0 +1,58 @@
+import csv
+import io
+import os
+import re
+import numpy as np
+
+BULK_MAX_CARDS = int(os.getenv("BULK_MAX_CARDS", "100000"))
+CARD_NUMBER_LENGTH = 9
+
+# Digit runs of 6+ characters are card number candidates; "a-b", "a to b" and "a through b" are ranges
+CARD_TOKEN_PATTERN = re.compile(r"(?<!\d)(\d{6,})(?:\s*(?:-|–|to|through)\s*(\d{6,}))?(?!\d)", re.IGNORECASE)
+
+def _validate(tokens: list):
+    # One vectorised pass: a valid card number is exactly nine digits
+    if not tokens:
+        return [], []
+    candidates = np.array(tokens, dtype=str)
+    valid_mask = (np.char.str_len(candidates) == CARD_NUMBER_LENGTH) & np.char.isdigit(candidates)
+    valid = list(dict.fromkeys(candidates[valid_mask].tolist()))
+    invalid = list(dict.fromkeys(candidates[~valid_mask].tolist()))
+    return valid, invalid
+
+def _expand_ranges(matches) -> list:
+    tokens = []
+    for start, end in matches:
+        if not end:
+            tokens.append(start)
+            continue
+        if len(start) != CARD_NUMBER_LENGTH or len(end) != CARD_NUMBER_LENGTH or int(end) < int(start):
+            tokens.append(f"{start}-{end}")
+            continue
+        count = int(end) - int(start) + 1
+        if count > BULK_MAX_CARDS:
+            tokens.append(f"{start}-{end}")
+            continue
+        numbers = np.arange(int(start), int(end) + 1, dtype=np.int64)
+        tokens.extend(np.char.zfill(numbers.astype(str), CARD_NUMBER_LENGTH).tolist())
+    return tokens
+
+def extract_card_numbers(text: str):
+    # Returns (valid card numbers in first-seen order, invalid tokens)
+    return _validate(_expand_ranges(CARD_TOKEN_PATTERN.findall(text)))
+
+def parse_card_csv(data: bytes):
+    text = data.decode("utf-8-sig", errors="replace")
+    tokens = []
+    for row in csv.reader(io.StringIO(text)):
+        for cell in row:
+            cell = cell.strip()
+            if not cell:
+                continue
+            matches = CARD_TOKEN_PATTERN.findall(cell)
+            # Cells that are not card-like at all (headers, names) are ignored; short numbers are reported
+            if matches:
+                tokens.extend(_expand_ranges(matches))
+            elif cell.isdigit():
+                tokens.append(cell)
+    return _validate(tokens)
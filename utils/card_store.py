@@ -0,0 +1,198 @@
+import json
+import os
+import threading
+import time
+import uuid
+from utils.card_history import CardActionHistory
+from utils.file_lock import file_lock
+from utils.logger import setup_logger
+from utils.metrics import span
+
+CARD_STORE_PATH = os.getenv("CARD_STORE_PATH", "card_states.log")
+LEGACY_CARD_STATES_PATH = "card_states.json"
+CARD_STORE_COMPACT_BYTES = int(os.getenv("CARD_STORE_COMPACT_BYTES", str(1024 * 1024)))
+CARD_STORE_FSYNC = os.getenv("CARD_STORE_FSYNC", "true").lower() in ("1", "true", "yes")
+
+class CardStateStore:
+    # Append-only log of card mutations, one compact JSON record per line:
+    #   {"op": "set", "card": ..., "state": ..., "action": ..., "ts": ...}
+    #   {"op": "batch", "cards": [...], "state": ..., "action": ..., "ts": ...}  (one line, so all-or-nothing)
+    #   {"op": "reset", "ts": ...}
+    #   {"op": "snapshot", "card_states": {...}, "card_action_history": [...]}  (written by compaction)
+    # Every log file starts with {"op": "header", "generation": ...} so readers notice a compaction
+    # by another process. The state map is rebuilt by replaying the log; processes coordinate through a lock file.
+    def __init__(self, path: str = CARD_STORE_PATH, legacy_path: str = LEGACY_CARD_STATES_PATH,
+                 compact_bytes: int = CARD_STORE_COMPACT_BYTES, fsync: bool = CARD_STORE_FSYNC):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.lock_path = f"{path}.lock"
+        self.compact_bytes = compact_bytes
+        self.fsync = fsync
+        self.logger = setup_logger()
+        self.card_states = {}
+        self.card_action_history = CardActionHistory()
+        self._offset = 0
+        self._generation = None
+        self._lock = threading.RLock()
+        self._compacting = False
+        self._compacted_bytes = 0
+        self._load()
+
+    def _apply(self, record: dict):
+        op = record.get("op")
+        if op == "header":
+            return
+        if op == "set":
+            self.card_states[record["card"]] = record["state"]
+            self.card_action_history.append(record["card"], record["action"], record.get("ts"))
+        elif op == "batch":
+            for card_number in record["cards"]:
+                self.card_states[card_number] = record["state"]
+                self.card_action_history.append(card_number, record["action"], record.get("ts"))
+        elif op == "reset":
+            self.card_states.clear()
+            self.card_action_history.clear()
+        elif op == "snapshot":
+            self.card_states = dict(record.get("card_states", {}))
+            self.card_action_history = CardActionHistory(record.get("card_action_history", []))
+        else:
+            self.logger.warning(f"Skipping unknown card store record: {record}")
+
+    def _load(self):
+        with self._lock, file_lock(self.lock_path):
+            if not os.path.exists(self.path) and os.path.exists(self.legacy_path):
+                self._migrate_legacy()
+            self.card_states = {}
+            self.card_action_history = CardActionHistory()
+            self._offset = 0
+            self._generation = None
+            self._read_tail()
+        self.logger.info(f"Loaded {len(self.card_states)} card states and {len(self.card_action_history)} actions from {self.path}")
+
+    def _migrate_legacy(self):
+        with open(self.legacy_path, "r") as f:
+            data = json.load(f)
+        self._write_snapshot(data.get("card_states", {}), data.get("card_action_history", []))
+        self.logger.info(f"Migrated {self.legacy_path} to card store log {self.path}")
+
+    def _read_tail(self):
+        # Replay records appended since the last read; a compaction by another process means a full replay
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            generation = f.readline()
+            size = os.fstat(f.fileno()).st_size
+            replay = generation != self._generation or size < self._offset
+            if replay:
+                self.card_states = {}
+                self.card_action_history = CardActionHistory()
+                self._offset = 0
+                self._generation = generation
+            if size <= self._offset:
+                return
+            f.seek(self._offset)
+            data = f.read()
+        # Ignore a torn final line left by a writer that crashed mid-append
+        complete = data[:data.rfind(b"\n") + 1]
+        for line in complete.splitlines():
+            if not line.strip():
+                continue
+            try:
+                self._apply(json.loads(line))
+            except (ValueError, KeyError) as e:
+                self.logger.error(f"Skipping corrupt card store record: {e}")
+        self._offset += len(complete)
+        if replay:
+            # A log found at startup or just compacted by another process is the baseline for the next
+            # compaction, so N processes starting on a large log do not each rewrite it
+            self._compacted_bytes = self._offset
+
+    def refresh(self):
+        with self._lock, file_lock(self.lock_path, shared=True):
+            self._read_tail()
+
+    def append(self, records: list):
+        line_data = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records)
+        with self._lock, span("card_store.append"):
+            with file_lock(self.lock_path):
+                # Pick up other writers first so our in-memory map stays in log order
+                self._read_tail()
+                if not self._offset:
+                    line_data = self._header() + line_data
+                with open(self.path, "a") as f:
+                    f.write(line_data)
+                    f.flush()
+                    if self.fsync:
+                        os.fsync(f.fileno())
+                self._read_tail()
+            size = self._offset
+        # Snapshots keep the full history, so each compaction rewrites all of it: wait for the log to grow by
+        # at least the snapshot's own size, which keeps the rewriting linear in the history overall
+        if size > self._compacted_bytes + max(self.compact_bytes, self._compacted_bytes):
+            self.compact_in_background()
+
+    def record_action(self, card_number: str, state: str, action: str):
+        self.append([{"op": "set", "card": card_number, "state": state, "action": action, "ts": time.time()}])
+
+    def record_batch(self, card_numbers: list, state: str, action: str, timestamp: float):
+        self.append([{"op": "batch", "cards": card_numbers, "state": state, "action": action, "ts": timestamp}])
+
+    def record_reset(self):
+        self.append([{"op": "reset", "ts": time.time()}])
+
+    def flush(self):
+        with self._lock, file_lock(self.lock_path):
+            if os.path.exists(self.path):
+                with open(self.path, "a") as f:
+                    os.fsync(f.fileno())
+
+    def _header(self) -> str:
+        record = {"op": "header", "generation": uuid.uuid4().hex, "ts": time.time()}
+        return json.dumps(record, separators=(",", ":")) + "\n"
+
+    def _write_snapshot(self, card_states: dict, card_action_history: list):
+        tmp_path = f"{self.path}.tmp"
+        record = {"op": "snapshot", "card_states": card_states, "card_action_history": card_action_history, "ts": time.time()}
+        with open(tmp_path, "w") as f:
+            f.write(self._header())
+            f.write(json.dumps(record, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def compact(self):
+        with self._lock, span("card_store.compact"), file_lock(self.lock_path):
+            self._read_tail()
+            before = self._offset
+            self._write_snapshot(self.card_states, self.card_action_history.to_records())
+            self._read_tail()
+            self._compacted_bytes = self._offset
+        self.logger.info(f"Compacted card store log from {before} to {self._offset} bytes")
+
+    def compact_in_background(self):
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+
+        def run():
+            try:
+                self.compact()
+            except Exception as e:
+                self.logger.error(f"Error compacting card store: {e}")
+            finally:
+                self._compacting = False
+
+        threading.Thread(target=run, name="card-store-compaction", daemon=True).start()
+
+_card_store = None
+_card_store_lock = threading.Lock()
+
+def get_card_store() -> CardStateStore:
+    global _card_store
+    with _card_store_lock:
+        if _card_store is None:
+            _card_store = CardStateStore()
+        return _card_store
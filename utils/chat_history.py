@@ -0,0 +1,132 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from itertools import islice
+
+# Messages kept in memory per session; older ones are appended to a per-session JSONL file
+CHAT_HISTORY_WINDOW = int(os.getenv("CHAT_HISTORY_WINDOW", "50"))
+CHAT_HISTORY_DIR = os.getenv("CHAT_HISTORY_DIR", os.path.join("cache", "chat_history"))
+# Spill files untouched for this long are deleted: Streamlit sessions end by closing the tab, with no hook to clean up
+CHAT_HISTORY_TTL = float(os.getenv("CHAT_HISTORY_TTL", str(7 * 86400)))
+CHAT_HISTORY_PRUNE_INTERVAL = float(os.getenv("CHAT_HISTORY_PRUNE_INTERVAL", "3600"))
+# Compact context handed to the intent classifier: the last few messages, each capped in length
+CHAT_CONTEXT_MESSAGES = int(os.getenv("CHAT_CONTEXT_MESSAGES", "4"))
+CHAT_CONTEXT_CHARS = int(os.getenv("CHAT_CONTEXT_CHARS", "400"))
+
+class ChatHistory:
+    # Ring buffer of (role, message) pairs. len() counts every message of the session, iteration and
+    # indexing cover the in-memory window, and older messages are read back from disk only on request.
+    def __init__(self, window: int = CHAT_HISTORY_WINDOW, directory: str = CHAT_HISTORY_DIR,
+                 history_id: str = None, messages=(), spilled: int = 0):
+        self.window = max(window, CHAT_CONTEXT_MESSAGES, 1)
+        self.directory = directory
+        self.history_id = history_id or uuid.uuid4().hex
+        self.spilled = spilled
+        self._messages = deque((tuple(message) for message in messages))
+        self.context = ""
+        self._update_context()
+
+    @property
+    def spill_path(self) -> str:
+        return os.path.join(self.directory, f"{self.history_id}.jsonl")
+
+    def __len__(self):
+        return self.spilled + len(self._messages)
+
+    def __bool__(self):
+        return bool(self._messages)
+
+    def __iter__(self):
+        return iter(self._messages)
+
+    def __getitem__(self, index: int):
+        return self._messages[index]
+
+    def _update_context(self):
+        # Rebuilt from a fixed number of messages, so it costs the same on turn 5 and turn 5000
+        recent = islice(reversed(self._messages), CHAT_CONTEXT_MESSAGES)
+        lines = [f"{role}: {message[:CHAT_CONTEXT_CHARS]}" for role, message in recent]
+        self.context = "\n".join(reversed(lines)) + "\n" if lines else ""
+
+    def _spill(self, count: int):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.spill_path, "a", encoding="utf-8") as f:
+            for _ in range(count):
+                f.write(json.dumps(self._messages.popleft(), ensure_ascii=False) + "\n")
+        self.spilled += count
+
+    def append(self, entry):
+        role, message = entry
+        self._messages.append((role, message))
+        if len(self._messages) > self.window:
+            self._spill(len(self._messages) - self.window)
+        self._update_context()
+
+    def extend(self, entries):
+        for entry in entries:
+            self.append(entry)
+
+    def tail(self, count: int) -> list:
+        # Newest `count` messages, reaching into the spill file only when the window is not enough
+        if count <= len(self._messages):
+            return list(islice(self._messages, len(self._messages) - count, None))
+        return self.older(count - len(self._messages)) + list(self._messages)
+
+    def older(self, count: int) -> list:
+        # The `count` newest spilled messages; a linear scan, paid only when the user asks for them
+        count = min(count, self.spilled)
+        if count <= 0 or not os.path.exists(self.spill_path):
+            return []
+        with open(self.spill_path, "r", encoding="utf-8") as f:
+            return [tuple(json.loads(line)) for line in islice(f, self.spilled - count, self.spilled)]
+
+    def clear(self):
+        self.discard()
+        self._messages.clear()
+        self.spilled = 0
+        self._update_context()
+
+    def discard(self):
+        try:
+            os.remove(self.spill_path)
+        except FileNotFoundError:
+            pass
+
+    def to_state(self) -> dict:
+        return {"history_id": self.history_id, "messages": list(self._messages), "spilled": self.spilled}
+
+    @classmethod
+    def from_state(cls, state: dict) -> "ChatHistory":
+        return cls(history_id=state["history_id"], messages=state["messages"], spilled=state["spilled"])
+
+_last_prune = 0.0
+_prune_lock = threading.Lock()
+
+def prune_spill_files(directory: str = CHAT_HISTORY_DIR, ttl: float = CHAT_HISTORY_TTL) -> int:
+    # Every append to a live session's file refreshes its mtime, so only abandoned sessions are removed
+    cutoff = time.time() - ttl
+    removed = 0
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.name.endswith(".jsonl") and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+def prune_spill_files_in_background(directory: str = CHAT_HISTORY_DIR, ttl: float = CHAT_HISTORY_TTL):
+    # At most once per CHAT_HISTORY_PRUNE_INTERVAL per process, off the caller's thread
+    global _last_prune
+    with _prune_lock:
+        if time.time() - _last_prune < CHAT_HISTORY_PRUNE_INTERVAL:
+            return
+        _last_prune = time.time()
+    threading.Thread(target=prune_spill_files, args=(directory, ttl), name="chat-history-prune", daemon=True).start()
@@ -0,0 +1,60 @@
+import math
+import os
+from collections import namedtuple
+from functools import lru_cache
+import numpy as np
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Candidates fetched from the index; how many of them reach the prompt depends on scores and budget
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "8"))
+# Chunks scoring below this fraction of the best hit are dropped, so k follows the score distribution
+CONTEXT_SCORE_RATIO = float(os.getenv("CONTEXT_SCORE_RATIO", "0.85"))
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.95"))
+PROMPT_MODEL = "gpt-4"
+
+ContextSelection = namedtuple("ContextSelection", ["text", "chunks", "tokens", "candidates", "duplicates"])
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.encoding_for_model(PROMPT_MODEL)
+    except Exception:
+        # tiktoken missing, or its BPE file cannot be fetched
+        return None
+
+def count_tokens(text: str) -> int:
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    # About four characters per token for English text
+    return math.ceil(len(text) / 4)
+
+def select_context(hits: list, vectors, budget: int = CONTEXT_TOKEN_BUDGET, score_ratio: float = CONTEXT_SCORE_RATIO,
+                   dedup_threshold: float = CONTEXT_DEDUP_THRESHOLD) -> ContextSelection:
+    # hits: (content, score) best first; vectors: the hits' embeddings in the same order
+    if not hits:
+        return ContextSelection("", [], 0, 0, 0)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors = vectors / norms
+
+    best_score = hits[0][1]
+    chosen = []
+    tokens_used = 0
+    duplicates = 0
+    for i, (content, score) in enumerate(hits):
+        if chosen and best_score > 0 and score < best_score * score_ratio:
+            break
+        if chosen and float(np.max(vectors[chosen] @ vectors[i])) >= dedup_threshold:
+            duplicates += 1
+            continue
+        tokens = count_tokens(content)
+        if tokens_used + tokens > budget:
+            # A lower-ranked but shorter chunk may still fit
+            continue
+        chosen.append(i)
+        tokens_used += tokens
+    chunks = [hits[i][0] for i in chosen]
+    return ContextSelection("\n\n".join(chunks), chunks, tokens_used, len(hits), duplicates)
@@ -0,0 +1,50 @@
+import os
+from utils.logger import setup_logger
+
+# torch: float32 PyTorch (the original setup); torch-int8: dynamically quantized Linear layers;
+# onnx: exported ONNX model on onnxruntime; onnx-int8: the model's pre-quantized ONNX export
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+EMBEDDING_BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+EMBEDDING_ONNX_INT8_FILE = os.getenv("EMBEDDING_ONNX_INT8_FILE", "onnx/model_quint8_avx2.onnx")
+# 0 leaves the thread count to the runtime
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+
+def embedding_model_id(model_name: str, backend: str = EMBEDDING_BACKEND) -> str:
+    # Quantized backends produce slightly different vectors, so they get their own cache entries and index manifest
+    return model_name if backend == "torch" else f"{model_name}@{backend}"
+
+def _load(model_name: str, backend: str):
+    from sentence_transformers import SentenceTransformer
+    if backend == "torch":
+        return SentenceTransformer(model_name)
+    if backend == "torch-int8":
+        import torch
+        model = SentenceTransformer(model_name, device="cpu")
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if backend == "onnx":
+        return SentenceTransformer(model_name, device="cpu", backend="onnx")
+    if backend == "onnx-int8":
+        return SentenceTransformer(model_name, device="cpu", backend="onnx",
+                                   model_kwargs={"file_name": EMBEDDING_ONNX_INT8_FILE})
+    raise ValueError(f"Unknown embedding backend: {backend} (expected one of {', '.join(EMBEDDING_BACKENDS)})")
+
+def load_embedding_model(model_name: str, backend: str = EMBEDDING_BACKEND):
+    # Returns (model, backend actually used). All backends expose SentenceTransformer.encode;
+    # a backend whose runtime is not installed falls back to plain torch.
+    logger = setup_logger()
+    if EMBEDDING_THREADS:
+        try:
+            import torch
+            torch.set_num_threads(EMBEDDING_THREADS)
+        except ImportError:
+            pass
+    try:
+        model = _load(model_name, backend)
+    except ImportError as e:
+        if backend == "torch":
+            raise
+        logger.warning(f"Embedding backend {backend} is unavailable ({e}), falling back to torch")
+        backend = "torch"
+        model = _load(model_name, backend)
+    logger.info(f"Loaded {model_name} embeddings on the {backend} backend")
+    return model, backend
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+import numpy as np
+from utils.file_lock import file_lock
+from utils.logger import setup_logger
+from utils.metrics import cache_requests
+
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", os.path.join("cache", "embeddings"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+# User queries kept in memory per process; they are not written to the disk cache
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "4096"))
+
+class EmbeddingCache:
+    # Append-only float32 matrix (<model>.f32) plus an append-only row index (<model>.index.jsonl: a header
+    # line, then one key per line), shared across processes. Row n of the matrix belongs to key line n; a
+    # writer appends and fsyncs the rows before their keys, so readers only ever see keys whose rows exist.
+    def __init__(self, model_id: str, cache_dir: str = EMBEDDING_CACHE_DIR):
+        self.model_id = model_id
+        slug = re.sub(r"[^A-Za-z0-9_.-]", "_", model_id)
+        self.data_path = os.path.join(cache_dir, f"{slug}.f32")
+        self.index_path = os.path.join(cache_dir, f"{slug}.index.jsonl")
+        self.lock_path = os.path.join(cache_dir, f"{slug}.lock")
+        self.logger = setup_logger()
+        self.dim = None
+        self._rows = {}
+        self._matrix = None
+        # Bytes of complete index lines read so far; refreshes only read what was appended since
+        self._index_offset = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._refresh()
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_id}\0{text}".encode("utf-8")).hexdigest()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _refresh(self):
+        # Read index lines appended by any writer since the last refresh, then re-map the grown matrix
+        try:
+            if os.path.getsize(self.index_path) == self._index_offset:
+                return
+        except OSError:
+            return
+        with open(self.index_path, "rb") as f:
+            f.seek(self._index_offset)
+            data = f.read()
+        # A line without its newline is still being written, or was torn by a crash
+        complete = data[:data.rfind(b"\n") + 1]
+        if not complete:
+            return
+        lines = complete.splitlines()
+        if self._index_offset == 0:
+            self.dim = json.loads(lines[0]).get("dim")
+            lines = lines[1:]
+        self._index_offset += len(complete)
+        for line in lines:
+            self._rows.setdefault(json.loads(line), len(self._rows))
+        if self._rows and self.dim:
+            self._matrix = np.memmap(self.data_path, dtype=np.float32, mode="r", shape=(len(self._rows), self.dim))
+
+    def get_many(self, keys: list) -> dict:
+        with self._lock:
+            if any(key not in self._rows for key in keys):
+                self._refresh()
+            found = {}
+            for key in keys:
+                row = self._rows.get(key)
+                if row is not None:
+                    found[key] = self._matrix[row]
+            return found
+
+    def put_many(self, keys: list, vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock, file_lock(self.lock_path):
+            self._refresh()
+            if self.dim is not None and self.dim != vectors.shape[1]:
+                self.logger.error(f"Embedding cache dimension mismatch for {self.model_id}: {self.dim} != {vectors.shape[1]}")
+                return
+            new_keys, new_rows = [], []
+            for key, vector in zip(keys, vectors):
+                if key not in self._rows and key not in new_keys:
+                    new_keys.append(key)
+                    new_rows.append(vector)
+            if not new_keys:
+                return
+            dim = vectors.shape[1]
+            with open(self.data_path, "ab") as f:
+                # Drop any tail left by a writer that died before publishing its keys
+                f.truncate(len(self._rows) * dim * 4)
+                f.write(np.stack(new_rows).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self.index_path, "ab") as f:
+                # Likewise drop a torn key line, then publish the new keys
+                f.truncate(self._index_offset)
+                if self._index_offset == 0:
+                    f.write((json.dumps({"model": self.model_id, "dim": dim}) + "\n").encode("utf-8"))
+                f.write("".join(json.dumps(key) + "\n" for key in new_keys).encode("utf-8"))
+            self._refresh()
+        self.logger.debug(f"Cached {len(new_keys)} new embeddings for {self.model_id} ({len(self._rows)} total)")
+
+class CachedEmbeddingModel:
+    # Drop-in for SentenceTransformer.encode that batches misses and serves repeats from EmbeddingCache.
+    # encode() persists what it embeds, for corpus chunks; encode_queries() keeps user queries in a bounded
+    # in-memory LRU, so one-off questions never grow the disk cache or wait on its lock and fsync.
+    def __init__(self, model, model_id: str, cache: EmbeddingCache = None, batch_size: int = EMBEDDING_BATCH_SIZE,
+                 query_cache_size: int = QUERY_CACHE_SIZE):
+        self.model = model
+        self.model_id = model_id
+        self.cache = cache if cache is not None else EmbeddingCache(model_id)
+        self.batch_size = batch_size
+        self.query_cache_size = query_cache_size
+        self._queries = OrderedDict()
+        self._queries_lock = threading.Lock()
+        self.logger = setup_logger()
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def _embed(self, texts: list, batch_size: int = None, **kwargs) -> np.ndarray:
+        return self.model.encode(texts, batch_size=batch_size or self.batch_size, convert_to_numpy=True, **kwargs).astype(np.float32)
+
+    def encode(self, sentences, batch_size: int = None, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        keys = [self.cache.key(text) for text in texts]
+        found = self.cache.get_many(keys)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            encoded = self._embed(list(missing.values()), batch_size, **kwargs)
+            self.cache.put_many(list(missing.keys()), encoded)
+            found.update(zip(missing.keys(), encoded))
+            self.logger.debug(f"Embedded {len(missing)} texts, {len(texts) - len(missing)} served from cache")
+
+        cache_requests.inc(len(texts) - len(missing), cache="embedding", result="hit")
+        cache_requests.inc(len(missing), cache="embedding", result="miss")
+        vectors = np.stack([np.asarray(found[key], dtype=np.float32) for key in keys]) if texts else np.empty((0, 0), dtype=np.float32)
+        return vectors[0] if single else vectors
+
+    def encode_queries(self, texts: list, batch_size: int = None, **kwargs) -> np.ndarray:
+        texts = list(texts)
+        found = {}
+        with self._queries_lock:
+            for text in texts:
+                if text in self._queries:
+                    self._queries.move_to_end(text)
+                    found[text] = self._queries[text]
+        missing = list(dict.fromkeys(text for text in texts if text not in found))
+        if missing:
+            encoded = self._embed(missing, batch_size, **kwargs)
+            found.update(zip(missing, encoded))
+            with self._queries_lock:
+                for text, vector in zip(missing, encoded):
+                    self._queries[text] = vector
+                while len(self._queries) > self.query_cache_size:
+                    self._queries.popitem(last=False)
+        hits = len(texts) - len(missing)
+        cache_requests.inc(hits, cache="query_embedding", result="hit")
+        cache_requests.inc(len(texts) - hits, cache="query_embedding", result="miss")
+        return np.stack([found[text] for text in texts]) if texts else np.empty((0, 0), dtype=np.float32)
+
+def encode_queries(embedding_model, texts: list) -> np.ndarray:
+    # Query-side encode: through the in-memory LRU when the model has one, plain encode otherwise
+    if isinstance(embedding_model, CachedEmbeddingModel):
+        return embedding_model.encode_queries(texts)
+    return np.asarray(embedding_model.encode(texts), dtype=np.float32)
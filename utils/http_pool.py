@@ -0,0 +1,31 @@
+import os
+
+# Connection pool limits shared by the OpenAI and Azure Search clients
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "60"))
+
+def openai_http_client():
+    import httpx
+    import openai
+    return openai.DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=HTTP_TIMEOUT,
+    )
+
+async def azure_transport():
+    # aiohttp sessions belong to the loop they are created on: call this on the shared event loop
+    import aiohttp
+    from azure.core.pipeline.transport import AioHttpTransport
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_MAX_CONNECTIONS,
+        limit_per_host=HTTP_MAX_CONNECTIONS,
+        keepalive_timeout=HTTP_KEEPALIVE_EXPIRY,
+    )
+    session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT))
+    return AioHttpTransport(session=session, session_owner=True)
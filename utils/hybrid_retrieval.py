@@ -0,0 +1,75 @@
+import os
+import numpy as np
+from utils.lexical_index import tokenize
+from utils.logger import setup_logger
+
+# vector: index search only; lexical: the local BM25 index only; hybrid: both, fused
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector").lower()
+# Score cut-off for fused, BM25 and reranked hits, as a fraction of the best hit; those scores are not
+# cosines, so they get their own ratio instead of CONTEXT_SCORE_RATIO
+FUSED_SCORE_RATIO = float(os.getenv("FUSED_SCORE_RATIO", "0.7"))
+BM25_CANDIDATES = int(os.getenv("BM25_CANDIDATES", "8"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+# none, local (query/chunk cosine plus query term coverage) or cross-encoder (sentence-transformers, optional)
+RERANKER = os.getenv("RERANKER", "none").lower()
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_TERM_WEIGHT = float(os.getenv("RERANK_TERM_WEIGHT", "0.3"))
+
+def reciprocal_rank_fusion(rankings: list, k: int = RRF_K) -> list:
+    # rankings: lists of contents, best first. Returns (content, fused score) best first; each list
+    # contributes 1 / (k + rank), so agreement between retrievers outweighs a high rank in only one.
+    # Scores are divided by the best possible one, first in every list, so they fall in (0, 1]
+    scores = {}
+    for ranking in rankings:
+        for rank, content in enumerate(ranking, start=1):
+            scores[content] = scores.get(content, 0.0) + 1.0 / (k + rank)
+    best = len(rankings) / (k + 1)
+    return sorted(((content, score / best) for content, score in scores.items()), key=lambda item: item[1], reverse=True)
+
+class LocalReranker:
+    # Cosine similarity to the query plus the share of query terms a chunk contains; uses vectors the
+    # embedding cache already holds, so it adds no model inference
+    def __init__(self, term_weight: float = RERANK_TERM_WEIGHT):
+        self.term_weight = term_weight
+
+    def rerank(self, query: str, query_vector, contents: list, vectors) -> list:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        query_vector = query_vector / max(float(np.linalg.norm(query_vector)), 1e-12)
+        query_terms = set(tokenize(query))
+        scores = vectors @ query_vector
+        if query_terms:
+            coverage = np.array([len(query_terms & set(tokenize(content))) / len(query_terms) for content in contents],
+                                dtype=np.float32)
+            scores = scores + self.term_weight * coverage
+        # Back to at most 1, like the other scores the context cut-off sees
+        scores = scores / (1.0 + self.term_weight)
+        order = np.argsort(-scores, kind="stable")
+        return [(contents[i], float(scores[i])) for i in order]
+
+class CrossEncoderReranker:
+    def __init__(self, model_name: str = RERANKER_MODEL):
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model_name, device="cpu")
+
+    def rerank(self, query: str, query_vector, contents: list, vectors) -> list:
+        logits = np.asarray(self.model.predict([(query, content) for content in contents]), dtype=np.float32)
+        # Logits can be negative; the ratio cut-off needs positive scores
+        scores = 1.0 / (1.0 + np.exp(-logits))
+        order = np.argsort(-scores, kind="stable")
+        return [(contents[i], float(scores[i])) for i in order]
+
+def load_reranker(name: str = RERANKER):
+    logger = setup_logger()
+    if name in ("", "none"):
+        return None
+    if name == "local":
+        return LocalReranker()
+    if name == "cross-encoder":
+        try:
+            return CrossEncoderReranker()
+        except ImportError as e:
+            logger.warning(f"Cross-encoder reranker is unavailable ({e}), using the local reranker")
+            return LocalReranker()
+    raise ValueError(f"Unknown reranker: {name}")
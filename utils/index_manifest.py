@@ -0,0 +1,72 @@
+import hashlib
+import json
+import os
+from utils.logger import setup_logger
+
+MANIFEST_PATH = os.path.join("cache", "index_manifest.json")
+# Held while an index is synced, so API workers starting together sync it once instead of each in turn
+MANIFEST_LOCK_PATH = f"{MANIFEST_PATH}.lock"
+MANIFEST_VERSION = 1
+
+def chunk_id(content: str) -> str:
+    # Content-addressed document key: a shifted chunk order never changes the key of a chunk
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def corpus_fingerprint(chunks: list, model_name: str) -> str:
+    digest = hashlib.sha256(model_name.encode("utf-8"))
+    for doc_id in sorted({chunk_id(chunk) for chunk in chunks}):
+        digest.update(doc_id.encode("ascii"))
+    return digest.hexdigest()
+
+def empty_manifest(index_name: str) -> dict:
+    return {"version": MANIFEST_VERSION, "index_name": index_name, "documents": {}}
+
+def load_manifest(index_name: str, file_path: str = MANIFEST_PATH):
+    logger = setup_logger()
+    try:
+        if not os.path.exists(file_path):
+            logger.info(f"No ingestion manifest found at {file_path}")
+            return None
+        with open(file_path, "r") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != MANIFEST_VERSION or manifest.get("index_name") != index_name:
+            logger.info(f"Ingestion manifest at {file_path} does not match index {index_name}, ignoring it")
+            return None
+        return manifest
+    except Exception as e:
+        logger.error(f"Error loading ingestion manifest: {e}")
+        return None
+
+def save_manifest(manifest: dict, file_path: str = MANIFEST_PATH):
+    logger = setup_logger()
+    try:
+        os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+        tmp_path = f"{file_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, separators=(",", ":"))
+        os.replace(tmp_path, file_path)
+        logger.debug(f"Saved ingestion manifest with {len(manifest['documents'])} documents")
+    except Exception as e:
+        logger.error(f"Error saving ingestion manifest: {e}")
+
+def plan_batch(manifest: dict, chunks: list, model_name: str, seen: set) -> dict:
+    # Plans one batch of a chunk stream; ids already in `seen` (identical chunks) collapse onto one document
+    documents = manifest["documents"]
+    plan = {"add": [], "update": [], "skip": 0}
+    for chunk in chunks:
+        doc_id = chunk_id(chunk)
+        if doc_id in seen:
+            continue
+        seen.add(doc_id)
+        entry = documents.get(doc_id)
+        if entry is None:
+            plan["add"].append((doc_id, chunk))
+        elif entry.get("model") != model_name:
+            plan["update"].append((doc_id, chunk))
+        else:
+            plan["skip"] += 1
+    return plan
+
+def stale_ids(manifest: dict, seen: set) -> list:
+    # Documents that were indexed before but did not appear anywhere in this run's chunk stream
+    return [doc_id for doc_id in manifest["documents"] if doc_id not in seen]
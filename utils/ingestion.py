@@ -0,0 +1,192 @@
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from utils.logger import setup_logger
+
+# Comma-separated files and/or directories to index
+KNOWLEDGE_SOURCES = os.getenv("KNOWLEDGE_SOURCES", "global_card_access_user_guide.pdf,ProjectDocumentationCardAssist.pdf")
+DOCUMENT_EXTENSIONS = (".pdf", ".txt", ".md")
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "200"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "40"))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "256"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Below this many pages, spawning extraction processes costs more than it saves
+PARALLEL_MIN_PAGES = int(os.getenv("INGEST_PARALLEL_MIN_PAGES", "64"))
+PAGES_PER_TASK = 8
+
+WORD_PATTERN = re.compile(r"\S+")
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?:;])\s+")
+PARAGRAPH_BOUNDARY = re.compile(r"\n\s*\n")
+
+class IngestionStats:
+    def __init__(self):
+        self.documents = 0
+        self.pages = 0
+        self.chunks = 0
+        self.started_at = time.perf_counter()
+        self.extraction_seconds = 0.0
+        self.finished_at = None
+
+    def finish(self):
+        self.finished_at = time.perf_counter()
+
+    @property
+    def seconds(self) -> float:
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+    def as_dict(self) -> dict:
+        seconds = self.seconds
+        return {
+            "documents": self.documents,
+            "pages": self.pages,
+            "chunks": self.chunks,
+            "seconds": seconds,
+            "pages_per_second": self.pages / self.extraction_seconds if self.extraction_seconds else 0.0,
+            "chunks_per_second": self.chunks / seconds if seconds else 0.0,
+        }
+
+    def summary(self) -> str:
+        stats = self.as_dict()
+        return (
+            f"{stats['documents']} documents, {stats['pages']} pages, {stats['chunks']} chunks in {stats['seconds']:.2f}s "
+            f"({stats['pages_per_second']:.1f} pages/s extracted, {stats['chunks_per_second']:.1f} chunks/s end to end)"
+        )
+
+def discover_documents(sources) -> list:
+    logger = setup_logger()
+    if isinstance(sources, str):
+        sources = [source.strip() for source in sources.split(",") if source.strip()]
+    documents = []
+    for source in sources:
+        if os.path.isdir(source):
+            for root, _, files in os.walk(source):
+                documents.extend(os.path.join(root, name) for name in sorted(files) if name.lower().endswith(DOCUMENT_EXTENSIONS))
+        elif os.path.isfile(source):
+            documents.append(source)
+        else:
+            logger.warning(f"Knowledge source not found: {source}")
+    return documents
+
+def _page_count(path: str) -> int:
+    if not path.lower().endswith(".pdf"):
+        return 1
+    from PyPDF2 import PdfReader
+    return len(PdfReader(path).pages)
+
+def _extract_pages(path: str, start: int, stop: int) -> list:
+    # Runs in a worker process: each task re-opens the file and extracts its own page range
+    if not path.lower().endswith(".pdf"):
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            return [(path, 0, f.read())]
+    from PyPDF2 import PdfReader
+    reader = PdfReader(path)
+    return [(path, number, reader.pages[number].extract_text() or "") for number in range(start, stop)]
+
+def iter_pages(documents: list, stats: IngestionStats = None, workers: int = INGEST_WORKERS):
+    # Yields (path, page_number, text) in document order with a bounded number of page ranges in flight
+    stats = stats or IngestionStats()
+    tasks = []
+    for path in documents:
+        count = _page_count(path)
+        tasks.extend((path, start, min(start + PAGES_PER_TASK, count)) for start in range(0, count, PAGES_PER_TASK))
+        stats.documents += 1
+    total_pages = sum(stop - start for _, start, stop in tasks)
+
+    if workers <= 1 or total_pages < PARALLEL_MIN_PAGES:
+        for task in tasks:
+            started = time.perf_counter()
+            pages = _extract_pages(*task)
+            stats.extraction_seconds += time.perf_counter() - started
+            stats.pages += len(pages)
+            yield from pages
+        return
+
+    # spawn, not fork: this runs on a background thread of a multi-threaded process
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        pending = []
+        next_task = 0
+        while next_task < len(tasks) or pending:
+            while next_task < len(tasks) and len(pending) < workers * 2:
+                pending.append(executor.submit(_extract_pages, *tasks[next_task]))
+                next_task += 1
+            started = time.perf_counter()
+            pages = pending.pop(0).result()
+            stats.extraction_seconds += time.perf_counter() - started
+            stats.pages += len(pages)
+            yield from pages
+
+class TokenCounter:
+    # Counts with the embedding model's tokenizer when available, whitespace words otherwise
+    def __init__(self, tokenizer=None):
+        self.tokenizer = tokenizer
+
+    def __call__(self, text: str) -> int:
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False))
+        return len(WORD_PATTERN.findall(text))
+
+def _units(text: str, count_tokens, max_tokens: int):
+    # Sentences with their token counts; sentences longer than the window are cut into word slices
+    for paragraph in PARAGRAPH_BOUNDARY.split(text):
+        for sentence in SENTENCE_BOUNDARY.split(paragraph):
+            sentence = " ".join(sentence.split())
+            if not sentence:
+                continue
+            tokens = count_tokens(sentence)
+            if tokens <= max_tokens:
+                yield sentence, tokens
+                continue
+            words = sentence.split(" ")
+            step = max(1, len(words) * max_tokens // tokens)
+            for start in range(0, len(words), step):
+                piece = " ".join(words[start:start + step])
+                yield piece, count_tokens(piece)
+
+def iter_chunks(pages, count_tokens, max_tokens: int = CHUNK_TOKENS, overlap: int = CHUNK_OVERLAP,
+                stats: IngestionStats = None):
+    # Sliding token window over each document's sentences; consecutive chunks share up to `overlap` tokens
+    window = []
+    window_tokens = 0
+    fresh = False
+    current_path = None
+    for path, _, text in pages:
+        if path != current_path:
+            if fresh:
+                if stats:
+                    stats.chunks += 1
+                yield " ".join(unit for unit, _ in window)
+            window, window_tokens, fresh = [], 0, False
+            current_path = path
+        for unit, tokens in _units(text, count_tokens, max_tokens):
+            if window_tokens + tokens > max_tokens and fresh:
+                if stats:
+                    stats.chunks += 1
+                yield " ".join(unit for unit, _ in window)
+                tail, tail_tokens = [], 0
+                for previous, previous_tokens in reversed(window):
+                    if tail_tokens + previous_tokens > overlap:
+                        break
+                    tail.insert(0, (previous, previous_tokens))
+                    tail_tokens += previous_tokens
+                window, window_tokens, fresh = tail, tail_tokens, False
+            while window and window_tokens + tokens > max_tokens:
+                window_tokens -= window.pop(0)[1]
+            window.append((unit, tokens))
+            window_tokens += tokens
+            fresh = True
+    if fresh:
+        if stats:
+            stats.chunks += 1
+        yield " ".join(unit for unit, _ in window)
+
+def batched(iterable, size: int = INGEST_BATCH_SIZE):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
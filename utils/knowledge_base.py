@@ -1,104 +1,213 @@
-import streamlit as st
-from sentence_transformers import SentenceTransformer
-from PyPDF2 import PdfReader
-from azure.search.documents import SearchClient
-from azure.search.documents.indexes import SearchIndexClient
-from azure.search.documents.indexes.models import (
-    VectorSearch,  # Correct import from indexes.models
-    SearchIndex,
-    SearchField,
-    SearchFieldDataType,
-    SimpleField,
-    SearchableField,
-    VectorSearchAlgorithmConfiguration,
-    VectorSearchProfile,
-)
-from azure.core.credentials import AzureKeyCredential
 from dotenv import load_dotenv
 import os
-import numpy as np
 from utils.logger import setup_logger
+from utils.answer_cache import get_answer_cache
+from utils.async_runtime import run_async
+from utils.http_pool import azure_transport
+from utils.embedding_backends import EMBEDDING_BACKEND, embedding_model_id, load_embedding_model
+from utils.embedding_cache import CachedEmbeddingModel
+from utils.lexical_index import BM25Index
+from utils.file_lock import file_lock
+from utils.index_manifest import MANIFEST_LOCK_PATH, corpus_fingerprint, empty_manifest, load_manifest, plan_batch, save_manifest, stale_ids
+from utils.ingestion import (
+    INGEST_BATCH_SIZE, KNOWLEDGE_SOURCES, IngestionStats, TokenCounter, batched, discover_documents, iter_chunks, iter_pages
+)
+from utils.search_backends import SEARCH_BACKEND, create_local_search_client
+from utils.startup import startup_phase
 
-@st.cache_resource
-def load_knowledge_base():
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+UPLOAD_BATCH_SIZE = 1000
+
+def _list_index_ids(search_client):
+    return [doc["id"] for doc in search_client.search(search_text="*", select=["id"])]
+
+def sync_search_index(search_client, embedding_model, chunks, index_name, index_created=False):
     logger = setup_logger()
-    logger.debug("Loading knowledge base with Azure Search")
-    try:
-        embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-        logger.info("Loaded SentenceTransformer model")
-        reader = PdfReader("global_card_access_user_guide.pdf")
-        chunks = []
-        for page in reader.pages:
-            text = page.extract_text()
-            if text:
-                chunks.extend([chunk.strip() for chunk in text.split("\n\n") if chunk.strip()])
-        logger.info(f"Extracted {len(chunks)} text chunks from PDF")
-
-        # Load Azure Search configuration
-        load_dotenv()
-        endpoint = os.getenv("AZURE_SEARCH_ENDPOINT")
-        api_key = os.getenv("AZURE_SEARCH_API_KEY")
-        if not endpoint or not api_key:
-            logger.error("AZURE_SEARCH_ENDPOINT or AZURE_SEARCH_API_KEY not set in .env")
-            raise ValueError("Azure Search configuration is missing in .env")
-
-        # Initialize Azure Search index client
-        credential = AzureKeyCredential(api_key)
-        index_client = SearchIndexClient(endpoint=endpoint, credential=credential)
-        logger.debug("Initialized Azure Search index client")
-
-        # Define index schema
-        index_name = "cardassist-index"
-        fields = [
-            SimpleField(name="id", type=SearchFieldDataType.String, key=True, searchable=False),
-            SearchableField(name="content", type=SearchFieldDataType.String),
-            SearchField(
-                name="embedding",
-                type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
-                searchable=True,
-                dimensions=384,
-                vector_search_profile_name="my-vector-profile"
-            )
-        ]
-        vector_search = VectorSearch(
-            algorithms=[VectorSearchAlgorithmConfiguration(name="my-hnsw", kind="hnsw")],
-            profiles=[VectorSearchProfile(name="my-vector-profile", algorithm_configuration_name="my-hnsw")]
-        )
-        index = SearchIndex(name=index_name, fields=fields, vector_search=vector_search)
-
-        # Create index if it doesn't exist
-        try:
-            index_client.get_index(index_name)
-            logger.info(f"Index {index_name} already exists")
-        except:
-            logger.info(f"Creating index {index_name}")
-            index_client.create_index(index)
-            logger.info(f"Index {index_name} created successfully")
-
-        # Initialize Azure Search client
-        search_client = SearchClient(endpoint=endpoint, index_name=index_name, credential=credential)
-        logger.debug("Initialized Azure Search client")
-
-        # Upload documents with embeddings
+    manifest = None if index_created else load_manifest(index_name)
+    manifest_loaded = manifest is not None
+    if not manifest_loaded:
+        manifest = empty_manifest(index_name)
+        if not index_created:
+            # No manifest for an existing index: treat every indexed id as unknown so it is reconciled
+            existing_ids = _list_index_ids(search_client)
+            manifest["documents"] = {doc_id: {"model": None} for doc_id in existing_ids}
+            logger.info(f"Reconciling {len(existing_ids)} documents already in index {index_name}")
+
+    # Chunks arrive as a stream: each batch is planned, embedded and uploaded before the next is read,
+    # so embeddings never accumulate; the manifest keeps one id per document
+    report = {"added": 0, "updated": 0, "deleted": 0, "skipped": 0}
+    model_id = getattr(embedding_model, "model_id", EMBEDDING_MODEL_NAME)
+    seen = set()
+    for chunk_batch in batched(chunks, min(INGEST_BATCH_SIZE, UPLOAD_BATCH_SIZE)):
+        plan = plan_batch(manifest, chunk_batch, model_id, seen)
+        report["skipped"] += plan["skip"]
+        batch = [(doc_id, content, "added") for doc_id, content in plan["add"]]
+        batch += [(doc_id, content, "updated") for doc_id, content in plan["update"]]
+        if not batch:
+            continue
+        vectors = embedding_model.encode([content for _, content, _ in batch])
         documents = [
             {
-                "id": str(i),
-                "content": chunk,
-                "embedding": embedding_model.encode(chunk).tolist()
+                "id": doc_id,
+                "content": content,
+                "embedding": vector.tolist()
             }
-            for i, chunk in enumerate(chunks)
+            for (doc_id, content, _), vector in zip(batch, vectors)
         ]
-        try:
-            result = search_client.upload_documents(documents)
-            logger.info(f"Uploaded {len(documents)} documents to Azure Search index")
-            for res in result:
-                if not res.succeeded:
-                    logger.error(f"Failed to upload document {res.key}: {res.error_message}")
-        except Exception as e:
-            logger.error(f"Error uploading documents: {e}")
-            raise
-
-        return embedding_model, chunks, search_client
+        kinds = {doc_id: kind for doc_id, _, kind in batch}
+        for res in search_client.merge_or_upload_documents(documents):
+            if res.succeeded:
+                manifest["documents"][res.key] = {"model": model_id}
+                report[kinds[res.key]] += 1
+            else:
+                logger.error(f"Failed to upload document {res.key}: {res.error_message}")
+
+    for batch in batched(stale_ids(manifest, seen), UPLOAD_BATCH_SIZE):
+        for res in search_client.delete_documents(documents=[{"id": doc_id} for doc_id in batch]):
+            if res.succeeded:
+                manifest["documents"].pop(res.key, None)
+                report["deleted"] += 1
+            else:
+                logger.error(f"Failed to delete document {res.key}: {res.error_message}")
+
+    if report["added"] or report["updated"] or report["deleted"] or not manifest_loaded:
+        save_manifest(manifest)
+    return report
+
+def connect_azure_search(embedding_model, chunks):
+    from azure.search.documents import SearchClient
+    from azure.search.documents.aio import SearchClient as AsyncSearchClient
+    from azure.search.documents.indexes import SearchIndexClient
+    from azure.search.documents.indexes.models import (
+        VectorSearch,  # Correct import from indexes.models
+        SearchIndex,
+        SearchField,
+        SearchFieldDataType,
+        SimpleField,
+        SearchableField,
+        VectorSearchAlgorithmConfiguration,
+        VectorSearchProfile,
+    )
+    from azure.core.credentials import AzureKeyCredential
+
+    logger = setup_logger()
+
+    # Load Azure Search configuration
+    load_dotenv()
+    endpoint = os.getenv("AZURE_SEARCH_ENDPOINT")
+    api_key = os.getenv("AZURE_SEARCH_API_KEY")
+    if not endpoint or not api_key:
+        logger.error("AZURE_SEARCH_ENDPOINT or AZURE_SEARCH_API_KEY not set in .env")
+        raise ValueError("Azure Search configuration is missing in .env")
+
+    # Initialize Azure Search index client
+    credential = AzureKeyCredential(api_key)
+    index_client = SearchIndexClient(endpoint=endpoint, credential=credential)
+    logger.debug("Initialized Azure Search index client")
+
+    # Define index schema
+    index_name = "cardassist-index"
+    fields = [
+        SimpleField(name="id", type=SearchFieldDataType.String, key=True, searchable=False),
+        SearchableField(name="content", type=SearchFieldDataType.String),
+        SearchField(
+            name="embedding",
+            type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
+            searchable=True,
+            dimensions=384,
+            vector_search_profile_name="my-vector-profile"
+        )
+    ]
+    vector_search = VectorSearch(
+        algorithms=[VectorSearchAlgorithmConfiguration(name="my-hnsw", kind="hnsw")],
+        profiles=[VectorSearchProfile(name="my-vector-profile", algorithm_configuration_name="my-hnsw")]
+    )
+    index = SearchIndex(name=index_name, fields=fields, vector_search=vector_search)
+
+    # Create index if it doesn't exist
+    index_created = False
+    try:
+        index_client.get_index(index_name)
+        logger.info(f"Index {index_name} already exists")
+    except:
+        logger.info(f"Creating index {index_name}")
+        index_client.create_index(index)
+        index_created = True
+        logger.info(f"Index {index_name} created successfully")
+
+    # Initialize Azure Search client
+    search_client = SearchClient(endpoint=endpoint, index_name=index_name, credential=credential)
+    logger.debug("Initialized Azure Search client")
+
+    # Embed and upload only new or changed chunks, delete chunks that no longer exist. Under the manifest lock,
+    # workers after the first find the manifest up to date and only plan, without uploading or rewriting it
+    try:
+        with file_lock(MANIFEST_LOCK_PATH):
+            report = sync_search_index(search_client, embedding_model, chunks, index_name, index_created)
+        logger.info(
+            f"Synced Azure Search index {index_name}: {report['added']} added, {report['updated']} updated, "
+            f"{report['deleted']} deleted, {report['skipped']} skipped"
+        )
+    except Exception as e:
+        logger.error(f"Error uploading documents: {e}")
+        raise
+    search_client.close()
+
+    # Queries go through a pooled async client created on the shared event loop
+    async def open_query_client():
+        # Retries and backoff are left to the upstream scheduler, which shares them across sessions
+        return AsyncSearchClient(
+            endpoint=endpoint, index_name=index_name, credential=credential, transport=await azure_transport(),
+            retry_total=0
+        )
+
+    return run_async(open_query_client())
+
+def build_knowledge_base(embedding_model, sources=KNOWLEDGE_SOURCES, backend: str = SEARCH_BACKEND):
+    # Pages are extracted in worker processes and chunked on the fly; the index consumes the chunk
+    # stream batch by batch, so extraction, embedding and upload overlap and embeddings only exist one
+    # batch at a time outside the index. Memory still grows with the corpus: the chunk texts are kept
+    # for context assembly, along with the BM25 postings and, for local backends, the vectors.
+    documents = discover_documents(sources)
+    stats = IngestionStats()
+    count_tokens = TokenCounter(getattr(embedding_model, "tokenizer", None))
+    chunks = []
+    # Built from the same stream, so BM25 positions index into chunks
+    lexical_index = BM25Index()
+
+    def chunk_stream():
+        for chunk in iter_chunks(iter_pages(documents, stats), count_tokens, stats=stats):
+            chunks.append(chunk)
+            lexical_index.add(chunk)
+            yield chunk
+
+    with startup_phase("ingestion"):
+        if backend == "azure":
+            search_client = connect_azure_search(embedding_model, chunk_stream())
+        else:
+            search_client = create_local_search_client(backend, chunk_stream(), embedding_model)
+        lexical_index.finalize()
+    stats.finish()
+    return chunks, search_client, lexical_index, stats
+
+def load_knowledge_base():
+    # Heavy dependencies are imported here so that importing this module stays cheap
+    logger = setup_logger()
+    logger.debug(f"Loading knowledge base with {SEARCH_BACKEND} search backend")
+    try:
+        with startup_phase("embedding_model"):
+            model, backend = load_embedding_model(EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND)
+            embedding_model = CachedEmbeddingModel(model, embedding_model_id(EMBEDDING_MODEL_NAME, backend))
+        logger.info(f"Loaded {embedding_model.model_id} with {len(embedding_model.cache)} cached embeddings")
+
+        chunks, search_client, lexical_index, stats = build_knowledge_base(embedding_model)
+        logger.info(f"Ingested {stats.summary()}")
+        logger.info(f"BM25 index: {len(lexical_index.terms)} terms, {lexical_index.nbytes / 1e6:.1f} MB")
+
+        # Cached answers are tied to the indexed content
+        get_answer_cache().bind_corpus(corpus_fingerprint(chunks, embedding_model.model_id))
+
+        return embedding_model, chunks, search_client, lexical_index
     except Exception as e:
         logger.error(f"Error loading knowledge base: {e}")
-        raise
\ No newline at end of file
+        raise
@@ -0,0 +1,105 @@
+import os
+import re
+from array import array
+import numpy as np
+
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+# Keeps codes and labels such as "E-1023", "v2.1" or "card_admin" as single terms
+TERM_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i if in is it my of on or the this to what when "
+    "where which who why will with you your".split()
+)
+
+def tokenize(text: str) -> list:
+    return [term for term in TERM_PATTERN.findall(text.lower()) if term not in STOPWORDS]
+
+class BM25Index:
+    # Okapi BM25 over chunk positions. Documents are added one at a time while the corpus streams in;
+    # finalize() packs the postings into flat arrays (int32 document ids, uint16 term counts, one offset
+    # per term), so the index costs a few bytes per posting instead of a dict per document.
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.terms = {}
+        self._building = []
+        self._lengths = array("I")
+        self.offsets = None
+        self.doc_ids = None
+        self.counts = None
+        self.idf = None
+        self.length_norm = None
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def add(self, text: str) -> int:
+        position = len(self._lengths)
+        terms = tokenize(text)
+        self._lengths.append(len(terms))
+        frequencies = {}
+        for term in terms:
+            frequencies[term] = frequencies.get(term, 0) + 1
+        for term, count in frequencies.items():
+            term_id = self.terms.get(term)
+            if term_id is None:
+                term_id = self.terms[term] = len(self._building)
+                self._building.append((array("i"), array("H")))
+            doc_ids, counts = self._building[term_id]
+            doc_ids.append(position)
+            counts.append(min(count, 65535))
+        return position
+
+    def finalize(self):
+        sizes = np.array([len(doc_ids) for doc_ids, _ in self._building], dtype=np.int64)
+        self.offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=self.offsets[1:])
+        self.doc_ids = np.empty(int(self.offsets[-1]), dtype=np.int32)
+        self.counts = np.empty(int(self.offsets[-1]), dtype=np.uint16)
+        for term_id, (doc_ids, counts) in enumerate(self._building):
+            start, stop = self.offsets[term_id], self.offsets[term_id + 1]
+            self.doc_ids[start:stop] = np.frombuffer(doc_ids, dtype=np.int32)
+            self.counts[start:stop] = np.frombuffer(counts, dtype=np.uint16)
+        self._building = []
+
+        documents = len(self._lengths)
+        self.idf = np.log1p((documents - sizes + 0.5) / (sizes + 0.5)).astype(np.float32)
+        lengths = np.frombuffer(self._lengths, dtype=np.uint32).astype(np.float32)
+        average = float(lengths.mean()) if documents else 0.0
+        # Per-document part of the BM25 denominator, precomputed once
+        self.length_norm = (self.k1 * (1 - self.b + self.b * lengths / average)).astype(np.float32) if average else \
+            np.full(documents, self.k1, dtype=np.float32)
+        return self
+
+    @classmethod
+    def from_texts(cls, texts) -> "BM25Index":
+        index = cls()
+        for text in texts:
+            index.add(text)
+        return index.finalize()
+
+    @property
+    def nbytes(self) -> int:
+        arrays = (self.offsets, self.doc_ids, self.counts, self.idf, self.length_norm)
+        return sum(a.nbytes for a in arrays if a is not None)
+
+    def search(self, query: str, k: int) -> list:
+        # (position, score) pairs, best first; only documents containing a query term are scored
+        term_ids = [self.terms[term] for term in set(tokenize(query)) if term in self.terms]
+        if not term_ids or not len(self._lengths):
+            return []
+        scores = np.zeros(len(self._lengths), dtype=np.float32)
+        for term_id in term_ids:
+            start, stop = self.offsets[term_id], self.offsets[term_id + 1]
+            doc_ids = self.doc_ids[start:stop]
+            tf = self.counts[start:stop].astype(np.float32)
+            scores[doc_ids] += self.idf[term_id] * tf * (self.k1 + 1) / (tf + self.length_norm[doc_ids])
+        matched = np.flatnonzero(scores)
+        k = min(k, len(matched))
+        if k == 0:
+            return []
+        top = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+        return [(int(position), float(scores[position])) for position in top]
@@ -1,41 +1,119 @@
+import atexit
+import contextvars
+import json
 import logging
 import os
-from logging.handlers import RotatingFileHandler
-from datetime import datetime
+import queue
+import threading
+import uuid
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from datetime import datetime, timezone
 
-def setup_logger(log_level: str = "INFO"):
-    logger = logging.getLogger("CardAssist")
-    
-    # Convert log_level string to logging level constant
-    level = getattr(logging, log_level.upper(), logging.INFO)
-    logger.setLevel(level)
+# json: one JSON object per line; text: the original human-readable format
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+# Hand records to a background listener thread so file and console I/O stay off the request path
+LOG_ASYNC = os.getenv("LOG_ASYNC", "true").lower() in ("1", "true", "yes")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_MAX_MESSAGE_CHARS = int(os.getenv("LOG_MAX_MESSAGE_CHARS", "2000"))
+
+# Correlation id of the chat turn being handled in the current context
+_correlation_id = contextvars.ContextVar("correlation_id", default=None)
+_listener = None
+_setup_lock = threading.Lock()
+
+def new_correlation_id() -> str:
+    correlation_id = uuid.uuid4().hex[:12]
+    _correlation_id.set(correlation_id)
+    return correlation_id
+
+def set_correlation_id(correlation_id: str):
+    _correlation_id.set(correlation_id)
+
+class _ContextFilter(logging.Filter):
+    # Runs in the caller's thread: stamps the correlation id and caps the message size before queueing
+    def filter(self, record):
+        record.correlation_id = _correlation_id.get()
+        message = record.getMessage()
+        if len(message) > LOG_MAX_MESSAGE_CHARS:
+            message = f"{message[:LOG_MAX_MESSAGE_CHARS]}... [{len(message) - LOG_MAX_MESSAGE_CHARS} chars truncated]"
+        record.msg = message
+        record.args = None
+        return True
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        correlation_id = getattr(record, "correlation_id", None)
+        if correlation_id:
+            entry["correlation_id"] = correlation_id
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+class _DroppingQueueHandler(QueueHandler):
+    # A full queue drops the record rather than blocking the request
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+def _formatter(console: bool) -> logging.Formatter:
+    if LOG_FORMAT == "json":
+        return _JsonFormatter()
+    if console:
+        return logging.Formatter("%(name)s - %(levelname)s - %(message)s")
+    return logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 
+def _configure(logger: logging.Logger):
+    global _listener
+    # Create logs directory
+    logs_dir = "logs"
+    os.makedirs(logs_dir, exist_ok=True)
+
+    # Create date-based subfolder (e.g., 2025-04-19)
+    current_date = datetime.now().strftime("%Y-%m-%d")
+    date_dir = os.path.join(logs_dir, current_date)
+    os.makedirs(date_dir, exist_ok=True)
+
+    # Create log file name based on run time (e.g., cardassist_2025-04-19_10-00-00.log)
+    current_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    log_file = os.path.join(date_dir, f"cardassist_{current_time}.log")
+
+    # File handler with rotation
+    file_handler = RotatingFileHandler(log_file, maxBytes=1048576, backupCount=5)
+    file_handler.setFormatter(_formatter(console=False))
+
+    # Console handler
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(_formatter(console=True))
+
+    if LOG_ASYNC:
+        queue_handler = _DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        queue_handler.addFilter(_ContextFilter())
+        logger.addHandler(queue_handler)
+        _listener = QueueListener(queue_handler.queue, file_handler, console_handler)
+        _listener.start()
+        atexit.register(_listener.stop)
+    else:
+        for handler in (file_handler, console_handler):
+            handler.addFilter(_ContextFilter())
+            logger.addHandler(handler)
+
+def setup_logger(log_level: str = None):
+    # Handlers are configured once per process; later calls only return the logger,
+    # or change its level when one is given explicitly
+    logger = logging.getLogger("CardAssist")
     if not logger.handlers:
-        # Create logs directory
-        logs_dir = "logs"
-        os.makedirs(logs_dir, exist_ok=True)
-
-        # Create date-based subfolder (e.g., 2025-04-19)
-        current_date = datetime.now().strftime("%Y-%m-%d")
-        date_dir = os.path.join(logs_dir, current_date)
-        os.makedirs(date_dir, exist_ok=True)
-
-        # Create log file name based on run time (e.g., cardassist_2025-04-19_10-00-00.log)
-        current_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        log_file = os.path.join(date_dir, f"cardassist_{current_time}.log")
-
-        # File handler with rotation
-        file_handler = RotatingFileHandler(log_file, maxBytes=1048576, backupCount=5)
-        file_handler.setLevel(level)
-        file_formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-        file_handler.setFormatter(file_formatter)
-        logger.addHandler(file_handler)
-
-        # Console handler
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(level)
-        console_formatter = logging.Formatter("%(name)s - %(levelname)s - %(message)s")
-        console_handler.setFormatter(console_formatter)
-        logger.addHandler(console_handler)
-    
-    return logger
\ No newline at end of file
+        with _setup_lock:
+            if not logger.handlers:
+                _configure(logger)
+                logger.setLevel(logging.INFO)
+    if log_level is not None:
+        logger.setLevel(getattr(logging, log_level.upper(), logging.INFO))
+    return logger
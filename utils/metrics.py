@@ -0,0 +1,211 @@
+import bisect
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from utils.logger import set_correlation_id, setup_logger
+
+# Prometheus text endpoint; an empty value or 0 disables it
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464") or "0")
+# Show each turn's stage breakdown under the latest answer in the UI
+SHOW_TURN_TIMINGS = os.getenv("SHOW_TURN_TIMINGS", "false").lower() in ("1", "true", "yes")
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _label_text(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(labels.get(name, "") for name in self.labels), 0.0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labels, key)} {value:g}")
+        return lines
+
+class Gauge(Counter):
+    # A value that goes up and down, e.g. a queue depth
+    def set(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self) -> list:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # Per label set: [per-bucket counts (last one is +Inf), sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels) -> int:
+        series = self._series.get(tuple(labels.get(name, "") for name in self.labels))
+        return series[2] if series else 0
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    labels = _label_text(self.labels, key, f'le="{le}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {total:g}")
+                lines.append(f"{self.name}_count{_label_text(self.labels, key)} {count}")
+        return lines
+
+stage_seconds = Histogram("cardassist_stage_seconds", "Time spent in each pipeline stage.", ("stage",))
+stage_errors = Counter("cardassist_stage_errors_total", "Exceptions raised inside a pipeline stage.", ("stage",))
+turn_seconds = Histogram("cardassist_turn_seconds", "End-to-end chat turn latency, including streaming.", ("intent",))
+turns_total = Counter("cardassist_turns_total", "Chat turns handled, by intent.", ("intent",))
+llm_tokens = Counter("cardassist_llm_tokens_total", "OpenAI tokens used.", ("caller", "kind"))
+cache_requests = Counter("cardassist_cache_requests_total", "Cache lookups by cache and result.", ("cache", "result"))
+intent_decisions = Counter("cardassist_intent_decisions_total", "Intent decisions by classifier tier and intent.", ("tier", "intent"))
+# Every centroid decision, including those escalated to the LLM, for tuning INTENT_CONFIDENCE_THRESHOLD
+intent_centroid_confidence = Histogram(
+    "cardassist_intent_centroid_confidence", "Confidence of nearest-centroid intent decisions.", ("outcome",),
+    buckets=(0.3, 0.4, 0.5, 0.6, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95, 0.99, 1.0),
+)
+speculation_total = Counter("cardassist_speculation_total", "Speculative retrievals by outcome.", ("result",))
+speculation_saved_seconds = Histogram("cardassist_speculation_saved_seconds", "Latency saved by committed speculative retrievals.")
+
+# Stage timings of the chat turn being handled in the current context
+_current_turn = contextvars.ContextVar("current_turn", default=None)
+
+def observe_stage(stage: str, seconds: float):
+    stage_seconds.observe(seconds, stage=stage)
+    timings = _current_turn.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+@contextmanager
+def span(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        stage_errors.inc(stage=stage)
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+def start_turn() -> dict:
+    timings = {}
+    _current_turn.set(timings)
+    return timings
+
+def finish_turn(timings: dict, intent: str, started: float):
+    seconds = time.perf_counter() - started
+    timings["total"] = seconds
+    turns_total.inc(intent=intent)
+    turn_seconds.observe(seconds, intent=intent)
+
+async def bind_turn(stream, timings: dict, intent: str, started: float, correlation_id: str = None):
+    # A streamed answer is consumed by another task: carry the turn's timings and log correlation id into it
+    _current_turn.set(timings)
+    set_correlation_id(correlation_id)
+    try:
+        async for item in stream:
+            yield item
+    finally:
+        finish_turn(timings, intent, started)
+
+def format_timings(timings: dict) -> str:
+    parts = [f"{stage} {seconds * 1000:.0f} ms" for stage, seconds in timings.items() if stage != "total"]
+    if "total" in timings:
+        parts.append(f"total {timings['total'] * 1000:.0f} ms")
+    return " · ".join(parts)
+
+def render_prometheus() -> str:
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+_server = None
+_server_lock = threading.Lock()
+
+def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST):
+    global _server
+    logger = setup_logger()
+    with _server_lock:
+        if _server is not None or not port:
+            return _server
+        try:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError as e:
+            # Another process on this host (e.g. a second worker) already serves the port
+            logger.warning(f"Metrics endpoint not started on {host}:{port}: {e}")
+            return None
+        threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+        logger.info(f"Serving Prometheus metrics on http://{host}:{port}/metrics")
+        return _server
@@ -1,8 +1,7 @@
 import openai
-from semantic_kernel import Kernel
-from semantic_kernel.connectors.ai.open_ai import OpenAIChatCompletion
 from dotenv import load_dotenv
 import os
+from utils.http_pool import openai_http_client
 from utils.logger import setup_logger
 
 def setup_openai():
@@ -19,13 +18,18 @@ def setup_openai():
     
     logger.info("Successfully loaded OpenAI API key from environment")
     
-    openai_client = openai.OpenAI(api_key=openai_key)
+    # One pooled, keep-alive HTTP client shared by the agents and Semantic Kernel.
+    # Retries are done by the upstream scheduler, which honours Retry-After across all sessions.
+    openai_client = openai.AsyncOpenAI(api_key=openai_key, http_client=openai_http_client(), max_retries=0)
     
+    # Imported here so that tools which only need the agents do not pull in Semantic Kernel
+    from semantic_kernel import Kernel
+    from semantic_kernel.connectors.ai.open_ai import OpenAIChatCompletion
     kernel = Kernel()
     chat_service = OpenAIChatCompletion(
         service_id="openai-gpt4",
         ai_model_id="gpt-4",
-        api_key=openai_key
+        async_client=openai_client
     )
     kernel.add_service(chat_service)
     logger.debug("OpenAI client and Semantic Kernel initialized")
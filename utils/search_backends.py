@@ -0,0 +1,368 @@
+import os
+import tempfile
+from collections import namedtuple
+import numpy as np
+from utils.index_manifest import chunk_id
+from utils.ingestion import batched
+from utils.logger import setup_logger
+
+# azure: Azure AI Search; numpy: exact in-process search; faiss: approximate (HNSW) in-process search
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "azure").lower()
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))
+# In-memory vector precision for local search: float32, float16 or int8. Compact formats shortlist
+# RESCORE_FACTOR * k candidates and rescore them exactly against float32 vectors kept in a memory-mapped file.
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "float32").lower()
+RESCORE_FACTOR = int(os.getenv("RESCORE_FACTOR", "4"))
+SCORE_BLOCK_ROWS = 16384
+
+IndexingResult = namedtuple("IndexingResult", ["key", "succeeded", "error_message", "status_code"])
+
+def _vector_query_parts(query):
+    # Accept the dict form used by KnowledgeAgent as well as azure VectorizedQuery objects
+    if isinstance(query, dict):
+        return query["vector"], query.get("k") or query.get("k_nearest_neighbors")
+    return query.vector, getattr(query, "k_nearest_neighbors", None) or getattr(query, "k", None)
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def _top_k(scores: np.ndarray, k: int):
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return top, scores[top]
+
+class CompactVectors:
+    # L2-normalised vectors in float32, float16 or int8 (symmetric, one scale per row).
+    # For the compact formats the float32 originals live in an anonymous memory-mapped file,
+    # so only the rows being rescored are paged in. keep_codes=False is for indexes that hold their own codes.
+    # Storage grows by doubling, so appending a batch copies existing rows only O(log n) times in total.
+    def __init__(self, vectors: np.ndarray, dtype: str = VECTOR_DTYPE, keep_codes: bool = True):
+        if dtype not in ("float32", "float16", "int8"):
+            raise ValueError(f"Unknown vector dtype: {dtype}")
+        self.dtype = dtype
+        self.keep_codes = keep_codes or dtype == "float32"
+        self.rows = 0
+        self.capacity = 0
+        self._codes = None
+        self._scales = None
+        self._exact = None
+        self.append(vectors)
+
+    def __len__(self):
+        return self.rows
+
+    @property
+    def matrix(self):
+        return None if self._codes is None else self._codes[:self.rows]
+
+    @property
+    def scales(self):
+        return None if self._scales is None else self._scales[:self.rows]
+
+    @property
+    def nbytes(self) -> int:
+        # Resident bytes, spare capacity included; the memory-mapped originals are paged in on demand
+        if self._codes is None:
+            return 0
+        return self._codes.nbytes + (self._scales.nbytes if self._scales is not None else 0)
+
+    def _grow(self, rows: int, dim: int):
+        capacity = max(rows, self.capacity * 2, 64)
+        if self.keep_codes:
+            code_dtype = np.int8 if self.dtype == "int8" else np.dtype(self.dtype)
+            codes = np.empty((capacity, dim), dtype=code_dtype)
+            if self._codes is not None:
+                codes[:self.rows] = self._codes[:self.rows]
+            self._codes = codes
+        if self.keep_codes and self.dtype == "int8":
+            scales = np.empty(capacity, dtype=np.float32)
+            if self._scales is not None:
+                scales[:self.rows] = self._scales[:self.rows]
+            self._scales = scales
+        if self.dtype != "float32":
+            exact = np.memmap(tempfile.TemporaryFile(), dtype=np.float32, mode="w+", shape=(capacity, dim))
+            if self._exact is not None:
+                exact[:self.rows] = self._exact[:self.rows]
+            self._exact = exact
+        self.capacity = capacity
+
+    def _store(self, start: int, vectors: np.ndarray):
+        stop = start + len(vectors)
+        if self.dtype == "float32":
+            self._codes[start:stop] = vectors
+            return
+        if self.keep_codes and self.dtype == "float16":
+            self._codes[start:stop] = vectors.astype(np.float16)
+        elif self.keep_codes:
+            scales = np.abs(vectors).max(axis=1, initial=0.0) / 127.0
+            scales[scales == 0] = 1.0
+            self._scales[start:stop] = scales
+            self._codes[start:stop] = np.round(vectors / scales[:, None]).astype(np.int8)
+        self._exact[start:stop] = vectors
+
+    def append(self, vectors: np.ndarray):
+        if not len(vectors):
+            return
+        vectors = _normalize(vectors)
+        if self.rows + len(vectors) > self.capacity:
+            self._grow(self.rows + len(vectors), vectors.shape[1])
+        self._store(self.rows, vectors)
+        self.rows += len(vectors)
+
+    def update(self, position: int, vector: np.ndarray):
+        self._store(position, _normalize(vector.reshape(1, -1)))
+
+    def exact(self, positions=None) -> np.ndarray:
+        source = self.matrix if self._exact is None else self._exact[:self.rows]
+        if source is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.asarray(source if positions is None else source[positions], dtype=np.float32)
+
+    def approximate_scores(self, vector: np.ndarray) -> np.ndarray:
+        if self.dtype == "float32":
+            return self.matrix @ vector
+        # numpy has no BLAS path for float16/int8, so widen a block at a time to keep the temporary small
+        scores = np.empty(self.rows, dtype=np.float32)
+        for start in range(0, self.rows, SCORE_BLOCK_ROWS):
+            stop = min(start + SCORE_BLOCK_ROWS, self.rows)
+            scores[start:stop] = self._codes[start:stop].astype(np.float32) @ vector
+        if self._scales is not None:
+            scores *= self.scales
+        return scores
+
+    def rescore(self, vector: np.ndarray, candidates: np.ndarray, k: int):
+        # Exact scores for the shortlisted rows, best first; rows are read in file order
+        candidates = np.sort(candidates)
+        order, scores = _top_k(self.exact(candidates) @ vector, k)
+        return candidates[order], scores
+
+    def search(self, vector: np.ndarray, k: int):
+        if self.dtype == "float32":
+            return _top_k(self.matrix @ vector, k)
+        candidates, _ = _top_k(self.approximate_scores(vector), k * RESCORE_FACTOR)
+        return self.rescore(vector, candidates, k)
+
+class NumpySearchClient:
+    # Exact cosine search over a contiguous, L2-normalised matrix; compact dtypes are rescored exactly.
+    # New documents are appended in place; updates overwrite their row, deletes compact the matrix.
+    def __init__(self, documents: list = None, dtype: str = VECTOR_DTYPE):
+        self.logger = setup_logger()
+        self.dtype = dtype
+        self._ids = []
+        self._contents = []
+        self._positions = {}
+        self._vectors = self._new_vectors(np.empty((0, 0), dtype=np.float32))
+        if documents:
+            self.merge_or_upload_documents(documents)
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def vector_bytes(self) -> int:
+        return self._vectors.nbytes
+
+    def _new_vectors(self, vectors: np.ndarray) -> CompactVectors:
+        return CompactVectors(vectors, self.dtype)
+
+    def _rebuild(self, vectors: np.ndarray):
+        if not len(vectors):
+            vectors = np.empty((0, 0), dtype=np.float32)
+        self._vectors = self._new_vectors(vectors)
+        self._positions = {doc_id: i for i, doc_id in enumerate(self._ids)}
+
+    def _append(self, vectors: np.ndarray):
+        self._vectors.append(vectors)
+
+    def _update(self, updates: dict):
+        for position, vector in updates.items():
+            self._vectors.update(position, vector)
+
+    def _scores(self, vector: np.ndarray, k: int):
+        return self._vectors.search(vector, k)
+
+    def merge_or_upload_documents(self, documents: list) -> list:
+        stored = len(self._vectors)
+        appended = []
+        updates = {}
+        results = []
+        for doc in documents:
+            vector = np.asarray(doc["embedding"], dtype=np.float32)
+            position = self._positions.get(doc["id"])
+            if position is None:
+                self._positions[doc["id"]] = len(self._ids)
+                self._ids.append(doc["id"])
+                self._contents.append(doc["content"])
+                appended.append(vector)
+            elif position >= stored:
+                # Repeated within this call: the last version wins, still as one appended row
+                self._contents[position] = doc["content"]
+                appended[position - stored] = vector
+            else:
+                self._contents[position] = doc["content"]
+                updates[position] = vector
+            results.append(IndexingResult(doc["id"], True, None, 201))
+        if updates:
+            self._update(updates)
+        if appended:
+            self._append(np.stack(appended))
+        return results
+
+    upload_documents = merge_or_upload_documents
+
+    def delete_documents(self, documents: list) -> list:
+        doomed = {doc["id"] for doc in documents}
+        keep = [i for i, doc_id in enumerate(self._ids) if doc_id not in doomed]
+        vectors = self._vectors.exact(keep) if len(self._ids) else self._vectors.exact()
+        self._ids = [self._ids[i] for i in keep]
+        self._contents = [self._contents[i] for i in keep]
+        self._rebuild(vectors)
+        return [IndexingResult(doc["id"], True, None, 200) for doc in documents]
+
+    def search(self, search_text: str = None, vector_queries: list = None, top: int = None, **kwargs) -> list:
+        top = top or 50
+        if not self._ids:
+            return []
+        if not vector_queries:
+            return [{"id": doc_id, "content": content, "@search.score": 1.0}
+                    for doc_id, content in zip(self._ids[:top], self._contents[:top])]
+
+        # Several vector queries are merged by keeping each document's best score
+        best = {}
+        for query in vector_queries:
+            vector, k = _vector_query_parts(query)
+            query_vector = _normalize(np.asarray(vector, dtype=np.float32))
+            positions, scores = self._scores(query_vector, k or top)
+            for position, score in zip(positions, scores):
+                position = int(position)
+                if score > best.get(position, -np.inf):
+                    best[position] = float(score)
+        ranked = sorted(best.items(), key=lambda item: item[1], reverse=True)[:top]
+        return [{"id": self._ids[position], "content": self._contents[position], "@search.score": score}
+                for position, score in ranked]
+
+class FaissSearchClient(NumpySearchClient):
+    # Approximate inner-product HNSW index for larger corpora; compact dtypes use faiss' scalar quantizer
+    def __init__(self, documents: list = None, m: int = FAISS_HNSW_M, ef_search: int = FAISS_EF_SEARCH,
+                 dtype: str = VECTOR_DTYPE):
+        import faiss
+        self._faiss = faiss
+        self.m = m
+        self.ef_search = ef_search
+        self._index = None
+        self._trained_rows = 0
+        super().__init__(documents, dtype)
+
+    @property
+    def vector_bytes(self) -> int:
+        if self._index is None or self.dtype == "float32":
+            return super().vector_bytes
+        return len(self._ids) * self._index.d * (2 if self.dtype == "float16" else 1)
+
+    def _new_vectors(self, vectors: np.ndarray) -> CompactVectors:
+        # The HNSW graph stores its own (quantized) codes; only the float32 originals are kept for rescoring
+        return CompactVectors(vectors, self.dtype, keep_codes=False)
+
+    def _build_index(self):
+        self._index = None
+        self._trained_rows = len(self._vectors)
+        if len(self._vectors):
+            matrix = self._vectors.exact()
+            dim = matrix.shape[1]
+            if self.dtype == "float32":
+                self._index = self._faiss.IndexHNSWFlat(dim, self.m, self._faiss.METRIC_INNER_PRODUCT)
+            else:
+                qtype = self._faiss.ScalarQuantizer.QT_fp16 if self.dtype == "float16" else self._faiss.ScalarQuantizer.QT_8bit
+                self._index = self._faiss.IndexHNSWSQ(dim, qtype, self.m, self._faiss.METRIC_INNER_PRODUCT)
+                self._index.train(matrix)
+            self._index.hnsw.efSearch = self.ef_search
+            self._index.add(matrix)
+
+    def _rebuild(self, vectors: np.ndarray):
+        super()._rebuild(vectors)
+        self._build_index()
+
+    def _append(self, vectors: np.ndarray):
+        start = len(self._vectors)
+        super()._append(vectors)
+        # HNSW takes new vectors incrementally. The scalar quantizer was trained on the rows present at the
+        # last build, so it is retrained once the index has doubled since, keeping total rebuild work linear
+        if self._index is None or (self.dtype != "float32" and len(self._vectors) >= 2 * self._trained_rows):
+            self._build_index()
+        else:
+            self._index.add(self._vectors.exact(np.arange(start, len(self._vectors))))
+
+    def _update(self, updates: dict):
+        # HNSW cannot replace a vector in place
+        super()._update(updates)
+        self._build_index()
+
+    def _scores(self, vector: np.ndarray, k: int):
+        shortlist = k if self.dtype == "float32" else k * RESCORE_FACTOR
+        scores, positions = self._index.search(vector.reshape(1, -1), min(shortlist, len(self._ids)))
+        valid = positions[0] >= 0
+        if self.dtype == "float32":
+            return positions[0][valid], scores[0][valid]
+        return self._vectors.rescore(vector, positions[0][valid], k)
+
+async def _iterate(results: list):
+    for result in results:
+        yield result
+
+class AsyncSearchClientAdapter:
+    # Exposes a local backend through the azure.search.documents.aio contract: await search(), then async for
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def __len__(self):
+        return len(self.client)
+
+    async def search(self, search_text: str = None, vector_queries: list = None, top: int = None, **kwargs):
+        return _iterate(self.client.search(search_text=search_text, vector_queries=vector_queries, top=top, **kwargs))
+
+    async def get_document_count(self) -> int:
+        return len(self.client)
+
+    async def close(self):
+        pass
+
+def create_local_search_client(backend: str, chunks, embedding_model):
+    # chunks may be a stream: each batch is embedded and appended to the index before the next is read,
+    # so no embeddings are held outside the index itself
+    logger = setup_logger()
+    if backend == "faiss":
+        try:
+            client = FaissSearchClient()
+        except ImportError:
+            logger.warning("faiss is not installed, falling back to the numpy search backend")
+            client = NumpySearchClient()
+    elif backend == "numpy":
+        client = NumpySearchClient()
+    else:
+        raise ValueError(f"Unknown local search backend: {backend}")
+    seen = set()
+    for batch in batched(chunks):
+        contents = []
+        for content in batch:
+            doc_id = chunk_id(content)
+            if doc_id not in seen:
+                seen.add(doc_id)
+                contents.append(content)
+        if not contents:
+            continue
+        vectors = embedding_model.encode(contents)
+        client.merge_or_upload_documents([
+            {"id": chunk_id(content), "content": content, "embedding": vector}
+            for content, vector in zip(contents, vectors)
+        ])
+    logger.info(f"Built {type(client).__name__} over {len(client)} documents "
+                f"({client.dtype} vectors, {client.vector_bytes / 1e6:.1f} MB resident)")
+    return AsyncSearchClientAdapter(client)
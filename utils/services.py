@@ -0,0 +1,132 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from agents.card_management_agent import CardManagementAgent
+from agents.intent_agent import IntentAgent
+from agents.knowledge_agent import KnowledgeAgent
+from utils.async_runtime import run_async
+from utils.knowledge_base import load_knowledge_base
+from utils.logger import setup_logger
+from utils.metrics import start_metrics_server
+from utils.openai_setup import setup_openai
+from utils.single_flight import coalesce_openai, coalesce_search
+from utils.upstream import schedule_openai, schedule_search
+from utils.startup import startup_phase, startup_timings
+
+HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", "10"))
+# How long a knowledge question waits for the warm-up before getting a "still warming up" reply
+KNOWLEDGE_WARMUP_WAIT = float(os.getenv("KNOWLEDGE_WARMUP_WAIT", "5"))
+# A failed warm-up is retried after WARMUP_RETRY_BASE seconds, doubling up to WARMUP_RETRY_MAX
+WARMUP_RETRY_BASE = float(os.getenv("WARMUP_RETRY_BASE", "5"))
+WARMUP_RETRY_MAX = float(os.getenv("WARMUP_RETRY_MAX", "300"))
+
+class Services:
+    # Process-wide clients and agents, built once and shared by every session and turn.
+    # Card intents are served immediately; the knowledge base warms up on a background thread.
+    def __init__(self, openai_client, kernel):
+        # Identical concurrent OpenAI and search calls from different sessions share one upstream request;
+        # the rest queue for the shared rate limits, concurrency caps and retries
+        self.openai_client = coalesce_openai(schedule_openai(openai_client))
+        self.kernel = kernel
+        self.intent_agent = IntentAgent(self.openai_client)
+        self.embedding_model = None
+        self.chunks = None
+        self.search_client = None
+        self.knowledge_agent = None
+        self.knowledge_future = None
+        self.health = {}
+        self.logger = setup_logger()
+
+    def card_agent(self, session) -> CardManagementAgent:
+        # Card operations act on one session's state, so this is a cheap per-turn view
+        return CardManagementAgent(session)
+
+    @property
+    def knowledge_ready(self) -> bool:
+        return self.knowledge_agent is not None
+
+    def start_warmup(self, attempt: int = 0):
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="knowledge-warmup")
+        future = self.knowledge_future = executor.submit(self._warm_up)
+        executor.shutdown(wait=False)
+        future.add_done_callback(lambda done: self._retry_warmup(done, attempt))
+
+    def _retry_warmup(self, future: Future, attempt: int):
+        # A transient Azure or model download error must not leave knowledge unavailable until a restart:
+        # the failed future stays visible (knowledge questions get "unavailable") until the next attempt replaces it
+        error = future.exception()
+        if error is None or future is not self.knowledge_future:
+            return
+        delay = min(WARMUP_RETRY_MAX, WARMUP_RETRY_BASE * (2 ** attempt))
+        self.logger.error(f"Knowledge base warm-up failed ({error}), retrying in {delay:.0f}s")
+        timer = threading.Timer(delay, self.start_warmup, (attempt + 1,))
+        timer.daemon = True
+        timer.start()
+
+    def attach_knowledge(self, embedding_model, chunks, search_client, answer_cache=None, lexical_index=None) -> KnowledgeAgent:
+        self.embedding_model = embedding_model
+        self.chunks = chunks
+        self.search_client = coalesce_search(schedule_search(search_client))
+        # The intent classifier's centroid tier switches on once the embedding model is available
+        self.intent_agent.embedding_model = embedding_model
+        self.knowledge_agent = KnowledgeAgent(
+            embedding_model, chunks, self.search_client, self.openai_client, answer_cache, lexical_index
+        )
+        if self.knowledge_future is None:
+            self.knowledge_future = Future()
+            self.knowledge_future.set_result(self.knowledge_agent)
+        return self.knowledge_agent
+
+    def _warm_up(self) -> KnowledgeAgent:
+        with startup_phase("knowledge_base"):
+            embedding_model, chunks, search_client, lexical_index = load_knowledge_base()
+        self.attach_knowledge(embedding_model, chunks, search_client, lexical_index=lexical_index)
+        with startup_phase("health_check"):
+            run_async(self.health_check())
+        self.logger.info(f"Knowledge base ready, startup timings: {', '.join(f'{k}={v:.2f}s' for k, v in startup_timings.items())}")
+        return self.knowledge_agent
+
+    async def wait_for_knowledge(self, timeout: float = KNOWLEDGE_WARMUP_WAIT) -> KnowledgeAgent:
+        # Returns None if the warm-up is still running after timeout; re-raises a failed warm-up
+        if self.knowledge_agent is not None:
+            return self.knowledge_agent
+        try:
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(self.knowledge_future)), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def _check(self, name: str, probe):
+        try:
+            await asyncio.wait_for(probe, HEALTH_CHECK_TIMEOUT)
+            return name, "ok"
+        except Exception as e:
+            return name, f"error: {e}"
+
+    async def health_check(self) -> dict:
+        probes = [self._check("openai", self.openai_client.models.list())]
+        if self.search_client is not None:
+            probes.append(self._check("search", self.search_client.get_document_count()))
+        self.health = dict(await asyncio.gather(*probes))
+        for name, status in self.health.items():
+            if status == "ok":
+                self.logger.info(f"Health check {name}: ok")
+            else:
+                self.logger.warning(f"Health check {name}: {status}")
+        return self.health
+
+_services = None
+_services_lock = threading.Lock()
+
+def get_services() -> Services:
+    global _services
+    with _services_lock:
+        if _services is None:
+            logger = setup_logger()
+            with startup_phase("openai_setup"):
+                openai_client, kernel = setup_openai()
+            _services = Services(openai_client, kernel)
+            _services.start_warmup()
+            start_metrics_server()
+            logger.info("Service container initialized, knowledge base warming up in the background")
+        return _services
@@ -1,26 +1,39 @@
 import streamlit as st
 from utils.logger import setup_logger
-import json
-import os
+from types import SimpleNamespace
+from utils.card_history import CardActionHistory
+from utils.chat_history import ChatHistory, prune_spill_files_in_background
+from utils.card_store import get_card_store
 
-def initialize_session_state():
+SESSION_KEYS = ["chat_history", "card_states", "card_action_history", "end_conversation", "last_intent", "history_cursor", "turn_timings"]
+
+def initialize_session_state(local_cards: bool = True):
+    # local_cards=False is the API client mode: card state lives on the server, so the local card store
+    # is never opened or replayed
     logger = setup_logger()
     logger.debug("Initializing session state")
     if "chat_history" not in st.session_state:
-        st.session_state.chat_history = []
+        st.session_state.chat_history = ChatHistory()
+        # New browser sessions sweep up the spill files of abandoned ones
+        prune_spill_files_in_background()
         logger.info("Initialized chat_history")
     if "card_states" not in st.session_state:
-        st.session_state.card_states = load_card_states()
-        logger.info("Initialized card_states from persistent storage")
+        st.session_state.card_states = load_card_states() if local_cards else {}
+        logger.info("Initialized card_states from persistent storage" if local_cards else "Initialized empty card_states")
     if "card_action_history" not in st.session_state:
-        st.session_state.card_action_history = load_card_action_history()
-        logger.info("Initialized card_action_history from persistent storage")
+        st.session_state.card_action_history = load_card_action_history() if local_cards else CardActionHistory()
+        logger.info("Initialized card_action_history" + (" from persistent storage" if local_cards else ""))
     if "end_conversation" not in st.session_state:
         st.session_state.end_conversation = False
         logger.info("Initialized end_conversation")
     if "last_intent" not in st.session_state:
         st.session_state.last_intent = None
         logger.info("Initialized last_intent")
+    if "history_cursor" not in st.session_state:
+        st.session_state.history_cursor = None
+        logger.info("Initialized history_cursor")
+    if "turn_timings" not in st.session_state:
+        st.session_state.turn_timings = None
 
 def update_chat_history(user_input: str, response: str):
     logger = setup_logger()
@@ -29,46 +42,52 @@ def update_chat_history(user_input: str, response: str):
     st.session_state.chat_history.append(("assistant", response))
     logger.info("Chat history updated")
 
+def snapshot_session_state():
+    # Plain view of the session for code running off the Streamlit script thread;
+    # containers are shared by reference, scalars are written back by apply_session_state
+    return SimpleNamespace(**{key: st.session_state[key] for key in SESSION_KEYS})
+
+def new_session_state(card_states: dict = None, card_action_history: CardActionHistory = None):
+    # A fresh session outside Streamlit, in the same shape as snapshot_session_state()
+    return SimpleNamespace(
+        chat_history=ChatHistory(),
+        card_states=card_states if card_states is not None else {},
+        card_action_history=card_action_history if card_action_history is not None else CardActionHistory(),
+        end_conversation=False,
+        last_intent=None,
+        history_cursor=None,
+        turn_timings=None,
+    )
+
+def apply_session_state(session):
+    for key in SESSION_KEYS:
+        st.session_state[key] = getattr(session, key)
+
 def load_card_states():
+    # Card states and action history come from one shared replay of the card store log
     logger = setup_logger()
-    file_path = "card_states.json"
     try:
-        if os.path.exists(file_path):
-            with open(file_path, "r") as f:
-                data = json.load(f)
-                return data.get("card_states", {})
-        else:
-            logger.info("No card_states.json found, initializing empty card states")
-            return {}
+        store = get_card_store()
+        store.refresh()
+        return dict(store.card_states)
     except Exception as e:
         logger.error(f"Error loading card states: {e}")
         return {}
 
 def load_card_action_history():
     logger = setup_logger()
-    file_path = "card_states.json"
     try:
-        if os.path.exists(file_path):
-            with open(file_path, "r") as f:
-                data = json.load(f)
-                return data.get("card_action_history", [])
-        else:
-            logger.info("No card_states.json found, initializing empty action history")
-            return []
+        store = get_card_store()
+        return store.card_action_history.copy()
     except Exception as e:
         logger.error(f"Error loading card action history: {e}")
-        return []
+        return CardActionHistory()
 
 def save_card_states():
+    # Mutations are appended to the card store as they happen; this only makes them durable
     logger = setup_logger()
-    file_path = "card_states.json"
     try:
-        data = {
-            "card_states": st.session_state.card_states,
-            "card_action_history": st.session_state.card_action_history
-        }
-        with open(file_path, "w") as f:
-            json.dump(data, f, indent=4)
-        logger.debug("Saved card states and action history to card_states.json")
+        get_card_store().flush()
+        logger.debug("Flushed card store log")
     except Exception as e:
-        logger.error(f"Error saving card states: {e}")
\ No newline at end of file
+        logger.error(f"Error saving card states: {e}")
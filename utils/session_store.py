@@ -0,0 +1,184 @@
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+from types import SimpleNamespace
+from utils.card_store import get_card_store
+from utils.chat_history import ChatHistory, prune_spill_files_in_background
+from utils.logger import setup_logger
+
+# memory: sessions live in this process; file: one JSON file per session, shared by all API workers
+API_SESSION_STORE = os.getenv("API_SESSION_STORE", "memory").lower()
+API_SESSION_DIR = os.getenv("API_SESSION_DIR", os.path.join("cache", "sessions"))
+API_SESSION_TTL = float(os.getenv("API_SESSION_TTL", "86400"))
+# The file store removes expired sessions at most this often per worker, on session creation
+API_SESSION_SWEEP_INTERVAL = float(os.getenv("API_SESSION_SWEEP_INTERVAL", "600"))
+
+# Per-session conversation state; card state is process-wide and lives in the card store
+CONVERSATION_KEYS = ["chat_history", "end_conversation", "last_intent", "history_cursor", "turn_timings"]
+SESSION_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+class LiveCardSession(SimpleNamespace):
+    # Session view for API turns: card state is read live from the card store instead of being copied
+    # into every session, so a turn costs the same with ten cards or a million
+    @property
+    def card_states(self):
+        return get_card_store().card_states
+
+    @property
+    def card_action_history(self):
+        return get_card_store().card_action_history
+
+def new_conversation() -> dict:
+    # Also sweeps spill files a crashed worker never discarded
+    prune_spill_files_in_background()
+    return {"chat_history": ChatHistory().to_state(), "end_conversation": False, "last_intent": None, "history_cursor": None,
+            "turn_timings": None, "updated_at": time.time()}
+
+def session_from_state(state: dict) -> LiveCardSession:
+    session = LiveCardSession(**{key: state.get(key) for key in CONVERSATION_KEYS})
+    # Only the in-memory window is stored with the session, so loading and saving cost the same on every turn
+    session.chat_history = ChatHistory.from_state(state["chat_history"])
+    return session
+
+def discard_state(state: dict):
+    # Removes the session's spilled chat history along with the session
+    ChatHistory.from_state(state["chat_history"]).discard()
+
+def state_from_session(session) -> dict:
+    state = {key: getattr(session, key) for key in CONVERSATION_KEYS}
+    state["chat_history"] = session.chat_history.to_state()
+    state["updated_at"] = time.time()
+    return state
+
+class MemorySessionStore:
+    def __init__(self, ttl: float = API_SESSION_TTL):
+        self.ttl = ttl
+        self._sessions = {}
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for session_id in [key for key, state in self._sessions.items() if state["updated_at"] < cutoff]:
+            discard_state(self._sessions.pop(session_id))
+
+    async def create(self) -> str:
+        self._expire()
+        session_id = uuid.uuid4().hex
+        self._sessions[session_id] = new_conversation()
+        return session_id
+
+    async def load(self, session_id: str):
+        state = self._sessions.get(session_id)
+        if state is None or state["updated_at"] < time.time() - self.ttl:
+            return None
+        return state
+
+    async def save(self, session_id: str, state: dict):
+        self._sessions[session_id] = state
+
+    async def delete(self, session_id: str) -> bool:
+        state = self._sessions.pop(session_id, None)
+        if state is None:
+            return False
+        discard_state(state)
+        return True
+
+class FileSessionStore:
+    # Whole-file atomic replaces, so readers in other workers never see a partial session.
+    # Two workers serving the same session at the same time: the last turn to finish wins.
+    def __init__(self, directory: str = API_SESSION_DIR, ttl: float = API_SESSION_TTL,
+                 sweep_interval: float = API_SESSION_SWEEP_INTERVAL):
+        self.directory = directory
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._last_sweep = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, session_id: str) -> str:
+        if not SESSION_ID_PATTERN.match(session_id):
+            raise KeyError(session_id)
+        return os.path.join(self.directory, f"{session_id}.json")
+
+    def _read(self, session_id: str):
+        try:
+            with open(self._path(session_id), "r") as f:
+                state = json.load(f)
+        except (FileNotFoundError, KeyError):
+            return None
+        return state if state["updated_at"] >= time.time() - self.ttl else None
+
+    def _write(self, session_id: str, state: dict):
+        path = self._path(session_id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    def _remove(self, session_id: str) -> bool:
+        try:
+            path = self._path(session_id)
+            with open(path, "r") as f:
+                discard_state(json.load(f))
+            os.remove(path)
+            return True
+        except (FileNotFoundError, KeyError):
+            return False
+
+    def _expire(self) -> int:
+        # Every save rewrites the file, so an mtime older than the TTL marks a candidate; updated_at decides.
+        # Workers may sweep at the same time, a file already gone is skipped
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for entry in list(os.scandir(self.directory)):
+            try:
+                if entry.stat().st_mtime >= cutoff:
+                    continue
+                if entry.name.endswith(".tmp"):
+                    # Left by a worker that died between write and replace
+                    os.remove(entry.path)
+                    continue
+                if not entry.name.endswith(".json"):
+                    continue
+                with open(entry.path, "r") as f:
+                    state = json.load(f)
+                if state["updated_at"] >= cutoff:
+                    continue
+                discard_state(state)
+                os.remove(entry.path)
+                removed += 1
+            except (OSError, ValueError, KeyError) as e:
+                if not isinstance(e, FileNotFoundError):
+                    setup_logger().warning(f"Could not expire session file {entry.path}: {e}")
+        if removed:
+            setup_logger().info(f"Removed {removed} expired sessions from {self.directory}")
+        return removed
+
+    async def create(self) -> str:
+        if time.time() - self._last_sweep >= self.sweep_interval:
+            self._last_sweep = time.time()
+            asyncio.get_running_loop().run_in_executor(None, self._expire)
+        session_id = uuid.uuid4().hex
+        await self.save(session_id, new_conversation())
+        return session_id
+
+    async def load(self, session_id: str):
+        return await asyncio.get_running_loop().run_in_executor(None, self._read, session_id)
+
+    async def save(self, session_id: str, state: dict):
+        await asyncio.get_running_loop().run_in_executor(None, self._write, session_id, state)
+
+    async def delete(self, session_id: str) -> bool:
+        return await asyncio.get_running_loop().run_in_executor(None, self._remove, session_id)
+
+def create_session_store(kind: str = API_SESSION_STORE):
+    logger = setup_logger()
+    if kind == "memory":
+        store = MemorySessionStore()
+    elif kind == "file":
+        store = FileSessionStore()
+    else:
+        raise ValueError(f"Unknown session store: {kind}")
+    logger.info(f"Using {type(store).__name__} for API sessions")
+    return store
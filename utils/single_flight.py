@@ -0,0 +1,191 @@
+import asyncio
+import contextvars
+import hashlib
+import json
+import os
+import numpy as np
+from utils.logger import setup_logger
+from utils.metrics import Counter
+
+# Identical upstream calls that overlap in time share one request; set to false to send every call upstream
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "true").lower() in ("1", "true", "yes")
+
+single_flight_calls = Counter(
+    "cardassist_single_flight_total", "Upstream calls by single-flight outcome (leader or coalesced).", ("call", "result")
+)
+
+# Whether the caller's most recent single-flight call joined another caller's request
+_coalesced = contextvars.ContextVar("single_flight_coalesced", default=False)
+
+def was_coalesced() -> bool:
+    return _coalesced.get()
+
+def _default(value):
+    if isinstance(value, np.ndarray):
+        return {"ndarray": hashlib.sha256(np.ascontiguousarray(value, dtype=np.float32).tobytes()).hexdigest()}
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    if hasattr(value, "as_dict"):
+        return value.as_dict()
+    return repr(value)
+
+def call_key(call: str, **kwargs) -> str:
+    # Normalised request fingerprint: keyword order and float vector formatting do not matter
+    payload = json.dumps(kwargs, sort_keys=True, default=_default, separators=(",", ":"))
+    return f"{call}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+class _SharedStream:
+    # Items produced by one upstream stream, replayed to every caller that joins while it is running
+    def __init__(self, source):
+        self.items = []
+        self.done = False
+        self.error = None
+        self._changed = asyncio.Condition()
+        self.task = asyncio.ensure_future(self._pump(source))
+
+    async def _pump(self, source):
+        try:
+            async for item in source:
+                self.items.append(item)
+                async with self._changed:
+                    self._changed.notify_all()
+        except BaseException as e:
+            self.error = e
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        finally:
+            self.done = True
+            async with self._changed:
+                self._changed.notify_all()
+
+    async def follow(self):
+        position = 0
+        while True:
+            while position < len(self.items):
+                yield self.items[position]
+                position += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            async with self._changed:
+                await self._changed.wait_for(lambda: position < len(self.items) or self.done)
+
+class SingleFlight:
+    # Process-wide: callers on the shared event loop with the same key await one upstream call.
+    # The upstream call is shielded, so a caller that gives up does not cancel it for the others.
+    def __init__(self, enabled: bool = SINGLE_FLIGHT):
+        self.enabled = enabled
+        self._calls = {}
+
+    def _join(self, call: str, key: str, start):
+        entry = self._calls.get(key)
+        if entry is None:
+            entry = self._calls[key] = start()
+            done = entry.task if isinstance(entry, _SharedStream) else entry
+            done.add_done_callback(lambda _: self._calls.get(key) is entry and self._calls.pop(key))
+            single_flight_calls.inc(call=call, result="leader")
+            _coalesced.set(False)
+        else:
+            single_flight_calls.inc(call=call, result="coalesced")
+            _coalesced.set(True)
+        return entry
+
+    async def do(self, call: str, key: str, factory):
+        # factory() returns a coroutine; every caller gets its result or exception
+        if not self.enabled:
+            _coalesced.set(False)
+            return await factory()
+
+        def start():
+            task = asyncio.ensure_future(factory())
+            # Retrieve the outcome even if every caller gave up, so it is never reported as unhandled
+            task.add_done_callback(lambda task: task.cancelled() or task.exception())
+            return task
+
+        return await asyncio.shield(self._join(call, key, start))
+
+    async def stream(self, call: str, key: str, factory):
+        # factory() returns a coroutine resolving to an async iterable; callers that join mid-stream
+        # first receive the items already produced
+        if not self.enabled:
+            _coalesced.set(False)
+            return await factory()
+
+        async def source():
+            async for item in await factory():
+                yield item
+
+        return self._join(call, key, lambda: _SharedStream(source())).follow()
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+single_flight = SingleFlight()
+
+async def _iterate(results: list):
+    for result in results:
+        yield result
+
+class SingleFlightSearchClient:
+    # Azure aio SearchClient contract; identical concurrent searches share one request and its materialised hits
+    def __init__(self, client, flights: SingleFlight = single_flight):
+        self.client = client
+        self.flights = flights
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def __len__(self):
+        return len(self.client)
+
+    async def search(self, search_text: str = None, vector_queries: list = None, top: int = None, **kwargs):
+        async def fetch():
+            results = await self.client.search(search_text=search_text, vector_queries=vector_queries, top=top, **kwargs)
+            return [result async for result in results]
+
+        key = call_key("search", search_text=search_text, vector_queries=vector_queries, top=top, **kwargs)
+        return _iterate(await self.flights.do("search", key, fetch))
+
+class _SingleFlightCompletions:
+    def __init__(self, completions, flights: SingleFlight):
+        self.completions = completions
+        self.flights = flights
+
+    def __getattr__(self, name):
+        return getattr(self.completions, name)
+
+    async def create(self, **kwargs):
+        # Responses and streamed chunks are shared between callers and must be treated as read-only
+        key = call_key("chat", **kwargs)
+        if kwargs.get("stream"):
+            return await self.flights.stream("chat_stream", key, lambda: self.completions.create(**kwargs))
+        return await self.flights.do("chat", key, lambda: self.completions.create(**kwargs))
+
+class _SingleFlightChat:
+    def __init__(self, chat, flights: SingleFlight):
+        self.chat = chat
+        self.completions = _SingleFlightCompletions(chat.completions, flights)
+
+    def __getattr__(self, name):
+        return getattr(self.chat, name)
+
+class SingleFlightOpenAI:
+    # AsyncOpenAI with chat.completions.create coalesced; everything else goes straight to the client
+    def __init__(self, client, flights: SingleFlight = single_flight):
+        self.client = client
+        self.chat = _SingleFlightChat(client.chat, flights)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+def coalesce_search(client):
+    if not single_flight.enabled or client is None or isinstance(client, SingleFlightSearchClient):
+        return client
+    return SingleFlightSearchClient(client)
+
+def coalesce_openai(client):
+    if not single_flight.enabled or client is None or isinstance(client, SingleFlightOpenAI):
+        return client
+    setup_logger().debug("Coalescing identical in-flight OpenAI and search calls")
+    return SingleFlightOpenAI(client)
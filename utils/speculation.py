@@ -0,0 +1,76 @@
+import asyncio
+import os
+import threading
+import time
+from utils.metrics import speculation_saved_seconds, speculation_total
+
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "false").lower() in ("1", "true", "yes")
+
+class SpeculationStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record_hit(self, saved_seconds: float):
+        with self._lock:
+            self.hits += 1
+            self.saved_seconds += saved_seconds
+        speculation_total.inc(result="hit")
+        speculation_saved_seconds.observe(saved_seconds)
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+        speculation_total.inc(result="miss")
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hit_rate,
+                "saved_seconds_total": self.saved_seconds,
+                "saved_seconds_avg": self.saved_seconds / self.hits if self.hits else 0.0,
+            }
+
+speculation_stats = SpeculationStats()
+
+class Speculation:
+    # Work started before we know whether it is needed; commit() keeps it, discard() cancels it
+    def __init__(self, coro, stats: SpeculationStats = speculation_stats):
+        self.stats = stats
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+        self._coro = coro
+        self._started = False
+        self.task = asyncio.ensure_future(self._run(coro))
+        # Consume the outcome so a failed or discarded speculation never logs "exception was never retrieved"
+        self.task.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+    async def _run(self, coro):
+        self._started = True
+        try:
+            return await coro
+        finally:
+            self.finished_at = time.perf_counter()
+
+    def commit(self):
+        # Saved latency is the speculative work already done by the time the decision arrived
+        now = time.perf_counter()
+        saved = min(now, self.finished_at or now) - self.started_at
+        self.stats.record_hit(saved)
+        return self.task, saved
+
+    def discard(self):
+        self.task.cancel()
+        if not self._started:
+            # Cancelled before its first step: the wrapped coroutine would otherwise never be awaited
+            self._coro.close()
+        self.stats.record_miss()
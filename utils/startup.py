@@ -0,0 +1,18 @@
+import time
+from contextlib import contextmanager
+from utils.logger import setup_logger
+from utils.metrics import observe_stage
+
+# Seconds spent in each start-up phase of this process, in the order they finished
+startup_timings = {}
+
+@contextmanager
+def startup_phase(name: str):
+    logger = setup_logger()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = time.perf_counter() - start
+        observe_stage(f"startup.{name}", startup_timings[name])
+        logger.info(f"Startup phase {name} took {startup_timings[name]:.2f}s")
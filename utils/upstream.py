@@ -0,0 +1,395 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import random
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from utils.context_builder import count_tokens
+from utils.logger import setup_logger
+from utils.metrics import Counter, Gauge, Histogram
+
+# Limits per upstream; 0 disables a limit. Requests/tokens per minute should match the deployment's quota.
+OPENAI_RPM = float(os.getenv("OPENAI_RPM", "500"))
+OPENAI_TPM = float(os.getenv("OPENAI_TPM", "80000"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+# Completion tokens reserved against the TPM budget when a request does not set max_tokens
+OPENAI_COMPLETION_ESTIMATE = int(os.getenv("OPENAI_COMPLETION_ESTIMATE", "300"))
+SEARCH_RPM = float(os.getenv("SEARCH_RPM", "0"))
+SEARCH_MAX_CONCURRENCY = int(os.getenv("SEARCH_MAX_CONCURRENCY", "32"))
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "4"))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.5"))
+UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", "20"))
+
+# Lower runs first: intent classification and search are short and block the turn,
+# knowledge generations are long, batch work yields to both
+PRIORITIES = {"interactive": 0, "generation": 1, "batch": 2}
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+upstream_queue_depth = Gauge("cardassist_upstream_queue_depth", "Calls waiting for an upstream slot.", ("upstream",))
+upstream_in_flight = Gauge("cardassist_upstream_in_flight", "Calls currently holding an upstream slot.", ("upstream",))
+upstream_wait_seconds = Histogram("cardassist_upstream_wait_seconds", "Time spent queued before an upstream call.",
+                                  ("upstream", "priority"))
+upstream_retries = Counter("cardassist_upstream_retries_total", "Upstream calls retried, by reason.", ("upstream", "reason"))
+upstream_failures = Counter("cardassist_upstream_failures_total", "Upstream calls that failed after retries.", ("upstream",))
+
+_priority = contextvars.ContextVar("upstream_priority", default="interactive")
+
+@contextmanager
+def priority(name: str):
+    # Upstream calls made inside the block are queued with this priority class. A block can lower the
+    # priority it runs under but not raise it, so a generation inside a batch job stays batch work.
+    current = _priority.get()
+    token = _priority.set(max(name, current, key=lambda value: PRIORITIES.get(value, 1)))
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+class TokenBucket:
+    def __init__(self, per_minute: float, capacity: float = None):
+        self.rate = per_minute / 60.0
+        # One minute's worth by default, so a full budget can be spent in a burst after idling
+        self.capacity = capacity if capacity is not None else per_minute
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        # Requests larger than the bucket are let through once it is full rather than never
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+    def adjust(self, amount: float):
+        # Positive charges more, negative refunds; the level may go below zero, delaying later requests
+        self.level = min(self.capacity, self.level - amount)
+
+def _status_code(error):
+    for value in (getattr(error, "status_code", None), getattr(getattr(error, "response", None), "status_code", None)):
+        if isinstance(value, int):
+            return value
+    return None
+
+def _retry_after(error):
+    # Seconds from Retry-After / retry-after-ms headers, if the error carries a response
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def _retry_reason(error):
+    status = _status_code(error)
+    if status is not None:
+        return str(status) if status in RETRYABLE_STATUS else None
+    # Connection resets and timeouts (openai.APIConnectionError, azure ServiceRequestError, asyncio timeouts)
+    name = type(error).__name__
+    if isinstance(error, (ConnectionError, asyncio.TimeoutError)) or any(
+            marker in name for marker in ("Connection", "Timeout", "ServiceRequest", "ServiceResponse")):
+        return "connection"
+    return None
+
+class UpstreamScheduler:
+    # One per upstream service and process. Calls wait in a priority queue until a concurrency slot and
+    # request/token budget are free; retryable failures back off with jitter, and a Retry-After from a
+    # throttled call pauses every queued call, not just the one that hit it.
+    def __init__(self, name: str, rpm: float = 0, tpm: float = 0, max_concurrency: int = 0,
+                 max_retries: int = UPSTREAM_MAX_RETRIES, backoff_base: float = UPSTREAM_BACKOFF_BASE,
+                 backoff_max: float = UPSTREAM_BACKOFF_MAX):
+        self.name = name
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.active = 0
+        self.paused_until = 0.0
+        self._queue = []
+        self._sequence = itertools.count()
+        self._timer = None
+        self.logger = setup_logger()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def _dispatch(self):
+        self._timer = None
+        while self._queue:
+            _, _, future, cost = self._queue[0]
+            if future.done():
+                # Cancelled while queued
+                heapq.heappop(self._queue)
+                continue
+            if self.max_concurrency and self.active >= self.max_concurrency:
+                break
+            now = time.monotonic()
+            wait = max(
+                self.paused_until - now,
+                self.requests.wait_time(1, now) if self.requests else 0.0,
+                self.tokens.wait_time(cost, now) if self.tokens else 0.0,
+            )
+            if wait > 0:
+                # Nothing behind the head may overtake it on budget, or large requests would starve
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                break
+            heapq.heappop(self._queue)
+            if self.requests:
+                self.requests.take(1)
+            if self.tokens:
+                self.tokens.take(cost)
+            self.active += 1
+            future.set_result(None)
+        upstream_queue_depth.set(len(self._queue), upstream=self.name)
+        upstream_in_flight.set(self.active, upstream=self.name)
+
+    def _schedule(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._dispatch()
+
+    async def acquire(self, cost: float = 0, priority_class: str = None):
+        priority_class = priority_class or _priority.get()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (PRIORITIES.get(priority_class, 1), next(self._sequence), future, cost))
+        started = time.perf_counter()
+        self._schedule()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted and cancelled in the same step: hand the slot back
+                self.release()
+            raise
+        upstream_wait_seconds.observe(time.perf_counter() - started, upstream=self.name, priority=priority_class)
+
+    def release(self):
+        self.active -= 1
+        self._schedule()
+
+    def settle(self, cost: float, used):
+        # Replace the estimate charged at dispatch with the tokens the upstream reported
+        if not self.tokens or used is None:
+            return
+        self.tokens.adjust(used - min(cost, self.tokens.capacity))
+        self._schedule()
+
+    def backoff(self, attempt: int) -> float:
+        # Full jitter: uniform in [0, min(max, base * 2^attempt)]
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def call(self, factory, cost: float = 0, priority_class: str = None, hold=None):
+        # factory() returns a coroutine for one attempt. hold(result) may return an async iterator that keeps
+        # the slot until it is exhausted, for streamed responses.
+        attempt = 0
+        while True:
+            await self.acquire(cost, priority_class)
+            released = False
+            try:
+                result = await factory()
+                if hold is not None:
+                    released = True
+                    return hold(result, self.release)
+                return result
+            except Exception as e:
+                reason = _retry_reason(e)
+                if reason is None or attempt >= self.max_retries:
+                    if reason is not None:
+                        upstream_failures.inc(upstream=self.name)
+                    raise
+                retry_after = _retry_after(e)
+                delay = retry_after if retry_after is not None else self.backoff(attempt)
+                if reason == "429":
+                    self.paused_until = max(self.paused_until, time.monotonic() + delay)
+                upstream_retries.inc(upstream=self.name, reason=reason)
+                self.logger.warning(f"{self.name} call failed ({reason}), retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+            finally:
+                if not released:
+                    self.release()
+            attempt += 1
+            await asyncio.sleep(delay)
+
+class _HeldStream:
+    # Keeps the upstream slot while the caller reads a streamed response. The slot is released exactly once:
+    # when the stream ends or fails, on aclose(), or when a stream that was never read is garbage collected.
+    def __init__(self, stream, release, on_usage=None):
+        self.stream = stream
+        self._release = release
+        self.on_usage = on_usage
+        self._iterator = None
+        self._closed = False
+        self._loop = asyncio.get_running_loop()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._closed:
+            raise StopAsyncIteration
+        if self._iterator is None:
+            self._iterator = self.stream.__aiter__()
+        try:
+            item = await self._iterator.__anext__()
+        except BaseException:
+            await self.aclose()
+            raise
+        usage = getattr(item, "usage", None)
+        if usage is not None and self.on_usage is not None:
+            self.on_usage(usage)
+        return item
+
+    async def aclose(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            # An abandoned stream would otherwise keep its HTTP connection until garbage collection
+            close = getattr(self.stream, "close", None)
+            if close is not None:
+                await close()
+        finally:
+            self._release()
+
+    # Same call as openai's AsyncStream.close
+    close = aclose
+
+    def __del__(self):
+        if self._closed:
+            return
+        self._closed = True
+        # The finaliser may run outside the loop; the HTTP response is left to its own finaliser
+        if not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._release)
+
+def _used_tokens(usage):
+    total = getattr(usage, "total_tokens", None)
+    if total is None and usage is not None:
+        total = (getattr(usage, "prompt_tokens", None) or 0) + (getattr(usage, "completion_tokens", None) or 0)
+    return total or None
+
+def _estimate_tokens(kwargs: dict) -> float:
+    prompt = sum(count_tokens(str(message.get("content") or "")) for message in kwargs.get("messages", []))
+    return prompt + (kwargs.get("max_tokens") or OPENAI_COMPLETION_ESTIMATE)
+
+class _ScheduledCompletions:
+    def __init__(self, completions, scheduler: UpstreamScheduler):
+        self.completions = completions
+        self.scheduler = scheduler
+
+    def __getattr__(self, name):
+        return getattr(self.completions, name)
+
+    async def create(self, **kwargs):
+        # Only opening the stream is retried; a stream that fails midway surfaces to the caller
+        cost = _estimate_tokens(kwargs)
+        if kwargs.get("stream"):
+            # The usage chunk (stream_options include_usage) arrives last and settles the TPM charge
+            def hold(stream, release):
+                return _HeldStream(stream, release, lambda usage: self.scheduler.settle(cost, _used_tokens(usage)))
+
+            return await self.scheduler.call(lambda: self.completions.create(**kwargs), cost=cost, hold=hold)
+        response = await self.scheduler.call(lambda: self.completions.create(**kwargs), cost=cost)
+        self.scheduler.settle(cost, _used_tokens(getattr(response, "usage", None)))
+        return response
+
+class _ScheduledChat:
+    def __init__(self, chat, scheduler: UpstreamScheduler):
+        self.chat = chat
+        self.completions = _ScheduledCompletions(chat.completions, scheduler)
+
+    def __getattr__(self, name):
+        return getattr(self.chat, name)
+
+class _ScheduledModels:
+    def __init__(self, models, scheduler: UpstreamScheduler):
+        self.models = models
+        self.scheduler = scheduler
+
+    def __getattr__(self, name):
+        return getattr(self.models, name)
+
+    async def list(self, **kwargs):
+        # The health probe; with max_retries=0 on the client, its retries come from here
+        return await self.scheduler.call(lambda: self.models.list(**kwargs), priority_class="interactive")
+
+class ScheduledOpenAI:
+    # AsyncOpenAI with chat.completions.create and models.list going through the scheduler; configure the
+    # client with max_retries=0
+    def __init__(self, client, scheduler: UpstreamScheduler):
+        self.client = client
+        self.scheduler = scheduler
+        self.chat = _ScheduledChat(client.chat, scheduler)
+        self.models = _ScheduledModels(client.models, scheduler)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+async def _iterate(results: list):
+    for result in results:
+        yield result
+
+class ScheduledSearchClient:
+    # Azure aio SearchClient contract. Results are read inside the slot, since the aio pager only sends the
+    # request when iterated, and the short hit list is replayed to the caller.
+    def __init__(self, client, scheduler: UpstreamScheduler):
+        self.client = client
+        self.scheduler = scheduler
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def __len__(self):
+        return len(self.client)
+
+    async def search(self, search_text: str = None, vector_queries: list = None, top: int = None, **kwargs):
+        async def fetch():
+            results = await self.client.search(search_text=search_text, vector_queries=vector_queries, top=top, **kwargs)
+            return [result async for result in results]
+
+        return _iterate(await self.scheduler.call(fetch, priority_class="interactive"))
+
+    async def get_document_count(self, **kwargs):
+        # The health probe; the query client is built with retry_total=0, so its retries come from here
+        return await self.scheduler.call(lambda: self.client.get_document_count(**kwargs), priority_class="interactive")
+
+_schedulers = {}
+
+def get_scheduler(name: str) -> UpstreamScheduler:
+    # Process-wide, so every session shares one budget per upstream
+    if name not in _schedulers:
+        if name == "openai":
+            _schedulers[name] = UpstreamScheduler(name, OPENAI_RPM, OPENAI_TPM, OPENAI_MAX_CONCURRENCY)
+        elif name == "search":
+            _schedulers[name] = UpstreamScheduler(name, SEARCH_RPM, 0, SEARCH_MAX_CONCURRENCY)
+        else:
+            raise ValueError(f"Unknown upstream: {name}")
+    return _schedulers[name]
+
+def schedule_openai(client):
+    if client is None or isinstance(client, ScheduledOpenAI):
+        return client
+    return ScheduledOpenAI(client, get_scheduler("openai"))
+
+def schedule_search(client):
+    if client is None or isinstance(client, ScheduledSearchClient):
+        return client
+    return ScheduledSearchClient(client, get_scheduler("search"))